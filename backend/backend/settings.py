@@ -30,6 +30,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'ecommerce',
     'rest_framework_simplejwt',
     'rest_framework.authtoken',
@@ -86,9 +87,40 @@ DATABASES = {
     }
 }
 
+# Per-process cache; point this at a shared backend (redis/memcached) when
+# running several workers so catalog version bumps are seen by all of them.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'ecommerce-default',
+    }
+}
+PRODUCT_LIST_CACHE_TIMEOUT = 300
+
+# how long stock stays held for an unpaid order
+STOCK_RESERVATION_MINUTES = 15
+
+# stored responses for Idempotency-Key retries of create-order / verify-payment
+IDEMPOTENCY_KEY_TTL_HOURS = 24
+IDEMPOTENCY_LRU_SIZE = 1024
+# a key whose request died without storing a response is free again after this
+IDEMPOTENCY_LEASE_SECONDS = 60
+
+# bulk product import: rows per bulk_create and concurrent image downloads
+PRODUCT_IMPORT_BATCH_SIZE = 500
+PRODUCT_IMPORT_IMAGE_WORKERS = 4
+
+# "stateless" builds request.user from the access token and reads the users
+# row only when a view needs more than the id; "db" loads it on every request
+JWT_AUTH_MODE = os.environ.get('JWT_AUTH_MODE', 'stateless')
+JWT_USER_CACHE_SECONDS = 30
+JWT_USER_CACHE_SIZE = 10000
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'ecommerce.authentication.ClaimsJWTAuthentication'
+        if JWT_AUTH_MODE == 'stateless'
+        else 'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.AllowAny',
@@ -99,7 +131,11 @@ SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
     'AUTH_HEADER_TYPES': ('Bearer',),
+    # re-stamps the role claims on every refresh
+    'TOKEN_REFRESH_SERIALIZER': 'ecommerce.roles.RoleTokenRefreshSerializer',
 }
+# how long a process trusts its cached RoleVersion before re-reading it
+ROLE_VERSION_CACHE_SECONDS = 60
 
 
 # Password validation
@@ -162,13 +198,20 @@ CORS_ALLOW_CREDENTIALS = True  # for frontend to send cookies or authentication
 CSRF_TRUSTED_ORIGINS = ["http://localhost:3000", "http://localhost:3001"]  # for session-based authentication
 
 # Email Configuration
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+EMAIL_BACKEND = os.environ.get('EMAIL_BACKEND', 'django.core.mail.backends.smtp.EmailBackend')
 EMAIL_HOST = 'smtp.gmail.com'
 EMAIL_PORT = 587
 EMAIL_USE_TLS = True
 EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD')
 
+# Email outbox: "thread" drains it in-process after each commit, "command" leaves it to send_outbox_emails
+EMAIL_OUTBOX_MODE = os.environ.get('EMAIL_OUTBOX_MODE', 'thread')
+EMAIL_OUTBOX_WORKERS = 2  # max concurrent SMTP connections per process
+EMAIL_OUTBOX_BATCH_SIZE = 50
+EMAIL_OUTBOX_MAX_ATTEMPTS = 6
+EMAIL_OUTBOX_RETRY_SECONDS = 30  # doubled after every failed attempt
+
 AWS_ACCESS_KEY_ID = os.environ.get('AWS_ACCESS_KEY_ID','')
 AWS_SECRET_ACCESS_KEY = os.environ.get('AWS_SECRET_ACCESS_KEY','')
 AWS_STORAGE_BUCKET_NAME = os.environ.get('AWS_STORAGE_BUCKET_NAME','')
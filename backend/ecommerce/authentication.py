@@ -0,0 +1,107 @@
+"""
+Stateless JWT authentication.
+
+JWTAuthentication loads the User row on every request, although most API
+views only use request.user.id. ClaimsJWTAuthentication returns a ClaimsUser
+built from the token's user id. The row comes from a small per-process
+cache shared by all requests of that user for JWT_USER_CACHE_SECONDS, so it
+is read from the database at most once in that time; it is used to turn
+away deleted and inactive users, and copied onto the ClaimsUser only when a
+view touches a column other than the id.
+
+A user deleted or deactivated through another process is noticed once the
+cached row expires; role changes are caught through the role claims (see
+roles.py).
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import ClaimsUser
+
+USER_ATTNAMES = [field.attname for field in User._meta.concrete_fields]
+
+
+class UserCache:
+    """Thread-safe LRU of user column values with a fixed time to live."""
+
+    def __init__(self, max_size=10000, ttl=30):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            expires_at, values = entry
+            if expires_at <= time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return values
+
+    def set(self, user_id, values):
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, values)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def forget(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+user_cache = UserCache(
+    getattr(settings, "JWT_USER_CACHE_SIZE", 10000),
+    getattr(settings, "JWT_USER_CACHE_SECONDS", 30),
+)
+
+
+def cached_user_values(user_id):
+    """Column values of a user by attname, None if the user is gone."""
+    values = user_cache.get(user_id)
+    if values is None:
+        values = User.objects.filter(pk=user_id).values(*USER_ATTNAMES).first()
+        if values is not None:
+            user_cache.set(user_id, values)
+    return values
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def forget_cached_user(sender, instance, **kwargs):
+    # no sender filter: saves through ClaimsUser are sent with the proxy class
+    if isinstance(instance, User):
+        user_cache.forget(instance.pk)
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        try:
+            user_id = int(validated_token[api_settings.USER_ID_CLAIM])
+        except (KeyError, TypeError, ValueError) as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+        values = cached_user_values(user_id)
+        if values is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        if api_settings.CHECK_USER_IS_ACTIVE and not values["is_active"]:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        return ClaimsUser.from_db(DEFAULT_DB_ALIAS, ["id"], [user_id])
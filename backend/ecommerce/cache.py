@@ -0,0 +1,132 @@
+import hashlib
+import time
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+CATALOG_VERSION_KEY = "catalog:version"
+OFFER_VERSION_KEY = "offer:version"
+
+# query params that change what product_list returns, everything else is ignored
+PRODUCT_LIST_PARAMS = (
+    "category", "min_price", "max_price", "search", "sort",
+    "page", "page_size", "pagination", "cursor", "skip_count",
+)
+# the params a page link changes; the rest come from the normalized URL
+PAGE_LINK_PARAMS = ("page", "cursor")
+
+
+def _fresh_version():
+    # seeded from the clock so a counter lost to eviction or a restart can
+    # never come back at a number that older cached entries were stored under
+    return int(time.time() * 1000)
+
+
+def _version(key):
+    version = cache.get(key)
+    if version is None:
+        version = _fresh_version()
+        if not cache.add(key, version, timeout=None):
+            version = cache.get(key, version)
+    return version
+
+
+def _bump(key):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version = _fresh_version()
+        cache.set(key, version, timeout=None)
+        return version
+
+
+def catalog_version():
+    return _version(CATALOG_VERSION_KEY)
+
+
+def bump_catalog_version():
+    """
+    Invalidate every cached listing at once; old entries are simply never
+    read again and age out on their own timeout. The bump waits for the
+    current transaction to commit (it is immediate outside one): done any
+    earlier, a reader still seeing the old rows could cache them under the
+    new version.
+    """
+    transaction.on_commit(lambda: _bump(CATALOG_VERSION_KEY))
+
+
+def offer_version():
+    return _version(OFFER_VERSION_KEY)
+
+
+def bump_offer_version():
+    """Invalidate cached cart quotes after a coupon is created, edited or deleted."""
+    transaction.on_commit(lambda: _bump(OFFER_VERSION_KEY))
+
+
+def product_list_url(request):
+    """
+    The absolute listing URL with only the params that matter, normalized.
+    Cache keys and the page links in cached payloads are both built from it.
+    """
+    params = []
+    for name in PRODUCT_LIST_PARAMS:
+        value = request.query_params.get(name, "").strip()
+        if not value:
+            continue
+        if name in ("category", "search"):
+            value = " ".join(value.lower().split())
+        params.append((name, value))
+    return f"{request.scheme}://{request.get_host()}{request.path}?{urlencode(params)}"
+
+
+def product_list_cache_key(request):
+    # links in the paginated payload are absolute, so the host is part of the key
+    return "product_list:" + hashlib.sha1(product_list_url(request).encode()).hexdigest()
+
+
+def rebase_page_links(data, url):
+    """
+    Rebuild next/previous on `url`, keeping only each link's page or cursor,
+    so a cached page never carries params of the request that filled it.
+    """
+    for name in ("next", "previous"):
+        link = data.get(name)
+        if not link:
+            continue
+        query = parse_qs(urlsplit(link).query)
+        rebased = url
+        for param in PAGE_LINK_PARAMS:
+            if param in query:
+                rebased = replace_query_param(rebased, param, query[param][0])
+            else:
+                rebased = remove_query_param(rebased, param)
+        data[name] = rebased
+    return data
+
+
+def get_cached_product_list(key, version):
+    return cache.get(key, version=version)
+
+
+def set_cached_product_list(key, version, data):
+    # stored under the version read before the queryset ran. Versions only
+    # move after a write has committed, so a reader that got the new version
+    # also sees the new rows; a write committing mid-request can only orphan
+    # this entry under the old version, never leave stale rows under the new one
+    cache.set(
+        key, data,
+        timeout=getattr(settings, "PRODUCT_LIST_CACHE_TIMEOUT", 300),
+        version=version,
+    )
+
+
+def role_version_cache_key(user_id):
+    return f"role:version:{user_id}"
+
+
+def forget_role_version(user_id):
+    cache.delete(role_version_cache_key(user_id))
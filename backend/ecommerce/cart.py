@@ -0,0 +1,455 @@
+"""
+Cart and wishlist mutations as single SQL statements.
+
+Each helper resolves the product by public id inside the same statement
+and relies on the (user, product) unique constraints, so one request is one
+round trip and concurrent double clicks cannot lose an update. The same
+statement bumps the user's CartVersion and records the touched rows in
+CartChange, which is what delta sync reads. Deleting a product records it
+as removed for everyone who had it.
+"""
+from django.db import connection, transaction
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+
+from .models import CartChange, CartItem, CartVersion, Product, Wishlist
+
+PRODUCT_TABLE = Product._meta.db_table
+CART_TABLE = CartItem._meta.db_table
+WISHLIST_TABLE = Wishlist._meta.db_table
+VERSION_TABLE = CartVersion._meta.db_table
+CHANGE_TABLE = CartChange._meta.db_table
+
+
+def _log_changes_sql(kind, removed):
+    """
+    CTEs that bump the user's version and log every product_id returned by
+    the `changed` CTE. Nothing is bumped when `changed` is empty.
+    """
+    return f"""
+        bumped AS (
+            INSERT INTO {VERSION_TABLE} (user_id, version)
+            SELECT %(user_id)s, 1 FROM changed LIMIT 1
+            ON CONFLICT (user_id) DO UPDATE SET version = {VERSION_TABLE}.version + 1
+            RETURNING version
+        ), logged AS (
+            INSERT INTO {CHANGE_TABLE} (user_id, kind, product_id, public_product_id, version, removed)
+            SELECT %(user_id)s, '{kind}', changed.product_id, p.public_product_id, bumped.version, {removed}
+            FROM changed JOIN {PRODUCT_TABLE} p ON p.id = changed.product_id, bumped
+            ON CONFLICT (user_id, kind, product_id)
+            DO UPDATE SET version = EXCLUDED.version, removed = EXCLUDED.removed
+        )
+    """
+
+
+def _log_move_sql(to_kind, from_kind):
+    """
+    Like _log_changes_sql for items moved by the `moved` CTE: one version
+    bump, the item added to `to_kind` and removed from `from_kind`.
+    """
+    return f"""
+        bumped AS (
+            INSERT INTO {VERSION_TABLE} (user_id, version)
+            SELECT %(user_id)s, 1 FROM moved LIMIT 1
+            ON CONFLICT (user_id) DO UPDATE SET version = {VERSION_TABLE}.version + 1
+            RETURNING version
+        ), logged AS (
+            INSERT INTO {CHANGE_TABLE} (user_id, kind, product_id, public_product_id, version, removed)
+            SELECT %(user_id)s, k.kind, moved.product_id, p.public_product_id, bumped.version, k.removed
+            FROM moved JOIN {PRODUCT_TABLE} p ON p.id = moved.product_id, bumped,
+                 (VALUES ('{to_kind}', false), ('{from_kind}', true)) AS k(kind, removed)
+            ON CONFLICT (user_id, kind, product_id)
+            DO UPDATE SET version = EXCLUDED.version, removed = EXCLUDED.removed
+        )
+    """
+
+
+def _fetch_one(sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchone()
+
+
+def record_changes(user_id, changes):
+    """
+    Log (kind, product_id, removed) changes made through the ORM under one
+    new version, in a single statement.
+    """
+    if not changes:
+        return None
+    kinds, product_ids, removed = zip(*changes)
+    row = _fetch_one(
+        f"""
+        WITH bumped AS (
+            INSERT INTO {VERSION_TABLE} (user_id, version) VALUES (%(user_id)s, 1)
+            ON CONFLICT (user_id) DO UPDATE SET version = {VERSION_TABLE}.version + 1
+            RETURNING version
+        ), logged AS (
+            INSERT INTO {CHANGE_TABLE} (user_id, kind, product_id, public_product_id, version, removed)
+            SELECT %(user_id)s, c.kind, c.product_id, p.public_product_id, bumped.version, c.removed
+            FROM bumped, unnest(%(kinds)s::varchar[], %(product_ids)s::bigint[], %(removed)s::boolean[])
+                AS c(kind, product_id, removed)
+            JOIN {PRODUCT_TABLE} p ON p.id = c.product_id
+            ON CONFLICT (user_id, kind, product_id)
+            DO UPDATE SET version = EXCLUDED.version, removed = EXCLUDED.removed
+        )
+        SELECT version FROM bumped
+        """,
+        {"user_id": user_id, "kinds": list(kinds), "product_ids": list(product_ids), "removed": list(removed)},
+    )
+    return row[0]
+
+
+def product_exists(public_product_id):
+    # only consulted on the error path, to tell "no product" from "not in cart"
+    return Product.objects.filter(public_product_id=public_product_id, is_active=True).exists()
+
+
+def add_to_cart(user_id, public_product_id, quantity):
+    """Returns the new cart quantity, or None if the product does not exist."""
+    row = _fetch_one(
+        f"""
+        WITH changed AS (
+            INSERT INTO {CART_TABLE} (user_id, product_id, quantity)
+            SELECT %(user_id)s, p.id, %(quantity)s FROM {PRODUCT_TABLE} p
+            WHERE p.public_product_id = %(product)s AND p.is_active
+            ON CONFLICT (user_id, product_id)
+            DO UPDATE SET quantity = {CART_TABLE}.quantity + EXCLUDED.quantity
+            RETURNING product_id, quantity
+        ), {_log_changes_sql("cart", "false")}
+        SELECT quantity FROM changed
+        """,
+        {"user_id": user_id, "quantity": quantity, "product": public_product_id},
+    )
+    return row[0] if row else None
+
+
+def set_cart_quantity(user_id, public_product_id, quantity):
+    """Returns the new quantity, or None if the product is not in the cart."""
+    row = _fetch_one(
+        f"""
+        WITH changed AS (
+            UPDATE {CART_TABLE} c SET quantity = %(quantity)s
+            FROM {PRODUCT_TABLE} p
+            WHERE c.product_id = p.id AND c.user_id = %(user_id)s
+              AND p.public_product_id = %(product)s AND p.is_active
+            RETURNING c.product_id, c.quantity
+        ), {_log_changes_sql("cart", "false")}
+        SELECT quantity FROM changed
+        """,
+        {"user_id": user_id, "quantity": quantity, "product": public_product_id},
+    )
+    return row[0] if row else None
+
+
+def remove_from_cart(user_id, public_product_id):
+    """Returns True if a cart row was deleted."""
+    row = _fetch_one(
+        f"""
+        WITH changed AS (
+            DELETE FROM {CART_TABLE} c
+            USING {PRODUCT_TABLE} p
+            WHERE c.product_id = p.id AND c.user_id = %(user_id)s
+              AND p.public_product_id = %(product)s AND p.is_active
+            RETURNING c.product_id
+        ), {_log_changes_sql("cart", "true")}
+        SELECT product_id FROM changed
+        """,
+        {"user_id": user_id, "product": public_product_id},
+    )
+    return row is not None
+
+
+def clear_cart(user_id):
+    """Empty the cart after checkout. Returns the number of rows removed."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            WITH changed AS (
+                DELETE FROM {CART_TABLE} WHERE user_id = %(user_id)s
+                RETURNING product_id
+            ), {_log_changes_sql("cart", "true")}
+            SELECT count(*) FROM changed
+            """,
+            {"user_id": user_id},
+        )
+        return cursor.fetchone()[0]
+
+
+def add_to_wishlist(user_id, public_product_id):
+    """
+    Returns True if the item was added, False if it was already there and
+    None if the product does not exist.
+    """
+    row = _fetch_one(
+        f"""
+        WITH target AS (
+            SELECT p.id FROM {PRODUCT_TABLE} p
+            WHERE p.public_product_id = %(product)s AND p.is_active
+        ), changed AS (
+            INSERT INTO {WISHLIST_TABLE} (user_id, product_id)
+            SELECT %(user_id)s, target.id FROM target
+            ON CONFLICT (user_id, product_id) DO NOTHING
+            RETURNING product_id
+        ), {_log_changes_sql("wishlist", "false")}
+        SELECT EXISTS (SELECT 1 FROM target), EXISTS (SELECT 1 FROM changed)
+        """,
+        {"user_id": user_id, "product": public_product_id},
+    )
+    found, created = row
+    return created if found else None
+
+
+def remove_from_wishlist(user_id, public_product_id):
+    """Returns True if a wishlist row was deleted."""
+    row = _fetch_one(
+        f"""
+        WITH changed AS (
+            DELETE FROM {WISHLIST_TABLE} w
+            USING {PRODUCT_TABLE} p
+            WHERE w.product_id = p.id AND w.user_id = %(user_id)s
+              AND p.public_product_id = %(product)s AND p.is_active
+            RETURNING w.product_id
+        ), {_log_changes_sql("wishlist", "true")}
+        SELECT product_id FROM changed
+        """,
+        {"user_id": user_id, "product": public_product_id},
+    )
+    return row is not None
+
+
+def move_to_cart(user_id, public_product_id, quantity):
+    """
+    Move a wishlisted item into the cart, adding `quantity`. Returns the new
+    cart quantity, 0 if the item was not in the wishlist and None if the
+    product does not exist.
+    """
+    row = _fetch_one(
+        f"""
+        WITH target AS (
+            SELECT p.id FROM {PRODUCT_TABLE} p
+            WHERE p.public_product_id = %(product)s AND p.is_active
+        ), moved AS (
+            DELETE FROM {WISHLIST_TABLE} w
+            USING target
+            WHERE w.product_id = target.id AND w.user_id = %(user_id)s
+            RETURNING w.product_id
+        ), added AS (
+            INSERT INTO {CART_TABLE} (user_id, product_id, quantity)
+            SELECT %(user_id)s, product_id, %(quantity)s FROM moved
+            ON CONFLICT (user_id, product_id)
+            DO UPDATE SET quantity = {CART_TABLE}.quantity + EXCLUDED.quantity
+            RETURNING quantity
+        ), {_log_move_sql("cart", "wishlist")}
+        SELECT EXISTS (SELECT 1 FROM target), COALESCE((SELECT quantity FROM added), 0)
+        """,
+        {"user_id": user_id, "quantity": quantity, "product": public_product_id},
+    )
+    found, new_quantity = row
+    return new_quantity if found else None
+
+
+def move_to_wishlist(user_id, public_product_id):
+    """
+    Move a cart item to the wishlist. An item that is already wishlisted
+    stays in the cart. Returns (in_cart, moved), or None if the product does
+    not exist.
+    """
+    row = _fetch_one(
+        f"""
+        WITH target AS (
+            SELECT p.id FROM {PRODUCT_TABLE} p
+            WHERE p.public_product_id = %(product)s AND p.is_active
+        ), in_cart AS (
+            SELECT c.product_id FROM {CART_TABLE} c
+            JOIN target ON target.id = c.product_id
+            WHERE c.user_id = %(user_id)s
+        ), added AS (
+            INSERT INTO {WISHLIST_TABLE} (user_id, product_id)
+            SELECT %(user_id)s, product_id FROM in_cart
+            ON CONFLICT (user_id, product_id) DO NOTHING
+            RETURNING product_id
+        ), moved AS (
+            DELETE FROM {CART_TABLE} c
+            USING added
+            WHERE c.user_id = %(user_id)s AND c.product_id = added.product_id
+            RETURNING c.product_id
+        ), {_log_move_sql("wishlist", "cart")}
+        SELECT EXISTS (SELECT 1 FROM target), EXISTS (SELECT 1 FROM in_cart), EXISTS (SELECT 1 FROM moved)
+        """,
+        {"user_id": user_id, "product": public_product_id},
+    )
+    found, in_cart, moved = row
+    return (in_cart, moved) if found else None
+
+
+@receiver(pre_delete, sender=Product)
+def record_product_removed(sender, instance, **kwargs):
+    """
+    Log the product as removed from every cart and wishlist holding it,
+    before those rows cascade away, one version bump per affected user.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            WITH affected AS (
+                SELECT user_id, 'cart' AS kind FROM {CART_TABLE} WHERE product_id = %(product_id)s
+                UNION ALL
+                SELECT user_id, 'wishlist' FROM {WISHLIST_TABLE} WHERE product_id = %(product_id)s
+            ), bumped AS (
+                INSERT INTO {VERSION_TABLE} (user_id, version)
+                SELECT DISTINCT user_id, 1 FROM affected
+                ON CONFLICT (user_id) DO UPDATE SET version = {VERSION_TABLE}.version + 1
+                RETURNING user_id, version
+            )
+            INSERT INTO {CHANGE_TABLE} (user_id, kind, product_id, public_product_id, version, removed)
+            SELECT affected.user_id, affected.kind, %(product_id)s, %(public_id)s, bumped.version, true
+            FROM affected JOIN bumped ON bumped.user_id = affected.user_id
+            ON CONFLICT (user_id, kind, product_id)
+            DO UPDATE SET version = EXCLUDED.version, removed = EXCLUDED.removed
+            """,
+            {"product_id": instance.pk, "public_id": instance.public_product_id},
+        )
+
+
+def apply_batch(user, operations):
+    """
+    Apply a list of validated cart/wishlist operations in one transaction.
+
+    Products and the affected cart/wishlist rows are read once, the
+    operations are replayed in memory in order, and only the net difference
+    is written back with bulk statements, so the query count does not grow
+    with the number of operations. Returns a list of per-operation errors;
+    failing operations are skipped, the rest still apply.
+    """
+    public_ids = {operation["product_id"] for operation in operations}
+
+    with transaction.atomic():
+        products = dict(
+            Product.objects.filter(public_product_id__in=public_ids, is_active=True)
+            .values_list("public_product_id", "id")
+        )
+        current_cart = dict(
+            CartItem.objects.select_for_update()
+            .filter(user=user, product_id__in=products.values())
+            .values_list("product_id", "quantity")
+        )
+        current_wishlist = set(
+            Wishlist.objects.select_for_update()
+            .filter(user=user, product_id__in=products.values())
+            .values_list("product_id", flat=True)
+        )
+        cart_rows = dict(current_cart)
+        wishlist_rows = set(current_wishlist)
+
+        errors = []
+        for index, operation in enumerate(operations):
+            product_id = products.get(operation["product_id"])
+            error = None
+            if product_id is None:
+                error = "Product not found"
+            else:
+                error = _replay(operation, product_id, cart_rows, wishlist_rows)
+            if error:
+                errors.append({"index": index, "product_id": operation["product_id"], "error": error})
+
+        # rows read above are locked and get their final quantity; rows that
+        # did not exist yet were not locked, so a concurrent add may have
+        # created them since and the batch's quantity is added on top
+        updated = {
+            product_id: quantity for product_id, quantity in cart_rows.items()
+            if product_id in current_cart and current_cart[product_id] != quantity
+        }
+        if updated:
+            _set_cart_rows(user.id, updated)
+        inserted = {
+            product_id: quantity for product_id, quantity in cart_rows.items()
+            if product_id not in current_cart
+        }
+        if inserted:
+            _add_cart_rows(user.id, inserted)
+        removed_cart = current_cart.keys() - cart_rows.keys()
+        if removed_cart:
+            CartItem.objects.filter(user=user, product_id__in=removed_cart).delete()
+
+        added_wishlist = wishlist_rows - current_wishlist
+        if added_wishlist:
+            Wishlist.objects.bulk_create(
+                [Wishlist(user=user, product_id=product_id) for product_id in added_wishlist],
+                ignore_conflicts=True,
+            )
+        removed_wishlist = current_wishlist - wishlist_rows
+        if removed_wishlist:
+            Wishlist.objects.filter(user=user, product_id__in=removed_wishlist).delete()
+
+        record_changes(
+            user.id,
+            [("cart", product_id, False) for product_id in [*updated, *inserted]]
+            + [("cart", product_id, True) for product_id in removed_cart]
+            + [("wishlist", product_id, False) for product_id in added_wishlist]
+            + [("wishlist", product_id, True) for product_id in removed_wishlist],
+        )
+
+    return errors
+
+
+def _set_cart_rows(user_id, quantities):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            UPDATE {CART_TABLE} c SET quantity = v.quantity
+            FROM unnest(%s::bigint[], %s::integer[]) AS v(product_id, quantity)
+            WHERE c.user_id = %s AND c.product_id = v.product_id
+            """,
+            [list(quantities), list(quantities.values()), user_id],
+        )
+
+
+def _add_cart_rows(user_id, quantities):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {CART_TABLE} (user_id, product_id, quantity)
+            SELECT %s, v.product_id, v.quantity
+            FROM unnest(%s::bigint[], %s::integer[]) AS v(product_id, quantity)
+            ON CONFLICT (user_id, product_id)
+            DO UPDATE SET quantity = {CART_TABLE}.quantity + EXCLUDED.quantity
+            """,
+            [user_id, list(quantities), list(quantities.values())],
+        )
+
+
+def _replay(operation, product_id, cart_rows, wishlist_rows):
+    # mirrors the single item endpoints, including their error messages
+    op = operation["op"]
+    quantity = operation.get("quantity")
+
+    if op == "add":
+        cart_rows[product_id] = cart_rows.get(product_id, 0) + quantity
+    elif op == "update":
+        if product_id not in cart_rows:
+            return "Item not in cart"
+        cart_rows[product_id] = quantity
+    elif op == "remove":
+        if product_id not in cart_rows:
+            return "Item not in cart"
+        del cart_rows[product_id]
+    elif op == "wishlist_add":
+        wishlist_rows.add(product_id)
+    elif op == "wishlist_remove":
+        if product_id not in wishlist_rows:
+            return "Item not in wishlist"
+        wishlist_rows.discard(product_id)
+    elif op == "move_to_cart":
+        if product_id not in wishlist_rows:
+            return "Item not in wishlist"
+        cart_rows[product_id] = cart_rows.get(product_id, 0) + quantity
+        wishlist_rows.discard(product_id)
+    elif op == "move_to_wishlist":
+        if product_id not in cart_rows:
+            return "Item not in cart"
+        # like transfer_to_wishlist, an item already wishlisted stays in the cart
+        if product_id not in wishlist_rows:
+            wishlist_rows.add(product_id)
+            del cart_rows[product_id]
+    return None
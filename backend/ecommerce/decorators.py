@@ -1,15 +1,14 @@
 from django.http import HttpResponse
 from django.contrib.auth.decorators import login_required
 
+from .roles import request_role, role_required
+
 def allowed_users(allowed_roles=[]):
     def decorator(view_func):
         @login_required(login_url="/login/")
         def wrapper_func(request, *args, **kwargs):
-            group = None
-            if request.user.groups.exists():
-                group = request.user.groups.all()[0].name
-
-            if group in allowed_roles:
+            # role claim for JWT requests, a single group query for sessions
+            if request_role(request) in allowed_roles:
                 return view_func(request, *args, **kwargs)
             else:
                 return HttpResponse("You are not authorized to view this page.")
@@ -0,0 +1,201 @@
+"""
+Idempotency-Key support for endpoints that must not run twice.
+
+The first request with a key claims a row in IdempotencyRecord and its
+response is stored there; retries with the same key get the stored response
+back from a single indexed lookup, or straight from a small in-process LRU,
+without re-running the view. A running request holds the key on a short
+lease, so a worker that dies before storing its response does not block the
+key until it expires.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework.response import Response
+
+from .models import IdempotencyRecord
+
+HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+
+
+class ResponseLRU:
+    """Thread-safe LRU of finished responses with a per-entry expiry."""
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry["expires_at"] <= timezone.now():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+response_cache = ResponseLRU(getattr(settings, "IDEMPOTENCY_LRU_SIZE", 1024))
+
+
+def key_ttl():
+    return timedelta(hours=getattr(settings, "IDEMPOTENCY_KEY_TTL_HOURS", 24))
+
+
+def lease():
+    return timedelta(seconds=getattr(settings, "IDEMPOTENCY_LEASE_SECONDS", 60))
+
+
+def _replay(entry):
+    response = Response(entry["body"], status=entry["status"])
+    response["Idempotent-Replayed"] = "true"
+    return response
+
+
+def idempotent(scope):
+    """
+    Decorate an APIView handler. Requests without the header run as before;
+    2xx/4xx responses are stored, 5xx responses and exceptions free the key
+    so the client can retry.
+    """
+    def decorator(handler):
+        @wraps(handler)
+        def wrapper(self, request, *args, **kwargs):
+            key = request.headers.get(HEADER)
+            if not key or not request.user.is_authenticated:
+                return handler(self, request, *args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return Response({"error": f"{HEADER} is too long."}, status=400)
+
+            request_hash = hashlib.sha256(request.body).hexdigest()
+            lru_key = (request.user.pk, scope, key)
+            entry = response_cache.get(lru_key)
+            if entry is not None:
+                if entry["request_hash"] != request_hash:
+                    return _key_reused()
+                return _replay(entry)
+
+            now = timezone.now()
+            record = IdempotencyRecord.objects.filter(
+                user=request.user, scope=scope, key=key
+            ).first()
+            if record is not None and record.expires_at <= now:
+                record.delete()
+                record = None
+            if record is not None:
+                if not _take_over(record, request_hash, now):
+                    return _existing(record, lru_key, request_hash)
+            else:
+                try:
+                    with transaction.atomic():
+                        record = IdempotencyRecord.objects.create(
+                            user=request.user, scope=scope, key=key, request_hash=request_hash,
+                            locked_until=now + lease(), expires_at=now + key_ttl(),
+                        )
+                except IntegrityError:
+                    # a concurrent request with the same key claimed it first
+                    record = IdempotencyRecord.objects.filter(
+                        user=request.user, scope=scope, key=key
+                    ).first()
+                    if record is None:
+                        return _in_progress()
+                    if not _take_over(record, request_hash, now):
+                        return _existing(record, lru_key, request_hash)
+
+            try:
+                response = handler(self, request, *args, **kwargs)
+            except Exception:
+                _release(record)
+                raise
+
+            if response.status_code >= 500 or not isinstance(response, Response):
+                _release(record)
+                return response
+
+            record.response_status = response.status_code
+            record.response_body = response.data
+            record.locked_until = None
+            record.save(update_fields=["response_status", "response_body", "locked_until"])
+            response_cache.set(lru_key, _entry(record))
+            return response
+        return wrapper
+    return decorator
+
+
+def _take_over(record, request_hash, now):
+    """
+    Claim a record whose request died before storing a response, once its
+    lease has lapsed. The conditional UPDATE lets only one retry win.
+    """
+    if record.response_status is not None or record.request_hash != request_hash:
+        return False
+    if record.locked_until is not None and record.locked_until > now:
+        return False
+    locked_until = now + lease()
+    claimed = IdempotencyRecord.objects.filter(
+        pk=record.pk, response_status__isnull=True, locked_until=record.locked_until
+    ).update(locked_until=locked_until)
+    if claimed:
+        record.locked_until = locked_until
+    return bool(claimed)
+
+
+def _release(record):
+    # frees the key unless a retry has taken it over in the meantime
+    IdempotencyRecord.objects.filter(
+        pk=record.pk, response_status__isnull=True, locked_until=record.locked_until
+    ).delete()
+
+
+def _entry(record):
+    return {
+        "status": record.response_status,
+        "body": record.response_body,
+        "request_hash": record.request_hash,
+        "expires_at": record.expires_at,
+    }
+
+
+def _existing(record, lru_key, request_hash):
+    if record.response_status is None:
+        return _in_progress()
+    entry = _entry(record)
+    response_cache.set(lru_key, entry)
+    if entry["request_hash"] != request_hash:
+        return _key_reused()
+    return _replay(entry)
+
+
+def _in_progress():
+    return Response(
+        {"error": f"A request with this {HEADER} is still being processed."},
+        status=409,
+    )
+
+
+def _key_reused():
+    return Response(
+        {"error": f"{HEADER} was already used with a different request body."},
+        status=422,
+    )
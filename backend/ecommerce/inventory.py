@@ -0,0 +1,395 @@
+"""
+Stock reservation for checkout.
+
+Stock is taken with conditional `UPDATE ... WHERE stock_quantity >= n`
+statements as the last step of the checkout transaction, so the row lock is
+only held from that update to the commit, instead of across the whole
+checkout as with an up-front SELECT FOR UPDATE. Hot SKUs can be split over
+InventoryShard rows; each buyer then takes an unlocked shard and concurrent
+checkouts mostly touch different rows.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .cache import bump_catalog_version
+from .models import REVENUE_STATUSES, Inventory, InventoryShard, Order, OrderItem, OrderSeller, Product, StockReservation
+
+PRODUCT_TABLE = Product._meta.db_table
+INVENTORY_TABLE = Inventory._meta.db_table
+SHARD_TABLE = InventoryShard._meta.db_table
+RESERVATION_TABLE = StockReservation._meta.db_table
+
+
+class OutOfStock(Exception):
+    def __init__(self, product_ids):
+        self.product_ids = list(product_ids)
+        super().__init__(f"Insufficient stock for products {self.product_ids}")
+
+
+def reservation_ttl():
+    return timedelta(minutes=getattr(settings, "STOCK_RESERVATION_MINUTES", 15))
+
+
+def _values_sql(rows, casts):
+    placeholders = ", ".join(
+        "(" + ", ".join(f"%s::{cast}" for cast in casts) + ")" for _ in rows
+    )
+    params = [value for row in rows for value in row]
+    return placeholders, params
+
+
+def decrement_stock(quantities):
+    """
+    Take {product_id: quantity} out of stock. Must run inside a transaction:
+    on OutOfStock the caller rolls back whatever was already decremented.
+    Returns (product_id, shard, quantity) allocations, shard None for plain rows.
+    Products without an Inventory row do not track stock and get no allocation.
+    """
+    if not connection.in_atomic_block:
+        raise RuntimeError("decrement_stock must run inside transaction.atomic()")
+    if not quantities:
+        return []
+
+    values, params = _values_sql(quantities.items(), ("bigint", "integer"))
+    with connection.cursor() as cursor:
+        # one round trip takes plain stock and reports which products are sharded
+        cursor.execute(
+            f"""
+            WITH wanted AS (
+                SELECT * FROM (VALUES {values}) AS v(product_id, quantity)
+            ), taken AS (
+                UPDATE {INVENTORY_TABLE} i
+                SET stock_quantity = i.stock_quantity - wanted.quantity
+                FROM wanted
+                WHERE i.product_id = wanted.product_id
+                  AND i.shard_count = 0
+                  AND i.stock_quantity >= wanted.quantity
+                RETURNING i.product_id
+            )
+            SELECT wanted.product_id, taken.product_id IS NOT NULL, COALESCE(i.shard_count, 0), i.id IS NULL
+            FROM wanted
+            LEFT JOIN taken ON taken.product_id = wanted.product_id
+            LEFT JOIN {INVENTORY_TABLE} i ON i.product_id = wanted.product_id
+            """,
+            params,
+        )
+        rows = cursor.fetchall()
+
+    allocations = []
+    out_of_stock = []
+    sharded = []
+    for product_id, was_taken, shard_count, untracked in rows:
+        if was_taken:
+            allocations.append((product_id, None, quantities[product_id]))
+        elif untracked:
+            # created before stock was tracked, or by a path that skips set_stock
+            continue
+        elif shard_count:
+            sharded.append(product_id)
+        else:
+            out_of_stock.append(product_id)
+    if out_of_stock:
+        raise OutOfStock(out_of_stock)
+
+    # in product order, so two checkouts never wait on each other's shards in a cycle
+    for product_id in sorted(sharded):
+        taken = _decrement_shards(product_id, quantities[product_id])
+        if taken is None:
+            raise OutOfStock([product_id])
+        allocations.extend((product_id, shard, quantity) for shard, quantity in taken)
+    return allocations
+
+
+def _decrement_shards(product_id, quantity):
+    """
+    Take stock from the product's shards, returning [(shard, quantity)] or
+    None when they cannot cover it. Usually one unlocked shard is enough;
+    SKIP LOCKED steers a buyer away from shards other checkouts are
+    holding. Otherwise every shard is locked, in shard order, and the
+    quantity is taken from as many as needed.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            UPDATE {SHARD_TABLE} s SET quantity = s.quantity - %s
+            WHERE s.id = (
+                SELECT s2.id FROM {SHARD_TABLE} s2
+                JOIN {INVENTORY_TABLE} i ON i.id = s2.inventory_id
+                WHERE i.product_id = %s AND s2.quantity >= %s
+                ORDER BY random() LIMIT 1
+                FOR UPDATE OF s2 SKIP LOCKED
+            )
+            RETURNING s.shard
+            """,
+            [quantity, product_id, quantity],
+        )
+        row = cursor.fetchone()
+        if row:
+            return [(row[0], quantity)]
+
+        cursor.execute(
+            f"""
+            SELECT s.id, s.shard, s.quantity FROM {SHARD_TABLE} s
+            JOIN {INVENTORY_TABLE} i ON i.id = s.inventory_id
+            WHERE i.product_id = %s AND s.quantity > 0
+            ORDER BY s.shard
+            FOR UPDATE OF s
+            """,
+            [product_id],
+        )
+        taken = []
+        remaining = quantity
+        for shard_id, shard, available in cursor.fetchall():
+            take = min(available, remaining)
+            taken.append((shard_id, shard, take))
+            remaining -= take
+            if not remaining:
+                break
+        if remaining:
+            return None
+
+        values, params = _values_sql([(shard_id, take) for shard_id, _, take in taken], ("bigint", "integer"))
+        cursor.execute(
+            f"""
+            UPDATE {SHARD_TABLE} s SET quantity = s.quantity - v.quantity
+            FROM (VALUES {values}) AS v(id, quantity)
+            WHERE s.id = v.id
+            """,
+            params,
+        )
+    return [(shard, take) for _, shard, take in taken]
+
+
+def increment_stock(allocations):
+    """Put (product_id, shard, quantity) allocations back into stock."""
+    plain = {}
+    sharded = {}
+    for product_id, shard, quantity in allocations:
+        if shard is None:
+            plain[product_id] = plain.get(product_id, 0) + quantity
+        else:
+            sharded[(product_id, shard)] = sharded.get((product_id, shard), 0) + quantity
+
+    with connection.cursor() as cursor:
+        if plain:
+            values, params = _values_sql(plain.items(), ("bigint", "integer"))
+            cursor.execute(
+                f"""
+                UPDATE {INVENTORY_TABLE} i
+                SET stock_quantity = i.stock_quantity + v.quantity
+                FROM (VALUES {values}) AS v(product_id, quantity)
+                WHERE i.product_id = v.product_id
+                """,
+                params,
+            )
+        if sharded:
+            rows = [(product_id, shard, quantity) for (product_id, shard), quantity in sharded.items()]
+            values, params = _values_sql(rows, ("bigint", "smallint", "integer"))
+            cursor.execute(
+                f"""
+                UPDATE {SHARD_TABLE} s
+                SET quantity = s.quantity + v.quantity
+                FROM {INVENTORY_TABLE} i, (VALUES {values}) AS v(product_id, shard, quantity)
+                WHERE s.inventory_id = i.id AND i.product_id = v.product_id AND s.shard = v.shard
+                """,
+                params,
+            )
+
+
+def reserve_stock(order, quantities, ttl=None):
+    """
+    Decrement stock for a PENDING order and record what was taken so it can
+    be given back if the order fails or is never paid.
+    """
+    allocations = decrement_stock(quantities)
+    expires_at = timezone.now() + (ttl or reservation_ttl())
+    StockReservation.objects.bulk_create([
+        StockReservation(order=order, product_id=product_id, shard=shard, quantity=quantity, expires_at=expires_at)
+        for product_id, shard, quantity in allocations
+    ])
+    return allocations
+
+
+def commit_reservations(order_ids):
+    """The orders are paid: the stock stays sold, only the holds go away."""
+    StockReservation.objects.filter(order_id__in=order_ids).delete()
+
+
+def release_reservations(order_ids):
+    """
+    Return held stock for failed or expired orders. Deleting with RETURNING
+    makes a second release of the same order a no-op.
+    """
+    if not order_ids:
+        return 0
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                DELETE FROM {RESERVATION_TABLE} WHERE order_id = ANY(%s)
+                RETURNING product_id, shard, quantity
+                """,
+                [list(order_ids)],
+            )
+            allocations = cursor.fetchall()
+        increment_stock(allocations)
+    return len(allocations)
+
+
+def settle_payment(order_id, status, **payment):
+    """
+    Mark an order paid (status PAID or VERIFIED) and keep its stock sold.
+    The order row is locked first, so this cannot interleave with
+    release_expired_reservations. An order that was cancelled or failed in
+    the meantime has already given its stock back: it is taken again, or
+    the order becomes REFUND_DUE when the stock is gone. Returns the order.
+    """
+    with transaction.atomic():
+        order = Order.objects.select_for_update().get(pk=order_id)
+        for field, value in payment.items():
+            setattr(order, field, value)
+
+        if order.status in REVENUE_STATUSES:
+            # a second delivery of the same payment; the webhook's VERIFIED outranks PAID
+            if order.status == "PAID" and status == "VERIFIED":
+                order.status = status
+        elif order.status == "PENDING" and order.reservations.exists():
+            order.status = status
+            commit_reservations([order.pk])
+        elif order.status != "REFUND_DUE":
+            quantities = {}
+            for product_id, quantity in OrderItem.objects.filter(order=order, product__isnull=False).values_list("product_id", "quantity"):
+                quantities[product_id] = quantities.get(product_id, 0) + quantity
+            try:
+                with transaction.atomic():
+                    decrement_stock(quantities)
+                order.status = status
+            except OutOfStock:
+                order.status = "REFUND_DUE"
+        order.save()
+    return order
+
+
+def release_expired_reservations(now=None, batch_size=500):
+    """
+    Cancel PENDING orders whose holds have expired and return their stock.
+    Orders being paid at the same moment are skipped thanks to SKIP LOCKED
+    and the status check.
+    """
+    now = now or timezone.now()
+    candidates = (
+        StockReservation.objects.filter(expires_at__lte=now, order__status="PENDING")
+        .values_list("order_id", flat=True).distinct()[:batch_size]
+    )
+    with transaction.atomic():
+        order_ids = list(
+            Order.objects.select_for_update(skip_locked=True)
+            .filter(pk__in=list(candidates), status="PENDING")
+            .values_list("pk", flat=True)
+        )
+        Order.objects.filter(pk__in=order_ids).update(status="CANCELLED")
+        OrderSeller.objects.filter(order_id__in=order_ids).update(status="CANCELLED")
+        release_reservations(order_ids)
+    return order_ids
+
+
+def set_stock(product, quantity):
+    """Set the absolute stock of a product, spreading it over shards if sharded."""
+    with transaction.atomic():
+        inventory, _ = Inventory.objects.select_for_update().get_or_create(product=product)
+        if not inventory.shard_count:
+            inventory.stock_quantity = quantity
+            inventory.save(update_fields=["stock_quantity"])
+            return inventory
+        _write_shards(inventory, inventory.shard_count, quantity)
+    return inventory
+
+
+def bulk_update_products(seller_id, updates):
+    """
+    Apply {public_product_id: (stock, price)} to the seller's own products,
+    either value None to leave it alone. Prices and plain stock go out in one
+    statement; sharded products are respread one by one. Returns
+    (updated public ids, ids that are unknown or belong to another seller).
+    """
+    if not updates:
+        return [], []
+
+    rows = [(public_id, stock, price) for public_id, (stock, price) in updates.items()]
+    values, params = _values_sql(rows, ("varchar", "integer", "numeric"))
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            # data-modifying CTEs always run, whether or not the SELECT reads them
+            cursor.execute(
+                f"""
+                WITH wanted AS (
+                    SELECT p.id, v.public_product_id, v.stock, v.price
+                    FROM (VALUES {values}) AS v(public_product_id, stock, price)
+                    JOIN {PRODUCT_TABLE} p ON p.public_product_id = v.public_product_id
+                    WHERE p.seller_id = %s
+                ), priced AS (
+                    UPDATE {PRODUCT_TABLE} p SET price = wanted.price
+                    FROM wanted
+                    WHERE p.id = wanted.id AND wanted.price IS NOT NULL
+                ), stocked AS (
+                    INSERT INTO {INVENTORY_TABLE} (product_id, stock_quantity, shard_count)
+                    SELECT id, stock, 0 FROM wanted WHERE stock IS NOT NULL
+                    ON CONFLICT (product_id) DO UPDATE
+                    SET stock_quantity = EXCLUDED.stock_quantity
+                    WHERE {INVENTORY_TABLE}.shard_count = 0
+                    RETURNING product_id
+                )
+                SELECT wanted.public_product_id, wanted.id, wanted.stock,
+                       wanted.stock IS NOT NULL AND stocked.product_id IS NULL
+                FROM wanted
+                LEFT JOIN stocked ON stocked.product_id = wanted.id
+                """,
+                params + [seller_id],
+            )
+            found = cursor.fetchall()
+
+        for _, product_id, stock, sharded in found:
+            if sharded:
+                set_stock(Product(pk=product_id), stock)
+
+    updated = [row[0] for row in found]
+    if updated:
+        # raw updates skip the Product/Inventory signals
+        bump_catalog_version()
+    return updated, sorted(set(updates) - set(updated))
+
+
+def reshard(product, shard_count):
+    """
+    Split a product's stock over `shard_count` shards, or fold it back into
+    Inventory.stock_quantity when shard_count is 0.
+    """
+    with transaction.atomic():
+        inventory, _ = Inventory.objects.select_for_update().get_or_create(product=product)
+        # checkouts take shards without touching the inventory row, so lock those too
+        list(inventory.shards.select_for_update())
+        total = inventory.available_quantity
+        # live holds point at shard numbers that are about to change; they
+        # go back to shard 0 or to the plain stock column once released
+        StockReservation.objects.filter(product=product).update(shard=0 if shard_count else None)
+        if shard_count:
+            _write_shards(inventory, shard_count, total)
+            inventory.stock_quantity = 0
+        else:
+            inventory.shards.all().delete()
+            inventory.stock_quantity = total
+        inventory.shard_count = shard_count
+        inventory.save(update_fields=["stock_quantity", "shard_count"])
+    return inventory
+
+
+def _write_shards(inventory, shard_count, total):
+    base, extra = divmod(total, shard_count)
+    inventory.shards.all().delete()
+    InventoryShard.objects.bulk_create([
+        InventoryShard(inventory=inventory, shard=shard, quantity=base + (1 if shard < extra else 0))
+        for shard in range(shard_count)
+    ])
@@ -0,0 +1,75 @@
+from datetime import date, datetime, time, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from ecommerce.models import REVENUE_STATUSES, Order, OrderItem, Product, SalesRollup
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def rebuild_rollups(start, end):
+    """
+    Recompute the rollups of days [start, end) from order items. The table
+    lock makes concurrent status changes either land before the snapshot or
+    wait and apply their delta on top of the rebuilt rows.
+    """
+    rollup = SalesRollup._meta.db_table
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"LOCK TABLE {rollup} IN SHARE ROW EXCLUSIVE MODE")
+        cursor.execute(f"DELETE FROM {rollup} WHERE day >= %s AND day < %s", [start, end])
+        cursor.execute(
+            f"""
+            INSERT INTO {rollup} (seller_id, product_id, day, units, revenue)
+            SELECT p.seller_id, i.product_id, (o.created_at AT TIME ZONE %(tz)s)::date,
+                   SUM(i.quantity), SUM(i.quantity * i.price_at_purchase)
+            FROM {Order._meta.db_table} o
+            JOIN {OrderItem._meta.db_table} i ON i.order_id = o.id
+            JOIN {Product._meta.db_table} p ON p.id = i.product_id
+            WHERE o.created_at >= %(start)s AND o.created_at < %(end)s
+              AND o.status = ANY(%(statuses)s)
+            GROUP BY 1, 2, 3
+            """,
+            {
+                "tz": settings.TIME_ZONE,
+                "start": _day_start(start),
+                "end": _day_start(end),
+                "statuses": list(REVENUE_STATUSES),
+            },
+        )
+        return cursor.rowcount
+
+
+class Command(BaseCommand):
+    help = "Rebuild the daily sales rollups from order history, a few days per transaction"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--from", dest="start", type=date.fromisoformat, help="first day, defaults to the oldest order")
+        parser.add_argument("--to", dest="end", type=date.fromisoformat, help="last day (inclusive), defaults to today")
+        parser.add_argument("--days-per-chunk", type=int, default=7)
+
+    def handle(self, *args, **options):
+        end = options["end"] or timezone.localdate()
+        start = options["start"]
+        if start is None:
+            first = Order.objects.aggregate(first=Min("created_at"))["first"]
+            if first is None:
+                self.stdout.write("No orders to roll up")
+                return
+            start = timezone.localdate(first)
+        if start > end:
+            raise CommandError("--from must not be after --to")
+
+        rows = 0
+        chunk = timedelta(days=options["days_per_chunk"])
+        day = start
+        while day <= end:
+            chunk_end = min(day + chunk, end + timedelta(days=1))
+            rows += rebuild_rollups(day, chunk_end)
+            day = chunk_end
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rows} rollup rows from {start} to {end}"))
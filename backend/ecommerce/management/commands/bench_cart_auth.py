@@ -0,0 +1,77 @@
+import statistics
+import time
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from ecommerce import views
+from ecommerce.authentication import ClaimsJWTAuthentication, user_cache
+from ecommerce.models import Product
+from ecommerce.roles import RoleRefreshToken
+
+CART_VIEWS = (views.manage_cart, views.manage_wishlist, views.sync_cart_wishlist, views.cart_quote)
+AUTH_CLASSES = (("db user", JWTAuthentication), ("stateless", ClaimsJWTAuthentication))
+
+
+class Command(BaseCommand):
+    help = "Cart/wishlist endpoint latency and queries/request with the database vs stateless JWT user"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=300, help="requests per endpoint and mode")
+
+    def handle(self, *args, **options):
+        original = {view: view.cls.authentication_classes for view in CART_VIEWS}
+        # fixtures live in a transaction that is rolled back at the end
+        with transaction.atomic():
+            client, product_id = self.create_fixtures()
+            calls = [
+                ("POST cart", lambda: client.post("/api/cart/", {"product_id": product_id, "quantity": 1}, format="json")),
+                ("PATCH cart", lambda: client.patch("/api/cart/", {"product_id": product_id, "quantity": 2}, format="json")),
+                ("POST wishlist", lambda: client.post("/api/wishlist/", {"product_id": product_id}, format="json")),
+                ("GET sync", lambda: client.get("/api/sync-cart-wishlist/")),
+                ("GET quote", lambda: client.get("/api/cart/quote/")),
+            ]
+            try:
+                for label, auth_class in AUTH_CLASSES:
+                    for view in CART_VIEWS:
+                        view.cls.authentication_classes = [auth_class]
+                    user_cache.clear()
+                    for name, call in calls:
+                        self.run(f"{label} {name}", call, options["requests"])
+            finally:
+                for view, classes in original.items():
+                    view.cls.authentication_classes = classes
+            transaction.set_rollback(True)
+
+    def create_fixtures(self):
+        buyer = User.objects.create(username="bench-auth-buyer", email="buyer@example.com")
+        seller = User.objects.create(username="bench-auth-seller")
+        product = Product.objects.create(
+            title="Bench product", description="benchmark", category="bench",
+            image="products/bench.png", seller=seller, price=Decimal("199.99"),
+        )
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION="Bearer " + str(RoleRefreshToken.for_user(buyer).access_token))
+        return client, product.public_product_id
+
+    def run(self, label, call, count):
+        call()  # warm up caches and the code path
+        timings = []
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(count):
+                started = time.perf_counter()
+                response = call()
+                timings.append((time.perf_counter() - started) * 1000)
+        if response.status_code >= 400:
+            self.stderr.write(f"{label}: HTTP {response.status_code} {response.content[:200]!r}")
+        timings.sort()
+        self.stdout.write(
+            f"{label:>26}: median {statistics.median(timings):6.2f} ms, "
+            f"p95 {timings[int(len(timings) * 0.95) - 1]:6.2f} ms, "
+            f"{len(queries) / count:.2f} queries/request"
+        )
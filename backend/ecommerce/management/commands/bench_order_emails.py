@@ -0,0 +1,70 @@
+import time
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from ecommerce.mailers import build_order_completed_email, prefetch_order_email_data, render_order_completed_batch
+from ecommerce.models import Order, OrderItem, Product
+
+
+class Command(BaseCommand):
+    help = "Order confirmation rendering: emails/sec and queries/email, one at a time vs batched"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--orders", type=int, default=200)
+        parser.add_argument("--items", type=int, default=5, help="line items per order")
+        parser.add_argument("--iterations", type=int, default=3)
+
+    def handle(self, *args, **options):
+        # fixtures live in a transaction that is rolled back at the end
+        with transaction.atomic():
+            order_ids = self.create_fixtures(options["orders"], options["items"])
+            self.run("one by one", order_ids, options["iterations"], self.one_by_one)
+            self.run("batch", order_ids, options["iterations"], self.batch)
+            transaction.set_rollback(True)
+
+    def create_fixtures(self, order_count, item_count):
+        buyer = User.objects.create(username="bench-email-buyer", email="buyer@example.com", first_name="Bench")
+        seller = User.objects.create(username="bench-email-seller")
+        products = Product.objects.bulk_create([
+            Product(
+                title=f"Bench product <{i}>", description="benchmark", category="bench",
+                image="products/bench.png", seller=seller, price=Decimal("199.99"),
+            )
+            for i in range(item_count)
+        ])
+        orders = Order.objects.bulk_create([
+            Order(user=buyer, total_amount=Decimal("999.95"), shipping_address="addr", phone_number="123")
+            for _ in range(order_count)
+        ])
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=product, quantity=2, price_at_purchase=product.price)
+            for order in orders for product in products
+        ])
+        return [order.pk for order in orders]
+
+    def one_by_one(self, order_ids):
+        # how the outbox used to work: load each order on its own, then build it
+        for order_id in order_ids:
+            build_order_completed_email(Order.objects.get(pk=order_id))
+
+    def batch(self, order_ids):
+        orders = list(Order.objects.filter(pk__in=order_ids))
+        prefetch_order_email_data(orders)
+        render_order_completed_batch(orders)
+
+    def run(self, label, order_ids, iterations, render):
+        best = None
+        for _ in range(iterations):
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                render(order_ids)
+                elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        self.stdout.write(
+            f"{label:>10}: {len(order_ids) / best:8.0f} emails/sec, "
+            f"{len(queries) / len(order_ids):.2f} queries/email"
+        )
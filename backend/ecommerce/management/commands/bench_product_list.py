@@ -0,0 +1,71 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from rest_framework.request import Request
+
+from ecommerce.models import Product
+from ecommerce.serializers import ProductListSerializer, ProductListValuesSerializer
+
+
+class Command(BaseCommand):
+    help = "Compare per-page cost of ProductListSerializer against the values() fast path"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--page-size", type=int, default=30)
+        parser.add_argument("--iterations", type=int, default=200)
+        parser.add_argument(
+            "--seed", type=int, default=0,
+            help="create this many throwaway products first (rolled back afterwards)",
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if options["seed"]:
+                self.seed(options["seed"])
+            self.run(options["page_size"], options["iterations"])
+            transaction.set_rollback(True)
+
+    def seed(self, count):
+        seller, _ = User.objects.get_or_create(username="bench-seller")
+        Product.objects.bulk_create(
+            [
+                Product(
+                    title=f"Bench product {i}",
+                    description="Benchmark product",
+                    category="bench",
+                    price=i % 500,
+                    image=f"products/bench-{i}.png",
+                    seller=seller,
+                )
+                for i in range(count)
+            ],
+            batch_size=1000,
+        )
+
+    def run(self, page_size, iterations):
+        request = Request(RequestFactory().get("/api/products/"))
+        base = Product.objects.filter(is_active=True).order_by("-created_at", "-id")
+
+        def model_path():
+            page = list(base[:page_size])
+            return ProductListSerializer(page, many=True, context={"request": request}).data
+
+        def values_path():
+            page = list(ProductListValuesSerializer.get_queryset(base)[:page_size])
+            return ProductListValuesSerializer(page, context={"request": request}).data
+
+        for label, fn in (("ProductListSerializer", model_path), ("values fast path", values_path)):
+            with CaptureQueriesContext(connection) as queries:
+                rows = len(fn())
+            start = time.perf_counter()
+            for _ in range(iterations):
+                fn()
+            elapsed = (time.perf_counter() - start) / iterations
+            self.stdout.write(
+                f"{label:<24} rows={rows:<4} queries/page={len(queries):<4} "
+                f"ms/page={elapsed * 1000:.3f}"
+            )
@@ -0,0 +1,93 @@
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import F
+
+from ecommerce.inventory import OutOfStock, decrement_stock, reshard
+from ecommerce.models import Inventory, Product
+
+
+class Command(BaseCommand):
+    help = "Concurrent checkouts of a single product: orders/sec per stock strategy"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=16)
+        parser.add_argument("--orders", type=int, default=2000, help="total checkouts across all threads")
+        parser.add_argument("--shards", type=int, default=8)
+        parser.add_argument(
+            "--work-ms", type=float, default=2.0,
+            help="simulated checkout work (order and item inserts) in the transaction",
+        )
+        parser.add_argument(
+            "--hold-ms", type=float, default=0.5,
+            help="simulated work after stock is taken (reservation insert, commit)",
+        )
+        parser.add_argument("--modes", default="locking,conditional,sharded")
+
+    def handle(self, *args, **options):
+        seller, _ = User.objects.get_or_create(username="bench-seller")
+        product = Product.objects.create(
+            title="Bench hot product", description="benchmark", category="bench",
+            image="products/bench.png", seller=seller,
+        )
+        try:
+            for mode in options["modes"].split(","):
+                Inventory.objects.update_or_create(product=product, defaults={"stock_quantity": options["orders"]})
+                reshard(product, options["shards"] if mode == "sharded" else 0)
+                self.run(mode, product.id, options)
+        finally:
+            # queryset delete: the bench image was never uploaded
+            Product.objects.filter(pk=product.pk).delete()
+
+    def run(self, mode, product_id, options):
+        work = options["work_ms"] / 1000
+        hold = options["hold_ms"] / 1000
+        per_thread = options["orders"] // options["threads"]
+        failures = []
+
+        def locking():
+            # the naive fix: lock the row first and keep it for the whole checkout
+            with transaction.atomic():
+                inventory = Inventory.objects.select_for_update().get(product_id=product_id)
+                time.sleep(work)
+                if inventory.stock_quantity < 1:
+                    raise OutOfStock([product_id])
+                Inventory.objects.filter(pk=inventory.pk).update(stock_quantity=F("stock_quantity") - 1)
+                time.sleep(hold)
+
+        def conditional():
+            # the checkout view: write the order first, take stock last
+            with transaction.atomic():
+                time.sleep(work)
+                decrement_stock({product_id: 1})
+                time.sleep(hold)
+
+        checkout = locking if mode == "locking" else conditional
+
+        def worker():
+            try:
+                for _ in range(per_thread):
+                    try:
+                        checkout()
+                    except OutOfStock:
+                        failures.append(product_id)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(options["threads"])]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        inventory = Inventory.objects.get(product_id=product_id)
+        done = per_thread * options["threads"] - len(failures)
+        self.stdout.write(
+            f"{mode:<12} threads={options['threads']:<3} orders={done:<6} "
+            f"orders/sec={done / elapsed:8.1f} stock_left={inventory.available_quantity}"
+        )
@@ -0,0 +1,98 @@
+import hashlib
+import hmac
+import json
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+
+from ecommerce.models import Order
+from ecommerce.webhooks import EVENT_ID_HEADER
+
+
+class Command(BaseCommand):
+    help = "Fake gateway: replay a burst of signed order.paid webhooks, with redeliveries"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--events", type=int, default=500)
+        parser.add_argument("--redeliveries", type=int, default=2, help="times each event is delivered")
+        parser.add_argument("--concurrency", type=int, default=16)
+        parser.add_argument(
+            "--url", default="",
+            help="webhook URL of a running server; without it requests go through the in-process test client",
+        )
+
+    def handle(self, *args, **options):
+        secret = settings.RAZORPAY_WEBHOOK_SECRET
+        # pending orders get paid; the rest of the burst names unknown orders, which the worker ignores
+        order_ids = list(
+            Order.objects.filter(status="PENDING", razorpay_order_id__isnull=False)
+            .values_list("razorpay_order_id", flat=True)[:options["events"]]
+        )
+        order_ids += [f"order_fake{uuid.uuid4().hex[:10]}" for _ in range(options["events"] - len(order_ids))]
+
+        deliveries = []
+        for order_id in order_ids:
+            body = json.dumps({
+                "event": "order.paid",
+                "payload": {
+                    "order": {"entity": {"id": order_id}},
+                    "payment": {"entity": {"id": f"pay_fake{uuid.uuid4().hex[:10]}"}},
+                },
+            }).encode()
+            signature = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+            event_id = f"evt_fake{uuid.uuid4().hex[:12]}"
+            deliveries += [(event_id, body, signature)] * options["redeliveries"]
+
+        send = self.http_sender(options["url"]) if options["url"] else self.client_sender()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(options["concurrency"]) as pool:
+            results = list(pool.map(lambda delivery: send(*delivery), deliveries))
+        elapsed = time.perf_counter() - started
+
+        latencies = sorted(latency for _, latency in results)
+        failed = sum(1 for code, _ in results if code != 200)
+        self.stdout.write(
+            f"{len(deliveries)} deliveries in {elapsed:.2f}s ({len(deliveries) / elapsed:.0f}/s), "
+            f"{failed} non-200, p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, "
+            f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms"
+        )
+
+    def http_sender(self, url):
+        def send(event_id, body, signature):
+            request = urllib.request.Request(url, data=body, method="POST", headers={
+                "Content-Type": "application/json",
+                "X-Razorpay-Signature": signature,
+                EVENT_ID_HEADER: event_id,
+            })
+            started = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request) as response:
+                    code = response.status
+            except urllib.error.HTTPError as e:
+                code = e.code
+            return code, time.perf_counter() - started
+        return send
+
+    def client_sender(self):
+        url = reverse("razorpay-webhook")
+        header = "HTTP_" + EVENT_ID_HEADER.upper().replace("-", "_")
+
+        def send(event_id, body, signature):
+            started = time.perf_counter()
+            try:
+                response = Client().post(
+                    url, data=body, content_type="application/json",
+                    HTTP_X_RAZORPAY_SIGNATURE=signature, **{header: event_id},
+                )
+            finally:
+                connection.close()
+            return response.status_code, time.perf_counter() - started
+        return send
@@ -0,0 +1,44 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from ecommerce.product_import import FORMATS, ImagePool, ProductImport, detect_format
+
+
+class Command(BaseCommand):
+    help = "Bulk import a seller's products from a CSV or JSON lines file"
+
+    def add_arguments(self, parser):
+        parser.add_argument("seller", help="username of the seller")
+        parser.add_argument("path")
+        parser.add_argument("--format", choices=FORMATS, help="defaults to the file extension")
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--image-workers", type=int, default=8)
+
+    def handle(self, *args, **options):
+        try:
+            seller = User.objects.get(username=options["seller"])
+        except User.DoesNotExist:
+            raise CommandError(f"No user named {options['seller']}")
+        fmt = detect_format(options["path"], options["format"])
+        if fmt is None:
+            raise CommandError("Pass --format csv or --format jsonl")
+
+        images = ImagePool(options["image_workers"])
+        importer = ProductImport(seller, batch_size=options["batch_size"], image_pool=images)
+        started = time.perf_counter()
+        with open(options["path"], "rb") as stream:
+            report = importer.run(stream, fmt)
+        imported = time.perf_counter() - started
+        stored, failed_images = images.wait()
+
+        for error in report["errors"]:
+            self.stderr.write(f"row {error['row']}: {error['errors']}")
+        if report["errors_truncated"]:
+            self.stderr.write(f"... {report['failed'] - len(report['errors'])} more failed rows not shown")
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {report['created']} products in {imported:.1f}s "
+            f"({report['created'] / max(imported, 1e-9):.0f}/s), {report['failed']} rows failed, "
+            f"images stored {stored}, failed {failed_images}"
+        ))
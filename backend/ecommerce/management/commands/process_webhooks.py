@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ecommerce.webhooks import MAX_ATTEMPTS, process_batch
+
+
+class Command(BaseCommand):
+    help = "Apply pending Razorpay webhook events from the inbox"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument("--max-attempts", type=int, default=MAX_ATTEMPTS)
+        parser.add_argument("--loop", action="store_true", help="keep polling instead of exiting when the inbox is empty")
+        parser.add_argument("--sleep", type=float, default=1.0, help="seconds between polls of an empty inbox")
+
+    def handle(self, *args, **options):
+        processed = 0
+        while True:
+            claimed = process_batch(options["batch_size"], options["max_attempts"])
+            processed += claimed
+            if claimed:
+                continue
+            if not options["loop"]:
+                break
+            time.sleep(options["sleep"])
+        self.stdout.write(self.style.SUCCESS(f"Handled {processed} webhook events"))
@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from ecommerce.cache import bump_catalog_version
+from ecommerce.models import Product, Review
+
+PRODUCT_TABLE = Product._meta.db_table
+REVIEW_TABLE = Review._meta.db_table
+
+
+class Command(BaseCommand):
+    help = "Recompute the denormalized review aggregates on every product"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        updated = 0
+        last_id = 0
+        while True:
+            # walk products by primary key so memory stays bounded on big catalogs
+            with transaction.atomic():
+                # lock the batch before counting: a review saved meanwhile waits for
+                # the lock and adds its delta on top instead of being overwritten
+                product_ids = list(
+                    Product.objects.select_for_update().filter(id__gt=last_id)
+                    .order_by("id").values_list("id", flat=True)[:batch_size]
+                )
+                if not product_ids:
+                    break
+                last_id = product_ids[-1]
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        f"""
+                        UPDATE {PRODUCT_TABLE} p SET
+                            rating_sum = agg.rating_sum, rating_count = agg.rating_count,
+                            rating_1 = agg.rating_1, rating_2 = agg.rating_2, rating_3 = agg.rating_3,
+                            rating_4 = agg.rating_4, rating_5 = agg.rating_5
+                        FROM (
+                            SELECT ids.id,
+                                   COALESCE(SUM(r.rating), 0) AS rating_sum,
+                                   COUNT(r.id) AS rating_count,
+                                   COUNT(r.id) FILTER (WHERE r.rating = 1) AS rating_1,
+                                   COUNT(r.id) FILTER (WHERE r.rating = 2) AS rating_2,
+                                   COUNT(r.id) FILTER (WHERE r.rating = 3) AS rating_3,
+                                   COUNT(r.id) FILTER (WHERE r.rating = 4) AS rating_4,
+                                   COUNT(r.id) FILTER (WHERE r.rating = 5) AS rating_5
+                            FROM unnest(%s::bigint[]) AS ids(id)
+                            LEFT JOIN {REVIEW_TABLE} r ON r.product_id = ids.id
+                            GROUP BY ids.id
+                        ) agg
+                        WHERE p.id = agg.id
+                        """,
+                        [product_ids],
+                    )
+            updated += len(product_ids)
+
+        bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt rating aggregates for {updated} products"))
@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Count, DecimalField, F, Q, Sum
+from django.db.models.functions import Coalesce
+
+from ecommerce.models import REVENUE_STATUSES, OrderItem, Product, SellerStats
+
+STATS_FIELDS = ["products_count", "orders_count", "revenue"]
+
+
+def compute_seller_stats():
+    stats = {}
+    for row in Product.objects.values("seller_id").annotate(products=Count("id")).order_by():
+        stats.setdefault(row["seller_id"], SellerStats(seller_id=row["seller_id"])).products_count = row["products"]
+    # the stamped seller first, so lines of deleted products still count
+    sales = (
+        OrderItem.objects.annotate(line_seller=Coalesce("seller_id", "product__seller_id"))
+        .filter(line_seller__isnull=False)
+        .values("line_seller")
+        .annotate(
+            orders=Count("order_id", distinct=True),
+            revenue=Sum(
+                F("quantity") * F("price_at_purchase"),
+                filter=Q(order__status__in=REVENUE_STATUSES),
+                output_field=DecimalField(max_digits=14, decimal_places=2),
+            ),
+        )
+        .order_by()
+    )
+    for row in sales:
+        seller_stats = stats.setdefault(row["line_seller"], SellerStats(seller_id=row["line_seller"]))
+        seller_stats.orders_count = row["orders"]
+        seller_stats.revenue = row["revenue"] or 0
+    return list(stats.values())
+
+
+class Command(BaseCommand):
+    help = "Recompute SellerStats for every seller from products and order items"
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            # block the incremental updates while the totals are recomputed
+            with connection.cursor() as cursor:
+                cursor.execute(f"LOCK TABLE {SellerStats._meta.db_table} IN SHARE ROW EXCLUSIVE MODE")
+            stats = compute_seller_stats()
+            SellerStats.objects.exclude(seller_id__in=[row.seller_id for row in stats]).delete()
+            SellerStats.objects.bulk_create(
+                stats, update_conflicts=True, unique_fields=["seller"], update_fields=STATS_FIELDS + ["updated_at"],
+            )
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt stats for {len(stats)} sellers"))
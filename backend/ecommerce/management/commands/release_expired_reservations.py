@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from ecommerce.inventory import release_expired_reservations
+
+
+class Command(BaseCommand):
+    help = "Cancel unpaid orders whose stock reservation expired and return the stock"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        released = 0
+        while True:
+            order_ids = release_expired_reservations(batch_size=options["batch_size"])
+            if not order_ids:
+                break
+            released += len(order_ids)
+        self.stdout.write(self.style.SUCCESS(f"Released reservations of {released} orders"))
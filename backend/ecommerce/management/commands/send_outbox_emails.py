@@ -0,0 +1,28 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ecommerce.outbox import send_batch
+
+
+class Command(BaseCommand):
+    help = "Send pending emails from the outbox, one connection per batch"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=getattr(settings, "EMAIL_OUTBOX_BATCH_SIZE", 50))
+        parser.add_argument("--max-attempts", type=int, default=None)
+        parser.add_argument("--loop", action="store_true", help="keep polling instead of exiting when the outbox is empty")
+        parser.add_argument("--sleep", type=float, default=2.0, help="seconds between polls of an empty outbox")
+
+    def handle(self, *args, **options):
+        claimed = 0
+        while True:
+            batch = send_batch(options["batch_size"], options["max_attempts"])
+            claimed += batch
+            if batch:
+                continue
+            if not options["loop"]:
+                break
+            time.sleep(options["sleep"])
+        self.stdout.write(self.style.SUCCESS(f"Processed {claimed} outbox emails"))
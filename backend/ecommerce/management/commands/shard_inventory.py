@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ecommerce.inventory import reshard
+from ecommerce.models import Product
+
+
+class Command(BaseCommand):
+    help = "Split a hot product's stock over N counter shards (0 folds it back into one row)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("product_id", help="public product id, e.g. PRD-1a2b3c4d")
+        parser.add_argument("shards", type=int)
+
+    def handle(self, *args, **options):
+        if options["shards"] < 0:
+            raise CommandError("shards must be 0 or more")
+        try:
+            product = Product.objects.get(public_product_id=options["product_id"])
+        except Product.DoesNotExist:
+            raise CommandError(f"Product {options['product_id']} not found")
+
+        inventory = reshard(product, options["shards"])
+        self.stdout.write(self.style.SUCCESS(
+            f"{product.public_product_id}: {inventory.available_quantity} units over "
+            f"{inventory.shard_count or 1} row(s)"
+        ))
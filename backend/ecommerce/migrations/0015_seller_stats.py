@@ -0,0 +1,50 @@
+# Generated by Django 5.2 on 2026-10-18 13:37
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, F, Q, Sum
+
+
+def backfill_seller_stats(apps, schema_editor):
+    Product = apps.get_model('ecommerce', 'Product')
+    OrderItem = apps.get_model('ecommerce', 'OrderItem')
+    SellerStats = apps.get_model('ecommerce', 'SellerStats')
+    stats = {}
+    for row in Product.objects.values('seller_id').annotate(products=Count('id')).order_by():
+        stats.setdefault(row['seller_id'], SellerStats(seller_id=row['seller_id'])).products_count = row['products']
+    sales = OrderItem.objects.filter(product__isnull=False).values('product__seller_id').annotate(
+        orders=Count('order_id', distinct=True),
+        revenue=Sum(
+            F('quantity') * F('price_at_purchase'),
+            filter=Q(order__status__in=['PAID', 'VERIFIED', 'SHIPPED', 'DELIVERED']),
+            output_field=DecimalField(max_digits=14, decimal_places=2),
+        ),
+    ).order_by()
+    for row in sales:
+        seller_stats = stats.setdefault(row['product__seller_id'], SellerStats(seller_id=row['product__seller_id']))
+        seller_stats.orders_count = row['orders']
+        seller_stats.revenue = row['revenue'] or 0
+    SellerStats.objects.bulk_create(stats.values())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('ecommerce', '0014_email_outbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SellerStats',
+            fields=[
+                ('seller', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='seller_stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('products_count', models.IntegerField(default=0)),
+                ('orders_count', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(backfill_seller_stats, migrations.RunPython.noop),
+    ]
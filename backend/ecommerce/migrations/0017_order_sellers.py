@@ -0,0 +1,51 @@
+# Generated by Django 5.2 on 2026-10-18 13:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_order_sellers(apps, schema_editor):
+    OrderItem = apps.get_model('ecommerce', 'OrderItem')
+    OrderSeller = apps.get_model('ecommerce', 'OrderSeller')
+    rows = OrderItem.objects.filter(product__isnull=False).values(
+        'order_id', 'product__seller_id', 'order__created_at', 'order__status'
+    ).distinct().order_by()
+    OrderSeller.objects.bulk_create(
+        [
+            OrderSeller(
+                order_id=row['order_id'],
+                seller_id=row['product__seller_id'],
+                created_at=row['order__created_at'],
+                status=row['order__status'],
+            )
+            for row in rows.iterator()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0016_sales_rollups'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderSeller',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField()),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('PAID', 'Paid'), ('VERIFIED', 'Verified'), ('FAILED', 'Failed'), ('CANCELLED', 'Cancelled'), ('SHIPPED', 'Shipped'), ('DELIVERED', 'Delivered')], max_length=20)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='seller_links', to='ecommerce.order')),
+                ('seller', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order_links', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['seller', 'created_at', 'id'], name='order_seller_created_idx')],
+                'unique_together': {('order', 'seller')},
+            },
+        ),
+        migrations.RunPython(backfill_order_sellers, migrations.RunPython.noop),
+    ]
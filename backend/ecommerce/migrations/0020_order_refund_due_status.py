@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-18 13:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0019_claims_user'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='status',
+            field=models.CharField(choices=[('PENDING', 'Pending'), ('PAID', 'Paid'), ('VERIFIED', 'Verified'), ('FAILED', 'Failed'), ('CANCELLED', 'Cancelled'), ('REFUND_DUE', 'Refund due'), ('SHIPPED', 'Shipped'), ('DELIVERED', 'Delivered')], db_index=True, default='PENDING', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='orderseller',
+            name='status',
+            field=models.CharField(choices=[('PENDING', 'Pending'), ('PAID', 'Paid'), ('VERIFIED', 'Verified'), ('FAILED', 'Failed'), ('CANCELLED', 'Cancelled'), ('REFUND_DUE', 'Refund due'), ('SHIPPED', 'Shipped'), ('DELIVERED', 'Delivered')], max_length=20),
+        ),
+    ]
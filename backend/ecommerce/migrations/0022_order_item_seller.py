@@ -0,0 +1,31 @@
+# Generated by Django 5.2 on 2026-10-18 14:25
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_item_sellers(apps, schema_editor):
+    OrderItem = apps.get_model('ecommerce', 'OrderItem')
+    Product = apps.get_model('ecommerce', 'Product')
+    OrderItem.objects.filter(product__isnull=False).update(
+        seller_id=Subquery(Product.objects.filter(pk=OuterRef('product_id')).values('seller_id')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0021_review_lowest_rating_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='seller',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(backfill_item_sellers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2 on 2026-10-18 14:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_public_ids(apps, schema_editor):
+    CartChange = apps.get_model('ecommerce', 'CartChange')
+    Product = apps.get_model('ecommerce', 'Product')
+    CartChange.objects.update(
+        public_product_id=Subquery(Product.objects.filter(pk=OuterRef('product_id')).values('public_product_id')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0022_order_item_seller'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cartchange',
+            name='public_product_id',
+            field=models.CharField(default='', max_length=30),
+            preserve_default=False,
+        ),
+        migrations.RunPython(backfill_public_ids, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='cartchange',
+            name='product',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='ecommerce.product'),
+        ),
+    ]
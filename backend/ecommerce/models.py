@@ -1,10 +1,15 @@
-from django.db import models
+from django.db import connection, models, transaction
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.db.models.signals import m2m_changed, post_save, post_delete, pre_delete
 from django.dispatch import receiver
+from django.utils import timezone
 import uuid
+from .cache import bump_catalog_version, bump_offer_version, forget_role_version
 
 def generate_user_id():
     return f"USR-{uuid.uuid4().hex[:8]}"
@@ -51,6 +56,34 @@ class Product(models.Model):
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # review aggregates, maintained incrementally by Review.save / post_delete
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_1 = models.PositiveIntegerField(default=0)
+    rating_2 = models.PositiveIntegerField(default=0)
+    rating_3 = models.PositiveIntegerField(default=0)
+    rating_4 = models.PositiveIntegerField(default=0)
+    rating_5 = models.PositiveIntegerField(default=0)
+
+    # weighted full-text document, kept in sync by postgres on every write
+    search_vector = models.GeneratedField(
+        expression=(
+            SearchVector("title", weight="A", config="english")
+            + SearchVector("category", weight="B", config="english")
+            + SearchVector("description", weight="C", config="english")
+        ),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=["search_vector"], name="product_search_vector_gin"),
+            # keyset pagination scans (created_at, id) for the catalog and per seller
+            models.Index(fields=["created_at", "id"], name="product_created_id_idx"),
+            models.Index(fields=["seller", "created_at", "id"], name="product_seller_created_idx"),
+        ]
+
     def save(self, *args, **kwargs):
         if self.pk:
             try:
@@ -69,16 +102,54 @@ class Product(models.Model):
         super().delete(*args, **kwargs)  # Delete the model instance
 
 
+    @property
+    def average_rating(self):
+        if not self.rating_count:
+            return 0
+        return round(self.rating_sum / self.rating_count, 1)
+
+    @property
+    def rating_histogram(self):
+        return {str(star): getattr(self, f"rating_{star}") for star in range(1, 6)}
+
     def __str__(self):
         return f"{self.title}"
 
 class Inventory(models.Model):
     product = models.OneToOneField(Product, on_delete=models.CASCADE, related_name="inventory")
     stock_quantity = models.PositiveIntegerField(default=0)
+    # > 0 for hot SKUs whose stock is split across InventoryShard rows so
+    # concurrent buyers decrement different rows instead of queueing on one
+    shard_count = models.PositiveSmallIntegerField(default=0)
+
+    @property
+    def available_quantity(self):
+        if not self.shard_count:
+            return self.stock_quantity
+        return self.shards.aggregate(total=models.Sum("quantity"))["total"] or 0
 
     def __str__(self):
         return f"{self.product.title} - {self.stock_quantity}"
 
+class InventoryShard(models.Model):
+    inventory = models.ForeignKey(Inventory, on_delete=models.CASCADE, related_name="shards")
+    shard = models.PositiveSmallIntegerField()
+    quantity = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ("inventory", "shard")
+
+    def __str__(self):
+        return f"{self.inventory_id}#{self.shard} - {self.quantity}"
+
+# any catalog write invalidates the cached product listings once it commits
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Inventory)
+@receiver(post_delete, sender=Inventory)
+def invalidate_catalog_cache(sender, **kwargs):
+    bump_catalog_version()
+
 class CartItem(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="cart_items")
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
@@ -90,6 +161,38 @@ class CartItem(models.Model):
     def __str__(self):
         return f"{self.user.username} x {self.product.title} x {self.quantity}"
 
+class CartVersion(models.Model):
+    # bumped on every cart / wishlist write so clients can sync deltas
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name="cart_version")
+    version = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user_id} @ {self.version}"
+
+class CartChange(models.Model):
+    KIND_CHOICES = (
+        ("cart", "Cart"),
+        ("wishlist", "Wishlist"),
+    )
+
+    # latest change per (user, kind, product); removed rows double as tombstones,
+    # and outlive the product so delta clients still hear it was removed
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="cart_changes")
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True)
+    public_product_id = models.CharField(max_length=30)
+    version = models.BigIntegerField()
+    removed = models.BooleanField(default=False)
+
+    class Meta:
+        unique_together = ("user", "kind", "product")
+        indexes = [
+            models.Index(fields=["user", "version"], name="cartchange_user_version_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} {self.kind} {self.product_id} @ {self.version}"
+
 class Order(models.Model):
     id = models.BigAutoField(primary_key=True)
     public_order_id = models.CharField(max_length=30, unique=True, editable=False, default=generate_order_id, db_index=True)
@@ -100,6 +203,8 @@ class Order(models.Model):
         ("VERIFIED", "Verified"),
         ("FAILED", "Failed"),
         ("CANCELLED", "Cancelled"),
+        # paid after its stock hold lapsed and the stock was gone; the payment is to be refunded
+        ("REFUND_DUE", "Refund due"),
         ("SHIPPED", "Shipped"),
         ("DELIVERED", "Delivered"),
     )
@@ -119,18 +224,212 @@ class Order(models.Model):
     phone_number = models.CharField(max_length=15)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["created_at", "id"], name="order_created_id_idx"),
+            models.Index(fields=["user", "created_at", "id"], name="order_user_created_idx"),
+        ]
+
+    def save(self, *args, **kwargs):
+        # seller links, stats and daily rollups follow the status in the same transaction
+        update_fields = kwargs.get("update_fields")
+        writes_status = not self._state.adding and (update_fields is None or "status" in update_fields)
+        with transaction.atomic():
+            old_status = None
+            if writes_status:
+                # the stored status, read under the row lock: two writers that both
+                # loaded the order as PENDING must not both count it as sold
+                old_status = (
+                    Order.objects.select_for_update().filter(pk=self.pk)
+                    .values_list("status", flat=True).first()
+                )
+            super().save(*args, **kwargs)
+            if old_status is not None and old_status != self.status:
+                OrderSeller.objects.filter(order_id=self.pk).update(status=self.status)
+                apply_seller_order_change(self.pk, revenue_sign=revenue_sign(old_status, self.status))
+
     def __str__(self):
         return f"{self.public_order_id} - {self.status}"
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="items")
     product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True)
+    # the product's seller at purchase, stamped by link_order_sellers; the line
+    # still counts for the seller after the product is deleted
+    seller = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
     quantity = models.PositiveIntegerField()
     price_at_purchase = models.DecimalField(max_digits=10, decimal_places=2)
 
     def __str__(self):
         return f"{self.product} x {self.quantity}"
 
+class OrderSeller(models.Model):
+    # one row per seller with items in an order, so seller order lists never scan the global order table
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="seller_links")
+    seller = models.ForeignKey(User, on_delete=models.CASCADE, related_name="order_links")
+    # copies of the order's columns; status is kept in step by Order.save()
+    created_at = models.DateTimeField()
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+
+    class Meta:
+        unique_together = ("order", "seller")
+        indexes = [
+            models.Index(fields=["seller", "created_at", "id"], name="order_seller_created_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.order_id} - {self.seller_id}"
+
+def link_order_sellers(order):
+    """
+    Stamp the seller on the items of a new order and create its OrderSeller
+    rows from them, in one statement.
+    """
+    item = OrderItem._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            WITH stamped AS (
+                UPDATE {item} i SET seller_id = p.seller_id
+                FROM {Product._meta.db_table} p
+                WHERE p.id = i.product_id AND i.order_id = %(order_id)s
+                RETURNING i.seller_id
+            )
+            INSERT INTO {OrderSeller._meta.db_table} (order_id, seller_id, created_at, status)
+            SELECT DISTINCT %(order_id)s, seller_id, %(created_at)s, %(status)s
+            FROM stamped
+            ON CONFLICT (order_id, seller_id) DO NOTHING
+            """,
+            {"order_id": order.pk, "created_at": order.created_at, "status": order.status},
+        )
+
+class StockReservation(models.Model):
+    # stock held for a PENDING order until it is paid, fails or expires
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="reservations")
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    shard = models.PositiveSmallIntegerField(null=True, blank=True)
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.order_id} holds {self.product_id} x {self.quantity}"
+
+class SellerStats(models.Model):
+    # dashboard totals kept up to date by the Order/Product hooks below; rebuild_seller_stats recomputes them
+    seller = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name="seller_stats")
+    products_count = models.IntegerField(default=0)
+    orders_count = models.IntegerField(default=0)
+    # the seller's own line items in orders that count as sold
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.seller_id}: {self.products_count} products, {self.orders_count} orders"
+
+# orders whose line items count towards seller revenue; .update() calls that
+# bypass Order.save() only move orders between statuses outside this set
+REVENUE_STATUSES = ("PAID", "VERIFIED", "SHIPPED", "DELIVERED")
+
+def revenue_sign(old_status, new_status):
+    return (new_status in REVENUE_STATUSES) - (old_status in REVENUE_STATUSES)
+
+def apply_seller_order_change(order_id, orders_delta=0, revenue_sign=0):
+    """
+    Add an order's line items to (or take them from) the stats of every
+    seller in it, in one INSERT ... ON CONFLICT DO UPDATE col = col + n.
+    """
+    if not orders_delta and not revenue_sign:
+        return
+    stats = SellerStats._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {stats} (seller_id, products_count, orders_count, revenue, updated_at)
+            SELECT COALESCE(i.seller_id, p.seller_id), 0, %(orders)s,
+                   %(sign)s * SUM(i.quantity * i.price_at_purchase), now()
+            FROM {OrderItem._meta.db_table} i
+            LEFT JOIN {Product._meta.db_table} p ON p.id = i.product_id
+            WHERE i.order_id = %(order_id)s AND COALESCE(i.seller_id, p.seller_id) IS NOT NULL
+            GROUP BY 1
+            ON CONFLICT (seller_id) DO UPDATE SET
+                orders_count = {stats}.orders_count + EXCLUDED.orders_count,
+                revenue = {stats}.revenue + EXCLUDED.revenue,
+                updated_at = EXCLUDED.updated_at
+            """,
+            {"orders": orders_delta, "sign": revenue_sign, "order_id": order_id},
+        )
+    if revenue_sign:
+        apply_sales_rollup_change(order_id, revenue_sign)
+
+class SalesRollup(models.Model):
+    # units and revenue sold per seller, product and order day, for the analytics endpoint
+    seller = models.ForeignKey(User, on_delete=models.CASCADE, related_name="sales_rollups")
+    # no FK constraint: the history stays when a product is deleted
+    product = models.ForeignKey(Product, on_delete=models.DO_NOTHING, db_constraint=False, related_name="+")
+    day = models.DateField()
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ("seller", "product", "day")
+        indexes = [
+            models.Index(fields=["seller", "day"], name="sales_rollup_seller_day_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.seller_id} {self.product_id} {self.day}: {self.units}"
+
+def apply_sales_rollup_change(order_id, sign):
+    """Add (sign=1) or remove (sign=-1) an order's line items in the daily rollups."""
+    rollup = SalesRollup._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {rollup} (seller_id, product_id, day, units, revenue)
+            SELECT p.seller_id, i.product_id, (o.created_at AT TIME ZONE %(tz)s)::date,
+                   %(sign)s * SUM(i.quantity), %(sign)s * SUM(i.quantity * i.price_at_purchase)
+            FROM {OrderItem._meta.db_table} i
+            JOIN {Product._meta.db_table} p ON p.id = i.product_id
+            JOIN {Order._meta.db_table} o ON o.id = i.order_id
+            WHERE i.order_id = %(order_id)s
+            GROUP BY p.seller_id, i.product_id, o.created_at
+            ON CONFLICT (seller_id, product_id, day) DO UPDATE SET
+                units = {rollup}.units + EXCLUDED.units,
+                revenue = {rollup}.revenue + EXCLUDED.revenue
+            """,
+            {"tz": settings.TIME_ZONE, "sign": sign, "order_id": order_id},
+        )
+
+def apply_seller_product_change(seller_id, delta):
+    stats = SellerStats._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {stats} (seller_id, products_count, orders_count, revenue, updated_at)
+            VALUES (%(seller_id)s, %(delta)s, 0, 0, now())
+            ON CONFLICT (seller_id) DO UPDATE SET
+                products_count = {stats}.products_count + EXCLUDED.products_count,
+                updated_at = EXCLUDED.updated_at
+            """,
+            {"seller_id": seller_id, "delta": delta},
+        )
+
+@receiver(pre_delete, sender=Order)
+def remove_order_from_seller_stats(sender, instance, **kwargs):
+    # pre_delete: the line items are still there to attribute
+    apply_seller_order_change(
+        instance.pk, orders_delta=-1, revenue_sign=-(instance.status in REVENUE_STATUSES)
+    )
+
+@receiver(post_save, sender=Product)
+def add_product_to_seller_stats(sender, instance, created, **kwargs):
+    if created:
+        apply_seller_product_change(instance.seller_id, 1)
+
+@receiver(post_delete, sender=Product)
+def remove_product_from_seller_stats(sender, instance, **kwargs):
+    apply_seller_product_change(instance.seller_id, -1)
+
 class Wishlist(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="wishlist")
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
@@ -150,10 +449,60 @@ class Review(models.Model):
 
     class Meta:
         unique_together = ("user", "product")
+        indexes = [
+            # newest / highest / lowest review pages for one product; "highest"
+            # walks review_product_rating_idx backwards, "lowest" mixes
+            # directions and needs its own
+            models.Index(fields=["product", "created_at", "id"], name="review_product_created_idx"),
+            models.Index(fields=["product", "rating", "created_at", "id"], name="review_product_rating_idx"),
+            models.Index(fields=["product", "rating", "-created_at", "-id"], name="review_product_rating_low_idx"),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # remember the stored rating so an edit can move it between buckets
+        instance._stored_rating = instance.__dict__.get("rating")
+        return instance
+
+    def save(self, *args, **kwargs):
+        old_rating = None if self._state.adding else getattr(self, "_stored_rating", None)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            apply_rating_change(self.product_id, old_rating, self.rating)
+        self._stored_rating = self.rating
 
     def __str__(self):
         return f"{self.rating}★ - {self.product.title}"
 
+def apply_rating_change(product_id, old_rating, new_rating):
+    """
+    Move one review between the aggregates of its product with a single
+    UPDATE ... SET col = col + n, so concurrent reviews never lose counts.
+    """
+    deltas = {}
+    if old_rating:
+        deltas["rating_sum"] = deltas.get("rating_sum", 0) - old_rating
+        deltas["rating_count"] = deltas.get("rating_count", 0) - 1
+        deltas[f"rating_{old_rating}"] = deltas.get(f"rating_{old_rating}", 0) - 1
+    if new_rating:
+        deltas["rating_sum"] = deltas.get("rating_sum", 0) + new_rating
+        deltas["rating_count"] = deltas.get("rating_count", 0) + 1
+        deltas[f"rating_{new_rating}"] = deltas.get(f"rating_{new_rating}", 0) + 1
+    deltas = {field: delta for field, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    Product.objects.filter(pk=product_id).update(
+        **{field: models.F(field) + delta for field, delta in deltas.items()}
+    )
+    # ratings are part of the listing payload and .update() skips post_save
+    bump_catalog_version()
+
+@receiver(post_delete, sender=Review)
+def remove_review_rating(sender, instance, **kwargs):
+    rating = getattr(instance, "_stored_rating", None) or instance.rating
+    apply_rating_change(instance.product_id, rating, None)
+
 class Offer(models.Model):
     COUPON_TYPE = (
         ("PERCENT", "Percent"),
@@ -167,6 +516,90 @@ class Offer(models.Model):
     def __str__(self):
         return self.coupon
 
+# cached cart quotes are keyed on the offer version
+@receiver(post_save, sender=Offer)
+@receiver(post_delete, sender=Offer)
+def invalidate_cart_quotes(sender, **kwargs):
+    bump_offer_version()
+
+class IdempotencyRecord(models.Model):
+    # response of a request sent with an Idempotency-Key header, replayed on retries
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="idempotency_records")
+    scope = models.CharField(max_length=50)
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64)
+    # null while the first request is still running
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    # lease of the running request; a retry takes the key over once it lapses
+    locked_until = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        unique_together = ("user", "scope", "key")
+
+    def __str__(self):
+        return f"{self.scope}:{self.key} - {self.response_status}"
+
+class WebhookEvent(models.Model):
+    # verified gateway webhook, stored before acknowledging and handled by process_webhooks
+    STATUS_CHOICES = (
+        ("PENDING", "Pending"),
+        ("PROCESSED", "Processed"),
+        ("FAILED", "Failed"),
+    )
+
+    event_id = models.CharField(max_length=100, unique=True)
+    event = models.CharField(max_length=50)
+    payload = models.JSONField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="PENDING")
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True, default="")
+    available_at = models.DateTimeField(default=timezone.now)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "available_at"], name="webhook_event_pending_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.event_id} {self.event} - {self.status}"
+
+class OutboxEmail(models.Model):
+    # transactional mail queued with the change that caused it, sent by ecommerce.outbox
+    KIND_CHOICES = (
+        ("order_completed", "Order completed"),
+    )
+    STATUS_CHOICES = (
+        ("PENDING", "Pending"),
+        ("SENT", "Sent"),
+        ("FAILED", "Failed"),
+    )
+
+    kind = models.CharField(max_length=30, choices=KIND_CHOICES)
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="emails")
+    to_email = models.EmailField(blank=True, default="")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="PENDING")
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True, default="")
+    # next attempt, pushed forward while a worker holds the row and on retry
+    available_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        # the verify view and the webhook both confirm an order; it is mailed once
+        unique_together = ("kind", "order")
+        indexes = [
+            models.Index(fields=["status", "available_at"], name="outbox_email_pending_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.order_id} - {self.status}"
+
 class ContactMessage(models.Model):
     SUBJECT_CHOICES = (
         ("general", "General Inquiry"),
@@ -205,3 +638,66 @@ class ContactMessage(models.Model):
 
     def __str__(self):
         return f"{self.name} - {self.email}"
+
+
+class RoleVersion(models.Model):
+    # bumped whenever the user's groups change; tokens carry the version they were issued under
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name="role_version")
+    version = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user_id} v{self.version}"
+
+def bump_role_version(user_ids):
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    table = RoleVersion._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {table} (user_id, version)
+            SELECT unnest(%s::integer[]), 1
+            ON CONFLICT (user_id) DO UPDATE SET version = {table}.version + 1
+            """,
+            [user_ids],
+        )
+    # dropped after commit so a rolled back change never leaves a newer version cached
+    transaction.on_commit(lambda: [forget_role_version(user_id) for user_id in user_ids])
+
+@receiver(m2m_changed, sender=User.groups.through)
+def role_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == "pre_clear":
+        # group.user_set.clear(): the members are gone by post_clear
+        instance._cleared_user_ids = list(instance.user_set.values_list("pk", flat=True))
+        return
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if action != "post_clear" and not pk_set:
+        return
+    if not reverse:
+        bump_role_version([instance.pk])
+    elif action == "post_clear":
+        bump_role_version(getattr(instance, "_cleared_user_ids", []))
+    else:
+        bump_role_version(pk_set or [])
+
+class ClaimsUser(User):
+    """
+    A User known only by the id in its access token. The other columns are
+    deferred and all filled in at once, from a short-lived per-process cache,
+    the first time any of them is read; see authentication.py.
+    """
+    class Meta:
+        proxy = True
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        deferred = self.get_deferred_fields()
+        if not fields or from_queryset is not None or not set(fields) <= deferred:
+            return super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        from .authentication import cached_user_values
+        values = cached_user_values(self.pk)
+        if values is None:
+            raise self.DoesNotExist(f"User {self.pk} no longer exists")
+        for attname in deferred:
+            setattr(self, attname, values[attname])
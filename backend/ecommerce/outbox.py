@@ -0,0 +1,159 @@
+"""
+Transactional email outbox.
+
+Mail is queued as an OutboxEmail row in the same transaction as the change
+that caused it, so it is neither lost on a crash nor sent for a rolled back
+order. send_batch claims due rows with SKIP LOCKED, sends them over one
+backend connection and reschedules failures with exponential backoff.
+
+Rows are drained either by a small in-process thread pool woken after each
+commit (EMAIL_OUTBOX_MODE = "thread") or only by the send_outbox_emails
+command (EMAIL_OUTBOX_MODE = "command").
+"""
+import logging
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.db import connection as db_connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .mailers import build_order_completed_email, prefetch_order_email_data
+from .models import OutboxEmail
+
+logger = logging.getLogger(__name__)
+
+BUILDERS = {
+    "order_completed": build_order_completed_email,
+}
+# loads what the builders read for a whole batch in a fixed number of queries
+PREFETCHERS = {
+    "order_completed": prefetch_order_email_data,
+}
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def backoff(attempts):
+    base = _setting("EMAIL_OUTBOX_RETRY_SECONDS", 30)
+    return timedelta(seconds=min(base * 2 ** (attempts - 1), _setting("EMAIL_OUTBOX_MAX_RETRY_SECONDS", 3600)))
+
+
+def enqueue_order_completed(orders):
+    """Queue one confirmation per order; orders already queued are skipped."""
+    OutboxEmail.objects.bulk_create(
+        [OutboxEmail(kind="order_completed", order=order) for order in orders],
+        ignore_conflicts=True,
+    )
+    if _setting("EMAIL_OUTBOX_MODE", "thread") == "thread":
+        transaction.on_commit(wake)
+
+
+def send_batch(batch_size=50, max_attempts=None):
+    """
+    Send up to batch_size due emails over a single connection. Returns the
+    number of rows claimed, 0 when nothing is due.
+    """
+    max_attempts = max_attempts or _setting("EMAIL_OUTBOX_MAX_ATTEMPTS", 6)
+    now = timezone.now()
+    with transaction.atomic():
+        emails = list(
+            OutboxEmail.objects.select_for_update(skip_locked=True, of=("self",))
+            .filter(status="PENDING", available_at__lte=now)
+            .select_related("order__user")
+            .order_by("id")[:batch_size]
+        )
+        if not emails:
+            return 0
+        # lease the rows, so a worker that dies mid-send only delays them
+        OutboxEmail.objects.filter(pk__in=[email.pk for email in emails]).update(
+            attempts=F("attempts") + 1,
+            available_at=now + timedelta(seconds=_setting("EMAIL_OUTBOX_LEASE_SECONDS", 300)),
+        )
+
+    for email in emails:
+        email.attempts += 1
+    for kind, prefetch in PREFETCHERS.items():
+        prefetch([email.order for email in emails if email.kind == kind])
+    mail_connection = get_connection()
+    try:
+        mail_connection.open()
+    except Exception:
+        # nothing in this batch can go out
+        error = traceback.format_exc(limit=5)
+        for email in emails:
+            _failed(email, error, max_attempts)
+    else:
+        try:
+            for email in emails:
+                try:
+                    build = BUILDERS[email.kind]
+                    build(email.order, email.to_email or None, connection=mail_connection).send()
+                except Exception:
+                    _failed(email, traceback.format_exc(limit=5), max_attempts)
+                else:
+                    email.status = "SENT"
+                    email.sent_at = timezone.now()
+                    email.last_error = ""
+        finally:
+            mail_connection.close()
+
+    OutboxEmail.objects.bulk_update(emails, ["status", "last_error", "available_at", "sent_at"])
+    return len(emails)
+
+
+def _failed(email, error, max_attempts):
+    email.last_error = error
+    if email.attempts >= max_attempts:
+        email.status = "FAILED"
+        logger.error("Giving up on %s after %s attempts", email, email.attempts)
+    else:
+        email.available_at = timezone.now() + backoff(email.attempts)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(max(1, _setting("EMAIL_OUTBOX_WORKERS", 2)))
+_wanted = threading.Event()
+
+
+def _pool():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=_setting("EMAIL_OUTBOX_WORKERS", 2), thread_name_prefix="email-outbox"
+            )
+        return _executor
+
+
+def wake():
+    """
+    Ask the in-process pool to drain the outbox. At most EMAIL_OUTBOX_WORKERS
+    drains run at once; a wake while they are all busy is picked up by one
+    of them before it exits.
+    """
+    _wanted.set()
+    if _slots.acquire(blocking=False):
+        _pool().submit(_drain)
+
+
+def _drain():
+    while True:
+        try:
+            _wanted.clear()
+            while send_batch(_setting("EMAIL_OUTBOX_BATCH_SIZE", 50)):
+                pass
+        except Exception:
+            logger.exception("Email outbox drain failed")
+        finally:
+            db_connection.close()
+            _slots.release()
+        if not _wanted.is_set() or not _slots.acquire(blocking=False):
+            return
@@ -0,0 +1,174 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class ProductPagination(PageNumberPagination):
+    page_size = 9
+    page_size_query_param = "page_size"
+    max_page_size = 30
+
+
+class KeysetPagination(BasePagination):
+    """
+    Seek pagination over a unique ordering, (created_at, id) newest first by
+    default.
+
+    Every page is a single indexed range scan no matter how deep the client
+    scrolls, unlike OFFSET. Cursors are opaque base64 tokens, and the total
+    count can be skipped with ?skip_count=1 for infinite scroll.
+    """
+    page_size = 9
+    page_size_query_param = "page_size"
+    max_page_size = 30
+    cursor_query_param = "cursor"
+    skip_count_query_param = "skip_count"
+    invalid_cursor_message = "Invalid cursor"
+    results_key = "results"
+    # must end in a unique column so every row has a distinct position
+    ordering = ("-created_at", "-id")
+
+    def __init__(self, ordering=None):
+        if ordering is not None:
+            self.ordering = tuple(ordering)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.count = None
+        if request.query_params.get(self.skip_count_query_param) not in ("1", "true"):
+            self.count = queryset.order_by().count()
+
+        cursor = self.decode_cursor(request, queryset.model)
+        self.reverse = bool(cursor and cursor["r"])
+
+        if cursor:
+            queryset = queryset.filter(self.seek_filter(cursor["v"]))
+        queryset = queryset.order_by(*self.get_ordering(self.reverse))
+
+        # one extra row tells us whether there is another page in that direction
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+
+        if self.reverse:
+            rows.reverse()
+            self.has_next = True
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = cursor is not None
+
+        self.page = rows
+        return rows
+
+    def get_paginated_response(self, data):
+        payload = {
+            "next": self.get_next_link(),
+            "previous": self.get_previous_link(),
+            self.results_key: data,
+        }
+        if self.count is not None:
+            payload = {"count": self.count, **payload}
+        return Response(payload)
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def get_ordering(self, reverse=False):
+        if not reverse:
+            return self.ordering
+        return tuple(field[1:] if field.startswith("-") else f"-{field}" for field in self.ordering)
+
+    def seek_filter(self, values):
+        """
+        Rows strictly after `values` in the current direction:
+        (a > x) OR (a = x AND b > y) OR ... with each comparison flipped for
+        descending columns.
+        """
+        condition = Q()
+        equal = Q()
+        for field, value in zip(self.get_ordering(self.reverse), values):
+            name = field.lstrip("-")
+            lookup = "lt" if field.startswith("-") else "gt"
+            condition |= equal & Q(**{f"{name}__{lookup}": value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.build_link(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.build_link(self.page[0], reverse=True)
+
+    def build_link(self, obj, reverse):
+        return replace_query_param(
+            self.base_url, self.cursor_query_param, self.encode_cursor(obj, reverse)
+        )
+
+    def encode_cursor(self, obj, reverse):
+        values = []
+        for field in self.ordering:
+            name = field.lstrip("-")
+            # pages may hold model instances or values() rows
+            value = obj[name] if isinstance(obj, dict) else getattr(obj, name)
+            values.append(value.isoformat() if isinstance(value, datetime) else value)
+        raw = json.dumps({"v": values, "r": int(reverse)})
+        return urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+    def decode_cursor(self, request, model):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            padded = token + "=" * (-len(token) % 4)
+            cursor = json.loads(urlsafe_b64decode(padded.encode()))
+            values = cursor["v"]
+            if len(values) != len(self.ordering):
+                raise ValueError("cursor does not match ordering")
+            return {
+                "v": [
+                    model._meta.get_field(field.lstrip("-")).to_python(value)
+                    for field, value in zip(self.ordering, values)
+                ],
+                "r": bool(cursor.get("r")),
+            }
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+
+class OrderPagination(KeysetPagination):
+    page_size = 10
+    max_page_size = 50
+    results_key = "orders"
+
+
+def select_paginator(request):
+    """
+    Page numbers stay the default; clients opt in to keyset pages with
+    ?pagination=cursor (follow-up links carry ?cursor=).
+    """
+    params = request.query_params
+    if params.get("pagination") == "cursor" or KeysetPagination.cursor_query_param in params:
+        return KeysetPagination()
+    return ProductPagination()
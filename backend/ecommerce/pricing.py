@@ -0,0 +1,143 @@
+"""
+Checkout pricing shared by the cart quote endpoint, apply_offer and order
+creation, so subtotal, coupon, gift wrap and total are computed one way.
+"""
+import hashlib
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.core.cache import cache
+
+from .cache import catalog_version, offer_version
+from .models import CartItem, CartVersion, Offer, Product
+
+GIFT_WRAP_PRICE = Decimal("10.00")
+DIRECT_DISCOUNT_CAP = Decimal("0.50")
+QUOTE_CACHE_TIMEOUT = 300
+
+CENT = Decimal("0.01")
+
+
+class PricingError(Exception):
+    pass
+
+
+def calculate_discount(subtotal, offer):
+    if offer is None:
+        return Decimal("0.00")
+
+    if offer.type == "PERCENT":
+        # Percentage discount
+        discount = (subtotal * Decimal(offer.unit)) / Decimal(100)
+    elif offer.type == "DIRECT":
+        # Direct discount with 50% cap
+        discount = min(Decimal(offer.unit), subtotal * DIRECT_DISCOUNT_CAP)
+    else:
+        discount = Decimal("0.00")
+
+    # Safety: discount should never exceed subtotal
+    return min(discount, subtotal).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def get_offer(coupon_code):
+    if not coupon_code:
+        return None
+    try:
+        return Offer.objects.get(coupon=coupon_code)
+    except Offer.DoesNotExist:
+        raise PricingError("Invalid coupon code.")
+
+
+def build_quote(subtotal, lines=(), offer=None, gift_wrap=False):
+    subtotal = Decimal(subtotal).quantize(CENT, rounding=ROUND_HALF_UP)
+    discount = calculate_discount(subtotal, offer)
+    gift_wrap_amount = GIFT_WRAP_PRICE if gift_wrap else Decimal("0.00")
+    return {
+        "items": list(lines),
+        "subtotal": subtotal,
+        "coupon": offer.coupon if offer else None,
+        "discount_type": offer.type if offer else None,
+        "discount_value": offer.unit if offer else None,
+        "discount": discount,
+        "gift_wrap": gift_wrap,
+        "gift_wrap_amount": gift_wrap_amount,
+        "total": subtotal - discount + gift_wrap_amount,
+    }
+
+
+def _line(product_pk, public_product_id, title, price, quantity):
+    return {
+        "product": product_pk,
+        "product_id": public_product_id,
+        "title": title,
+        "price": price,
+        "quantity": quantity,
+        "line_total": price * quantity,
+    }
+
+
+def quote_items(items, coupon_code=None, gift_wrap=False):
+    """
+    Price explicit [{"product_id": "PRD-...", "quantity": n}] lines with a
+    single IN query for all products.
+    """
+    products = {
+        row["public_product_id"]: row
+        for row in Product.objects.filter(
+            public_product_id__in={item["product_id"] for item in items}, is_active=True
+        ).values("id", "public_product_id", "title", "price")
+    }
+    lines = []
+    for item in items:
+        product = products.get(item["product_id"])
+        if product is None:
+            raise PricingError(f"Product {item['product_id']} not found.")
+        lines.append(_line(
+            product["id"], product["public_product_id"], product["title"],
+            product["price"], item["quantity"],
+        ))
+    subtotal = sum((line["line_total"] for line in lines), Decimal("0.00"))
+    return build_quote(subtotal, lines, get_offer(coupon_code), gift_wrap)
+
+
+def quote_cart(user, coupon_code=None, gift_wrap=False, cached=True):
+    """
+    Price the user's cart from one CartItem/Product join. The result is
+    cached per cart, catalog and offer version, so repeated quotes during
+    checkout are a cache hit until the cart, a product or a coupon changes.
+    Orders are priced with cached=False, from the current rows only.
+    """
+    if not cached:
+        return _price_cart(user, coupon_code, gift_wrap)
+
+    cart_version = CartVersion.objects.filter(user=user).values_list("version", flat=True).first() or 0
+    coupon_hash = hashlib.sha256((coupon_code or "").encode()).hexdigest()[:16]
+    key = (
+        f"cart_quote:{user.pk}:{cart_version}:{catalog_version()}:{offer_version()}"
+        f":{coupon_hash}:{int(bool(gift_wrap))}"
+    )
+    quote = cache.get(key)
+    if quote is not None:
+        return quote
+
+    quote = _price_cart(user, coupon_code, gift_wrap)
+    cache.set(key, quote, timeout=QUOTE_CACHE_TIMEOUT)
+    return quote
+
+
+def _price_cart(user, coupon_code, gift_wrap):
+    rows = CartItem.objects.filter(user=user, product__is_active=True).values_list(
+        "product_id", "product__public_product_id", "product__title", "product__price", "quantity"
+    ).order_by("id")
+    lines = [_line(*row) for row in rows]
+    subtotal = sum((line["line_total"] for line in lines), Decimal("0.00"))
+    return build_quote(subtotal, lines, get_offer(coupon_code), gift_wrap)
+
+
+def quote_payload(quote):
+    """Public JSON shape of a quote, without internal primary keys."""
+    payload = {key: value for key, value in quote.items() if key != "items"}
+    payload["items"] = [
+        {key: value for key, value in line.items() if key != "product"}
+        for line in quote["items"]
+    ]
+    return payload
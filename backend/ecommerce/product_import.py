@@ -0,0 +1,327 @@
+"""
+Bulk product import for sellers.
+
+The upload is read one row at a time from CSV or JSON lines, validated a
+chunk at a time and written with bulk_create in batches, so memory stays
+bounded by the batch size whatever the catalog size. bulk_create skips
+signals, so the catalog version and SellerStats are updated here. Products
+are created without an image; a row's image_url is fetched, checked and
+stored by a background pool afterwards. Existing storage keys are not
+accepted, so a seller cannot point a product at another seller's file.
+"""
+import csv
+import http.client
+import io
+import ipaddress
+import json
+import logging
+import os
+import socket
+import ssl
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, urlparse
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection as db_connection, transaction
+from PIL import Image
+from rest_framework.exceptions import ValidationError
+
+from .cache import bump_catalog_version
+from .models import Inventory, Product, apply_seller_product_change
+from .serializers import ProductImportRowSerializer
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("csv", "jsonl")
+MAX_REPORTED_ERRORS = 1000
+MAX_IMAGE_REDIRECTS = 3
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def detect_format(filename, requested=None):
+    fmt = (requested or os.path.splitext(filename or "")[1].lstrip(".")).lower()
+    if fmt == "ndjson":
+        fmt = "jsonl"
+    return fmt if fmt in FORMATS else None
+
+
+def read_rows(stream, fmt):
+    """
+    Yield (row_number, data, error) for every record of a binary stream.
+    Undecodable JSON lines come back as errors instead of stopping the import.
+    """
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    if fmt == "csv":
+        for number, row in enumerate(csv.DictReader(text), start=1):
+            yield number, row, None
+        return
+
+    for number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError as e:
+            yield number, None, f"Invalid JSON: {e}"
+            continue
+        if not isinstance(data, dict):
+            yield number, None, "Each line must be a JSON object"
+            continue
+        yield number, data, None
+
+
+def _clean(data):
+    # CSV has no nulls; an empty cell means "use the default"
+    return {
+        key.strip(): value.strip() if isinstance(value, str) else value
+        for key, value in data.items()
+        if key and value not in ("", None)
+    }
+
+
+class ProductImport:
+    def __init__(self, seller, batch_size=None, image_pool=None):
+        self.seller = seller
+        self.batch_size = batch_size or _setting("PRODUCT_IMPORT_BATCH_SIZE", 500)
+        self.image_pool = image_pool
+        self.created = 0
+        self.failed = 0
+        self.images_queued = 0
+        self.errors = []
+
+    def run(self, stream, fmt):
+        pending = []
+        for number, data, error in read_rows(stream, fmt):
+            if error:
+                self._error(number, error)
+                continue
+            pending.append((number, _clean(data)))
+            if len(pending) >= self.batch_size:
+                self._import_chunk(pending)
+                pending = []
+        if pending:
+            self._import_chunk(pending)
+        return self.report()
+
+    def report(self):
+        return {
+            "created": self.created,
+            "failed": self.failed,
+            "images_queued": self.images_queued,
+            "errors": self.errors,
+            "errors_truncated": self.failed > len(self.errors),
+        }
+
+    def _error(self, number, errors):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"row": number, "errors": errors})
+
+    def _import_chunk(self, rows):
+        validator = ProductImportRowSerializer()
+        valid = []
+        for number, data in rows:
+            try:
+                valid.append(validator.run_validation(data))
+            except ValidationError as e:
+                self._error(number, e.detail)
+        if not valid:
+            return
+
+        products = [
+            Product(
+                seller=self.seller,
+                title=row["title"],
+                price=row["price"],
+                description=row["description"],
+                category=row["category"],
+            )
+            for row in valid
+        ]
+        with transaction.atomic():
+            Product.objects.bulk_create(products)
+            Inventory.objects.bulk_create([
+                Inventory(product=product, stock_quantity=row["stock"])
+                for product, row in zip(products, valid)
+            ])
+            apply_seller_product_change(self.seller.pk, len(products))
+        bump_catalog_version()
+        self.created += len(products)
+
+        images = [
+            (product.pk, product.public_product_id, row["image_url"])
+            for product, row in zip(products, valid)
+            if row["image_url"]
+        ]
+        if images and self.image_pool is not None:
+            self.image_pool.submit(images)
+            self.images_queued += len(images)
+
+
+class ImagePool:
+    """
+    Fetch, verify and store product images off the request thread. At most
+    `workers` downloads run at once; each finished product image bumps the
+    catalog version so listings pick it up.
+    """
+
+    def __init__(self, workers=None):
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers or _setting("PRODUCT_IMPORT_IMAGE_WORKERS", 4),
+            thread_name_prefix="product-import-images",
+        )
+        self.stored = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+
+    def submit(self, images):
+        for image in images:
+            self.executor.submit(self._store, *image)
+
+    def wait(self):
+        """Block until every submitted image is handled; returns (stored, failed)."""
+        self.executor.shutdown(wait=True)
+        return self.stored, self.failed
+
+    def _store(self, product_pk, public_product_id, url):
+        try:
+            body, extension = fetch_image(url)
+            name = default_storage.save(f"products/{public_product_id}.{extension}", ContentFile(body))
+            Product.objects.filter(pk=product_pk).update(image=name)
+            bump_catalog_version()
+            stored = True
+        except Exception as e:
+            logger.warning("Image for %s from %s failed: %s", public_product_id, url, e)
+            stored = False
+        finally:
+            db_connection.close()
+        with self._lock:
+            if stored:
+                self.stored += 1
+            else:
+                self.failed += 1
+
+
+class _PinnedHTTPConnection(http.client.HTTPConnection):
+    """Talks to `address` while sending the URL's own host name."""
+
+    def __init__(self, host, address, **kwargs):
+        super().__init__(host, **kwargs)
+        self.address = address
+
+    def connect(self):
+        self.sock = socket.create_connection((self.address, self.port), self.timeout)
+
+
+class _PinnedHTTPSConnection(http.client.HTTPSConnection):
+    """Like _PinnedHTTPConnection; the certificate is still checked against the host name."""
+
+    def __init__(self, host, address, **kwargs):
+        super().__init__(host, context=ssl.create_default_context(), **kwargs)
+        self.address = address
+
+    def connect(self):
+        sock = socket.create_connection((self.address, self.port), self.timeout)
+        self.sock = self._context.wrap_socket(sock, server_hostname=self.host)
+
+
+# NAT64 well-known prefix (RFC 6052): the IPv4 address sits in the last 32 bits
+NAT64_PREFIX = ipaddress.ip_network("64:ff9b::/96")
+# deprecated IPv4-compatible addresses, ::a.b.c.d
+IPV4_COMPATIBLE_PREFIX = ipaddress.ip_network("::/96")
+
+
+def _embedded_ipv4(ip):
+    """The IPv4 address an IPv6 address tunnels or translates to, if any."""
+    if ip.version == 4:
+        return None
+    if ip.ipv4_mapped is not None:
+        return ip.ipv4_mapped
+    if ip.sixtofour is not None:
+        return ip.sixtofour
+    if ip in NAT64_PREFIX or ip in IPV4_COMPATIBLE_PREFIX:
+        return ipaddress.IPv4Address(int(ip) & 0xFFFFFFFF)
+    return None
+
+
+def _is_public(ip):
+    # ::ffff:127.0.0.1 and friends reach the embedded address, so it must be public too
+    embedded = _embedded_ipv4(ip)
+    return ip.is_global and (embedded is None or embedded.is_global)
+
+
+def _resolve(parsed):
+    """
+    Resolve the URL's host once and return the address to connect to. The
+    connection goes to this exact address, so a second DNS answer cannot
+    swap in a private one after the check.
+    """
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise ValueError("Only http(s) image URLs are supported")
+    port = parsed.port or (443 if parsed.scheme == "https" else 80)
+    addresses = [info[4][0] for info in socket.getaddrinfo(parsed.hostname, port, type=socket.SOCK_STREAM)]
+    if not addresses:
+        raise ValueError(f"Image host {parsed.hostname} does not resolve")
+    if not _setting("PRODUCT_IMPORT_ALLOW_PRIVATE_IMAGE_HOSTS", False):
+        # seller supplied URLs must not reach into our own network
+        for address in addresses:
+            if not _is_public(ipaddress.ip_address(address)):
+                raise ValueError(f"Image host {parsed.hostname} is not public")
+    return addresses[0], port
+
+
+def fetch_image(url):
+    """
+    Download an image, refusing non-http URLs, non-public hosts, oversized
+    bodies and non-images. Redirects are followed by hand so that every hop
+    goes through the same host check.
+    """
+    max_bytes = _setting("PRODUCT_IMPORT_IMAGE_MAX_BYTES", 5 * 1024 * 1024)
+    timeout = _setting("PRODUCT_IMPORT_IMAGE_TIMEOUT", 10)
+    for _ in range(MAX_IMAGE_REDIRECTS + 1):
+        parsed = urlparse(url)
+        address, port = _resolve(parsed)
+        connection_class = _PinnedHTTPSConnection if parsed.scheme == "https" else _PinnedHTTPConnection
+        conn = connection_class(parsed.hostname, address, port=port, timeout=timeout)
+        try:
+            path = parsed.path or "/"
+            conn.request("GET", f"{path}?{parsed.query}" if parsed.query else path)
+            response = conn.getresponse()
+            location = response.getheader("Location")
+            if response.status in (301, 302, 303, 307, 308) and location:
+                url = urljoin(url, location)
+                continue
+            if response.status != 200:
+                raise ValueError(f"Image download failed with HTTP {response.status}")
+            body = response.read(max_bytes + 1)
+        finally:
+            conn.close()
+        break
+    else:
+        raise ValueError("Too many redirects")
+
+    if len(body) > max_bytes:
+        raise ValueError("Image is too large")
+    with Image.open(io.BytesIO(body)) as image:
+        image.verify()
+        extension = (image.format or "jpeg").lower()
+    return body, "jpg" if extension == "jpeg" else extension
+
+
+_shared_pool = None
+_shared_pool_lock = threading.Lock()
+
+
+def shared_image_pool():
+    """Process-wide pool used by the import endpoint, created on first use."""
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            _shared_pool = ImagePool()
+        return _shared_pool
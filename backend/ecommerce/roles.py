@@ -0,0 +1,128 @@
+"""
+Role claims in JWTs.
+
+Tokens carry the user's role and the RoleVersion it was read under, so role
+checks on API calls read the token instead of querying auth_group. A change
+to the user's groups bumps RoleVersion; tokens issued before it stop passing
+role checks until they are refreshed, which stamps the current role again.
+The current version comes from the cache (ROLE_VERSION_CACHE_SECONDS), so
+with a per-process cache another process notices a change within that time.
+"""
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from rest_framework.permissions import BasePermission
+from rest_framework.response import Response
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .cache import role_version_cache_key
+from .models import RoleVersion
+
+ROLE_CLAIM = "role"
+ROLE_VERSION_CLAIM = "role_ver"
+DEFAULT_ROLE = "user"
+
+
+def user_role(user):
+    """The role of a user from their groups, in one query; "seller" wins over others."""
+    names = list(user.groups.values_list("name", flat=True))
+    if "seller" in names:
+        return "seller"
+    return names[0] if names else DEFAULT_ROLE
+
+
+def role_version(user_id):
+    key = role_version_cache_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        version = RoleVersion.objects.filter(user_id=user_id).values_list("version", flat=True).first() or 0
+        cache.set(key, version, timeout=getattr(settings, "ROLE_VERSION_CACHE_SECONDS", 60))
+    return version
+
+
+def stamp_role(token, user):
+    # version first: a change landing in between leaves the token stale, never too new
+    token[ROLE_VERSION_CLAIM] = role_version(user.pk)
+    token[ROLE_CLAIM] = user_role(user)
+    return token
+
+
+class RoleRefreshToken(RefreshToken):
+    """Refresh token whose access tokens carry the role as of when they are minted."""
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        token._user = user
+        return stamp_role(token, user)
+
+    @property
+    def access_token(self):
+        access = super().access_token
+        if getattr(self, "_user", None) is None:
+            # refreshing: the claims copied from the refresh token may be stale
+            user_id = self.payload.get(api_settings.USER_ID_CLAIM)
+            if user_id is not None:
+                stamp_role(access, User(pk=int(user_id)))
+        return access
+
+
+class RoleTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = RoleRefreshToken
+
+
+def token_role(request):
+    """
+    The role claim of the request's JWT, or None when there is no token, the
+    token predates role claims or the role changed since it was issued.
+    Never reads the groups.
+    """
+    token = getattr(request, "auth", None)
+    if token is None or not hasattr(token, "payload") or ROLE_CLAIM not in token.payload:
+        return None
+    if token.payload.get(ROLE_VERSION_CLAIM) != role_version(request.user.pk):
+        return None
+    return token.payload[ROLE_CLAIM]
+
+
+def request_role(request):
+    """
+    The caller's role. Read from the token when it has a role claim (None if
+    the role changed since it was issued), from the groups otherwise, e.g.
+    for session logins and tokens minted before role claims existed.
+    """
+    user = request.user
+    if not user.is_authenticated:
+        return None
+    token = getattr(request, "auth", None)
+    if token is not None and hasattr(token, "payload") and ROLE_CLAIM in token.payload:
+        return token_role(request)
+    return user_role(user)
+
+
+class HasRole(BasePermission):
+    role = None
+    message = "You do not have permission to perform this action. If your role changed, refresh your token."
+
+    def has_permission(self, request, view):
+        return request_role(request) == self.role
+
+
+def role_required(*roles):
+    """
+    Restrict an @api_view function view to JWT callers whose role claim is
+    one of `roles`; put it below @api_view. Session callers go through
+    allowed_users instead.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if token_role(request) not in roles:
+                return Response({"error": HasRole.message}, status=403)
+            return view_func(request, *args, **kwargs)
+        return wrapper
+    return decorator
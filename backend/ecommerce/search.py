@@ -0,0 +1,33 @@
+import re
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import F
+
+SEARCH_CONFIG = "english"
+MAX_SEARCH_TERMS = 8
+
+_TERM_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def build_search_query(text):
+    """
+    Turn raw user input into a prefix tsquery, so "jut ba" matches "jute bag"
+    while the user is still typing. Returns None when nothing searchable is left.
+    """
+    terms = _TERM_RE.findall(text or "")[:MAX_SEARCH_TERMS]
+    if not terms:
+        return None
+    raw = " & ".join(f"{term}:*" for term in terms)
+    return SearchQuery(raw, search_type="raw", config=SEARCH_CONFIG)
+
+
+def search_products(queryset, text):
+    """
+    Filter products through the GIN indexed search_vector and annotate a
+    `rank` usable for relevance ordering.
+    """
+    query = build_search_query(text)
+    if query is None:
+        return queryset.none()
+    return queryset.filter(search_vector=query).annotate(
+        rank=SearchRank(F("search_vector"), query)
+    )
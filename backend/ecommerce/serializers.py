@@ -3,13 +3,17 @@
 from rest_framework import serializers
 from .models import *
 from django.contrib.auth.models import User, Group
-from rest_framework_simplejwt.tokens import RefreshToken
+from .roles import ROLE_CLAIM, RoleRefreshToken
+from django.core.files.storage import default_storage
+from django.utils.encoding import filepath_to_uri
 from decimal import Decimal
+from . import inventory, pricing
 
 
 class ProductListSerializer(serializers.ModelSerializer):
     image = serializers.SerializerMethodField()
     seller = serializers.CharField(source="seller.username")
+    average_rating = serializers.FloatField(read_only=True)
 
     class Meta:
         model = Product
@@ -21,6 +25,8 @@ class ProductListSerializer(serializers.ModelSerializer):
             "image",
             "category",
             "seller",
+            "average_rating",
+            "rating_count",
             "created_at",
         ]
 
@@ -31,7 +37,70 @@ class ProductListSerializer(serializers.ModelSerializer):
                 "127.0.0.1", "localhost"
             )
         return None
-    
+
+
+def media_url_prefix(request):
+    # storage.url() per row is the hot spot of list rendering, the prefix is
+    # the same for every image so it is resolved once per response
+    prefix = default_storage.url("")
+    if request:
+        prefix = request.build_absolute_uri(prefix).replace("127.0.0.1", "localhost")
+    return prefix
+
+
+class ProductListValuesSerializer:
+    """
+    Read-only fast path producing the same payload as ProductListSerializer
+    from a `values()` queryset, so listings skip model instantiation and get
+    seller.username through the join instead of one query per row.
+    """
+    values_fields = (
+        "id",
+        "public_product_id",
+        "title",
+        "price",
+        "description",
+        "image",
+        "category",
+        "seller__username",
+        "rating_sum",
+        "rating_count",
+        "created_at",
+    )
+    price_field = serializers.DecimalField(max_digits=10, decimal_places=2)
+    created_at_field = serializers.DateTimeField()
+
+    def __init__(self, rows, context=None):
+        self.rows = rows
+        self.context = context or {}
+
+    @classmethod
+    def get_queryset(cls, queryset):
+        return queryset.values(*cls.values_fields)
+
+    @property
+    def data(self):
+        prefix = media_url_prefix(self.context.get("request"))
+        price = self.price_field.to_representation
+        created_at = self.created_at_field.to_representation
+        return [
+            {
+                "public_product_id": row["public_product_id"],
+                "title": row["title"],
+                "price": price(row["price"]),
+                "description": row["description"],
+                "image": prefix + filepath_to_uri(row["image"]) if row["image"] else None,
+                "category": row["category"],
+                "seller": row["seller__username"],
+                "average_rating": (
+                    round(row["rating_sum"] / row["rating_count"], 1) if row["rating_count"] else 0
+                ),
+                "rating_count": row["rating_count"],
+                "created_at": created_at(row["created_at"]),
+            }
+            for row in self.rows
+        ]
+
 class RegisterSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
     is_seller = serializers.BooleanField(write_only=True, required=False, default=False)
@@ -71,13 +140,13 @@ class LoginSerializer(serializers.Serializer):
         if not user:
             raise serializers.ValidationError("Invalid credentials")
 
-        refresh = RefreshToken.for_user(user)
+        refresh = RoleRefreshToken.for_user(user)
 
         return {
             "access": str(refresh.access_token),
             "refresh": str(refresh),
             "username": user.username,
-            "role": user.groups.first().name if user.groups.exists() else "user"
+            "role": refresh[ROLE_CLAIM],
         }
 
 
@@ -90,13 +159,17 @@ class ReviewSerializer(serializers.ModelSerializer):
 
 
 class ProductDetailSerializer(serializers.ModelSerializer):
+    # the rest of the reviews are paged through /api/product/<id>/reviews/
+    review_preview_limit = 5
+
     image = serializers.SerializerMethodField()
     seller = serializers.CharField(source="seller.username")
     stock_quantity = serializers.IntegerField(
-        source="inventory.stock_quantity", read_only=True
+        source="inventory.available_quantity", read_only=True
     )
-    reviews = ReviewSerializer(many=True, read_only=True)
-    average_rating = serializers.SerializerMethodField()
+    reviews = serializers.SerializerMethodField()
+    average_rating = serializers.FloatField(read_only=True)
+    rating_histogram = serializers.DictField(child=serializers.IntegerField(), read_only=True)
 
     class Meta:
         model = Product
@@ -110,6 +183,8 @@ class ProductDetailSerializer(serializers.ModelSerializer):
             "seller",
             "stock_quantity",
             "average_rating",
+            "rating_count",
+            "rating_histogram",
             "reviews",
             "created_at",
         ]
@@ -120,49 +195,35 @@ class ProductDetailSerializer(serializers.ModelSerializer):
             return request.build_absolute_uri(obj.image.url)
         return None
 
-    def get_average_rating(self, obj):
-        reviews = obj.reviews.all()
-        if reviews.exists():
-            return round(sum(r.rating for r in reviews) / reviews.count(), 1)
-        return 0
+    def get_reviews(self, obj):
+        reviews = obj.reviews.select_related("user").order_by("-created_at", "-id")
+        return ReviewSerializer(reviews[:self.review_preview_limit], many=True).data
 
 
 class OfferApplySerializer(serializers.Serializer):
     coupon = serializers.CharField()
-    cart_total = serializers.DecimalField(max_digits=10, decimal_places=2)
+    # optional for signed-in users, whose cart is priced server side
+    cart_total = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
 
     def validate(self, data):
-        coupon_code = data["coupon"]
-        cart_total = Decimal(data["cart_total"])
-
+        request = self.context.get("request")
         try:
-            offer = Offer.objects.get(coupon=coupon_code)
-        except Offer.DoesNotExist:
-            raise serializers.ValidationError("Invalid coupon code")
-
-        discount = Decimal("0.00")
-
-        if offer.type == "PERCENT":
-            # Percentage discount
-            discount = (cart_total * Decimal(offer.unit)) / Decimal(100)
-
-        elif offer.type == "DIRECT":
-            # Direct discount with 50% cap
-            max_allowed_discount = cart_total * Decimal("0.50")
-            discount = min(Decimal(offer.unit), max_allowed_discount)
-
-        # Safety: discount should never exceed cart total
-        discount = min(discount, cart_total)
-
-        final_amount = cart_total - discount
+            if "cart_total" in data:
+                quote = pricing.build_quote(data["cart_total"], offer=pricing.get_offer(data["coupon"]))
+            elif request and request.user.is_authenticated:
+                quote = pricing.quote_cart(request.user, coupon_code=data["coupon"])
+            else:
+                raise serializers.ValidationError({"cart_total": "This field is required."})
+        except pricing.PricingError as e:
+            raise serializers.ValidationError(str(e))
 
         return {
-            "coupon": offer.coupon,
-            "discount_type": offer.type,
-            "discount_value": offer.unit,
-            "cart_total": round(cart_total, 2),
-            "discount_amount": round(discount, 2),
-            "final_amount": round(final_amount, 2),
+            "coupon": quote["coupon"],
+            "discount_type": quote["discount_type"],
+            "discount_value": quote["discount_value"],
+            "cart_total": quote["subtotal"],
+            "discount_amount": quote["discount"],
+            "final_amount": quote["subtotal"] - quote["discount"],
         }
 
 
@@ -201,6 +262,26 @@ class TransferToCartSerializer(serializers.Serializer):
     product_id = serializers.CharField()
     quantity = serializers.IntegerField(min_value=1)
 
+class CartBatchOperationSerializer(serializers.Serializer):
+    OPERATIONS = (
+        "add", "update", "remove",
+        "wishlist_add", "wishlist_remove",
+        "move_to_cart", "move_to_wishlist",
+    )
+    QUANTITY_OPERATIONS = ("add", "update", "move_to_cart")
+
+    op = serializers.ChoiceField(choices=OPERATIONS)
+    product_id = serializers.CharField()
+    quantity = serializers.IntegerField(min_value=1, required=False)
+
+    def validate(self, data):
+        if data["op"] in self.QUANTITY_OPERATIONS and "quantity" not in data:
+            raise serializers.ValidationError({"quantity": "This field is required."})
+        return data
+
+class CartBatchSerializer(serializers.Serializer):
+    operations = CartBatchOperationSerializer(many=True, allow_empty=False, max_length=200)
+
 class OrderSerializer(serializers.ModelSerializer):
     items = serializers.SerializerMethodField()
 
@@ -221,8 +302,9 @@ class OrderSerializer(serializers.ModelSerializer):
         ]
 
     def get_items(self, obj):
+        # served from the items prefetch when the view sets one up
         order_items = obj.items.all()
-        return OrderItemSerializer(order_items, many=True).data
+        return OrderItemSerializer(order_items, many=True, context=self.context).data
 
 class OrderItemSerializer(serializers.ModelSerializer):
     product = ProductListSerializer()
@@ -264,7 +346,8 @@ class OrderItemCreationSerializer(serializers.Serializer):
 
 
 class OrderCreationSerializer(serializers.Serializer):
-    items = OrderItemCreationSerializer(many=True)
+    # when omitted the order is built from the user's cart
+    items = OrderItemCreationSerializer(many=True, required=False)
     shipping_address = serializers.CharField(max_length=255)
     phone_number = serializers.CharField(max_length=15)
     coupon = serializers.CharField(max_length=20, required=False, allow_blank=True)
@@ -303,7 +386,7 @@ class SellerProductSerializer(serializers.ModelSerializer):
     stock = serializers.IntegerField(write_only=True, required=False)
     # image = serializers.SerializerMethodField() # Removed to allow writing
     stock_quantity = serializers.IntegerField(
-        source="inventory.stock_quantity", read_only=True, allow_null=True
+        source="inventory.available_quantity", read_only=True, allow_null=True
     )
 
     class Meta:
@@ -344,12 +427,32 @@ class SellerProductSerializer(serializers.ModelSerializer):
         instance.save()
 
         if stock is not None:
-            inventory, _ = Inventory.objects.get_or_create(product=instance)
-            inventory.stock_quantity = stock
-            inventory.save()
+            inventory.set_stock(instance, stock)
 
         return instance
 
+class ProductImportRowSerializer(serializers.Serializer):
+    # one CSV/JSONL row of a bulk import; the image is always fetched from image_url later
+    title = serializers.CharField(max_length=255)
+    price = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal("0"))
+    description = serializers.CharField()
+    category = serializers.CharField(max_length=100)
+    stock = serializers.IntegerField(min_value=0, required=False, default=0)
+    image_url = serializers.URLField(required=False, allow_blank=True, default="")
+
+class SellerBulkUpdateItemSerializer(serializers.Serializer):
+    public_product_id = serializers.CharField(max_length=30)
+    stock = serializers.IntegerField(min_value=0, required=False)
+    price = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal("0"), required=False)
+
+    def validate(self, data):
+        if "stock" not in data and "price" not in data:
+            raise serializers.ValidationError("Give stock, price or both.")
+        return data
+
+class SellerBulkUpdateSerializer(serializers.Serializer):
+    items = SellerBulkUpdateItemSerializer(many=True, allow_empty=False, max_length=5000)
+
 class SellerOrderSerializer(serializers.ModelSerializer):
     customer = serializers.CharField(source="user.username", read_only=True)
     items = serializers.SerializerMethodField()
@@ -367,5 +470,8 @@ class SellerOrderSerializer(serializers.ModelSerializer):
         ]
 
     def get_items(self, obj):
-        order_items = obj.items.all()
-        return OrderItemSerializer(order_items, many=True).data
+        # the seller views prefetch only the requesting seller's lines
+        order_items = getattr(obj, "seller_items", None)
+        if order_items is None:
+            order_items = obj.items.all()
+        return OrderItemSerializer(order_items, many=True, context=self.context).data
@@ -1,10 +1,11 @@
 from django import template
-from django.contrib.auth.models import Group
 
 register = template.Library()
 
 @register.filter(name='has_group')
 def has_group(user, group_name):
-    group = Group.objects.get(name=group_name)
-    return True if group in user.groups.all() else False
-
+    # one query per user and group, remembered for the rest of the render
+    checked = user.__dict__.setdefault("_group_checks", {})
+    if group_name not in checked:
+        checked[group_name] = user.groups.filter(name=group_name).exists()
+    return checked[group_name]
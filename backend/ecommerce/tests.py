@@ -1,3 +1,1498 @@
-from django.test import TestCase
+import csv
+import io
+import ipaddress
+import socket
+from datetime import timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from smtplib import SMTPException
+from threading import Barrier, Event, Thread
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import Group, User
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.mail.backends.locmem import EmailBackend
+from django.db import connection, connections, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.decorators import api_view
+from rest_framework.response import Response
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import cart, idempotency, inventory, mailers, outbox, pricing, product_import, webhooks
+from .authentication import ClaimsJWTAuthentication, user_cache
+from .roles import role_required
+from .views import REVIEW_ORDERINGS
+from .cache import catalog_version
+from .models import (
+    CartItem, IdempotencyRecord, Inventory, InventoryShard, Offer, Order, OrderItem, OrderSeller, OutboxEmail, Product,
+    Review, SalesRollup, SellerStats, WebhookEvent, Wishlist, link_order_sellers,
+)
+from .serializers import ProductListSerializer, ProductListValuesSerializer
+
+
+class UserOrdersQueryCountTests(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user(username="seller", password="pass")
+        self.buyer = User.objects.create_user(username="buyer", password="pass")
+        self.products = [
+            Product.objects.create(
+                title=f"Product {i}",
+                description="desc",
+                price=Decimal("100.00"),
+                category="bags",
+                image=f"products/{i}.png",
+                seller=self.seller,
+            )
+            for i in range(3)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.buyer)
+
+    def create_orders(self, count):
+        for _ in range(count):
+            order = Order.objects.create(
+                user=self.buyer,
+                total_amount=Decimal("300.00"),
+                shipping_address="addr",
+                phone_number="123",
+            )
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product=product, quantity=1, price_at_purchase=product.price)
+                for product in self.products
+            ])
+
+    def test_query_count_does_not_grow_with_history(self):
+        # count + orders page + prefetched items with product and seller
+        self.create_orders(2)
+        with self.assertNumQueries(3):
+            response = self.client.get("/api/user-orders/", {"page_size": 10})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["orders"]), 2)
+
+        self.create_orders(8)
+        with self.assertNumQueries(3):
+            response = self.client.get("/api/user-orders/", {"page_size": 10})
+        self.assertEqual(len(response.data["orders"]), 10)
+        self.assertEqual(len(response.data["orders"][0]["items"]), 3)
+
+    def test_without_paging_params_every_order_is_returned(self):
+        self.create_orders(12)
+        with self.assertNumQueries(2):
+            response = self.client.get("/api/user-orders/")
+        self.assertEqual((response.data["count"], len(response.data["orders"])), (12, 12))
+        self.assertNotIn("next", response.data)
+
+    def test_cursor_walks_all_orders(self):
+        self.create_orders(5)
+        response = self.client.get("/api/user-orders/?page_size=2&skip_count=1")
+        seen = []
+        while True:
+            seen += [order["public_order_id"] for order in response.data["orders"]]
+            if not response.data["next"]:
+                break
+            response = self.client.get(response.data["next"])
+        self.assertNotIn("count", response.data)
+        self.assertEqual(len(seen), 5)
+        self.assertEqual(len(set(seen)), 5)
+
+
+@override_settings(EMAIL_OUTBOX_MODE="command")
+class EmailOutboxTests(TestCase):
+    def setUp(self):
+        self.buyer = User.objects.create_user(username="buyer", email="buyer@example.com", password="pass")
+        self.orders = [
+            Order.objects.create(
+                user=self.buyer,
+                total_amount=Decimal("100.00"),
+                shipping_address="addr",
+                phone_number="123",
+            )
+            for _ in range(3)
+        ]
+
+    def test_batch_shares_one_connection_and_dedupes(self):
+        outbox.enqueue_order_completed(self.orders)
+        outbox.enqueue_order_completed(self.orders[:1])
+        self.assertEqual(OutboxEmail.objects.count(), 3)
+
+        connect = mock.Mock(wraps=mail.get_connection)
+        with mock.patch("ecommerce.outbox.get_connection", connect), \
+                mock.patch("django.core.mail.get_connection", connect):
+            self.assertEqual(outbox.send_batch(), 3)
+        self.assertEqual(connect.call_count, 1)
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(outbox.send_batch(), 0)
+        self.assertFalse(OutboxEmail.objects.exclude(status="SENT").exists())
+
+    def test_failed_send_is_retried_later(self):
+        outbox.enqueue_order_completed(self.orders[:1])
+        with mock.patch.object(EmailBackend, "send_messages", side_effect=SMTPException("down")):
+            outbox.send_batch()
+        email = OutboxEmail.objects.get()
+        self.assertEqual((email.status, email.attempts), ("PENDING", 1))
+        self.assertGreater(email.available_at, timezone.now())
+        self.assertEqual(outbox.send_batch(), 0)
+
+        OutboxEmail.objects.update(available_at=timezone.now())
+        outbox.send_batch()
+        self.assertEqual(OutboxEmail.objects.get().status, "SENT")
+        self.assertEqual(len(mail.outbox), 1)
+
+
+class RoleClaimTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.group = Group.objects.create(name="seller")
+        self.seller = User.objects.create_user(username="seller", password="pass")
+        self.seller.groups.add(self.group)
+        self.client = APIClient()
+        self.tokens = self.client.post(
+            "/api/login/", {"username": "seller", "password": "pass"}, format="json"
+        ).json()
+        self.client.credentials(HTTP_AUTHORIZATION="Bearer " + self.tokens["access"])
+
+    def test_seller_check_reads_the_claim(self):
+        self.assertEqual(self.tokens["role"], "seller")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/seller/summary/")
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([q for q in queries if "auth_group" in q["sql"]])
+
+    def test_demotion_invalidates_token_until_refresh(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.seller.groups.remove(self.group)
+        self.assertEqual(self.client.get("/api/seller/summary/").status_code, 403)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.group.user_set.add(self.seller)
+        access = self.client.post(
+            "/api/token/refresh/", {"refresh": self.tokens["refresh"]}, format="json"
+        ).json()["access"]
+        self.client.credentials(HTTP_AUTHORIZATION="Bearer " + access)
+        self.assertEqual(self.client.get("/api/seller/summary/").status_code, 200)
+
+    def test_role_required_reads_only_the_claim(self):
+        @api_view(["GET"])
+        @role_required("seller")
+        def seller_only(request):
+            return Response({"ok": True})
+
+        def call(access):
+            request = APIRequestFactory().get("/", HTTP_AUTHORIZATION="Bearer " + access)
+            return seller_only(request)
+
+        self.assertEqual(call(self.tokens["access"]).status_code, 200)
+        with self.assertNumQueries(0):
+            self.assertEqual(call(self.tokens["access"]).status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.seller.groups.remove(self.group)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(call(self.tokens["access"]).status_code, 403)
+        self.assertFalse([q for q in queries if "auth_group" in q["sql"]])
+
+
+class PaymentSettlementTests(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user(username="seller", password="pass")
+        self.buyer = User.objects.create_user(username="buyer", password="pass")
+        self.product = Product.objects.create(
+            title="Lamp", description="desc", price=Decimal("50.00"),
+            category="home", image="products/lamp.png", seller=self.seller,
+        )
+        Inventory.objects.create(product=self.product, stock_quantity=1)
+        self.order = Order.objects.create(
+            user=self.buyer, total_amount=Decimal("50.00"), shipping_address="addr",
+            phone_number="123", razorpay_order_id="order_rzp_1",
+        )
+        OrderItem.objects.create(order=self.order, product=self.product, quantity=1, price_at_purchase=Decimal("50.00"))
+        inventory.reserve_stock(self.order, {self.product.pk: 1})
+
+    def stock(self):
+        return Inventory.objects.get(product=self.product).stock_quantity
+
+    def expire(self):
+        inventory.release_expired_reservations(now=timezone.now() + timedelta(days=1))
+        self.assertEqual(Order.objects.get(pk=self.order.pk).status, "CANCELLED")
+        self.assertEqual(self.stock(), 1)
+
+    def test_payment_within_hold_commits_reservation(self):
+        order = inventory.settle_payment(self.order.pk, "PAID", razorpay_payment_id="pay_1")
+        self.assertEqual(order.status, "PAID")
+        self.assertFalse(order.reservations.exists())
+        self.assertEqual(self.stock(), 0)
+        # a late webhook for the same payment only upgrades the status
+        self.assertEqual(inventory.settle_payment(self.order.pk, "VERIFIED").status, "VERIFIED")
+        self.assertEqual(self.stock(), 0)
+
+    def test_late_payment_takes_stock_again(self):
+        self.expire()
+        order = inventory.settle_payment(self.order.pk, "VERIFIED", razorpay_payment_id="pay_1")
+        self.assertEqual(order.status, "VERIFIED")
+        self.assertEqual(self.stock(), 0)
+
+    def test_late_payment_after_sell_out_is_refund_due(self):
+        self.expire()
+        inventory.set_stock(self.product, 0)  # someone else bought it
+        with mock.patch("ecommerce.views_payment.razorpay_client") as gateway:
+            gateway.utility.verify_payment_signature.return_value = True
+            client = APIClient()
+            client.force_authenticate(self.buyer)
+            response = client.post("/api/verify-payment/", {
+                "razorpay_order_id": "order_rzp_1",
+                "razorpay_payment_id": "pay_1",
+                "razorpay_signature": "sig",
+            }, format="json")
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Order.objects.get(pk=self.order.pk).status, "REFUND_DUE")
+        self.assertEqual(self.stock(), 0)
+        self.assertEqual(SellerStats.objects.get(seller=self.seller).revenue, 0)
+
+    def test_product_without_inventory_row_stays_sellable(self):
+        untracked = make_products(self.seller, 1)[0]
+        order = Order.objects.create(
+            user=self.buyer, total_amount=Decimal("20.00"), shipping_address="addr", phone_number="123",
+        )
+        with transaction.atomic():
+            self.assertEqual(inventory.reserve_stock(order, {untracked.pk: 2}), [])
+        self.assertFalse(order.reservations.exists())
+        self.assertFalse(Inventory.objects.filter(product=untracked).exists())
+
+
+class StockReservationConcurrencyTests(TransactionTestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user(username="seller", password="pass")
+        self.buyers = [User.objects.create_user(username=f"buyer{i}", password="pass") for i in range(8)]
+        self.product = Product.objects.create(
+            title="Lamp", description="desc", price=Decimal("50.00"),
+            category="home", image="products/lamp.png", seller=self.seller,
+        )
+        Inventory.objects.create(product=self.product, stock_quantity=5)
+
+    def new_order(self, buyer):
+        return Order.objects.create(user=buyer, total_amount=Decimal("50.00"), shipping_address="addr", phone_number="123")
+
+    def checkout_all_at_once(self, quantity):
+        orders = [self.new_order(buyer) for buyer in self.buyers]
+        barrier = Barrier(len(orders))
+        results = []
+
+        def checkout(order):
+            try:
+                barrier.wait()
+                with transaction.atomic():
+                    inventory.reserve_stock(order, {self.product.pk: quantity})
+                results.append(True)
+            except inventory.OutOfStock:
+                results.append(False)
+            finally:
+                connections.close_all()
+
+        threads = [Thread(target=checkout, args=(order,)) for order in orders]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def available(self):
+        return Inventory.objects.get(product=self.product).available_quantity
+
+    def test_concurrent_checkouts_never_oversell(self):
+        results = self.checkout_all_at_once(1)
+        self.assertEqual(results.count(True), 5)
+        self.assertEqual(self.available(), 0)
+
+    def test_sharded_concurrent_checkouts_never_oversell(self):
+        inventory.reshard(self.product, 3)
+        results = self.checkout_all_at_once(1)
+        self.assertEqual(results.count(True), 5)
+        self.assertEqual(self.available(), 0)
+        self.assertFalse(InventoryShard.objects.filter(quantity__lt=0).exists())
+
+    def test_quantity_can_span_shards(self):
+        inventory.reshard(self.product, 3)  # 2 + 2 + 1
+        order = self.new_order(self.buyers[0])
+        with transaction.atomic():
+            allocations = inventory.reserve_stock(order, {self.product.pk: 4})
+        self.assertEqual(sum(quantity for _, _, quantity in allocations), 4)
+        self.assertEqual(self.available(), 1)
+
+    def test_release_after_reshard_returns_stock(self):
+        order = self.new_order(self.buyers[0])
+        with transaction.atomic():
+            inventory.reserve_stock(order, {self.product.pk: 2})
+        inventory.reshard(self.product, 4)
+        inventory.release_reservations([order.pk])
+        self.assertEqual(self.available(), 5)
+
+        with transaction.atomic():
+            inventory.reserve_stock(order, {self.product.pk: 3})
+        inventory.reshard(self.product, 0)
+        inventory.release_reservations([order.pk])
+        self.assertEqual(self.available(), 5)
+
+
+class SellerRevenueRaceTests(TransactionTestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user(username="seller", password="pass")
+        buyer = User.objects.create_user(username="buyer", password="pass")
+        product = Product.objects.create(
+            title="Lamp", description="desc", price=Decimal("50.00"),
+            category="home", image="products/lamp.png", seller=self.seller,
+        )
+        self.order = Order.objects.create(user=buyer, total_amount=Decimal("100.00"), shipping_address="addr", phone_number="123")
+        OrderItem.objects.create(order=self.order, product=product, quantity=2, price_at_purchase=Decimal("50.00"))
+
+    def test_concurrent_paid_transitions_count_once(self):
+        # the verify view and the webhook worker both loaded the order while it was PENDING
+        copies = [Order.objects.get(pk=self.order.pk) for _ in range(2)]
+        barrier = Barrier(2)
+
+        def pay(order, status):
+            try:
+                barrier.wait()
+                order.status = status
+                order.save()
+            finally:
+                connections.close_all()
+
+        threads = [Thread(target=pay, args=pair) for pair in zip(copies, ("PAID", "VERIFIED"))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(SellerStats.objects.get(seller=self.seller).revenue, Decimal("100.00"))
+        rollup = SalesRollup.objects.get(seller=self.seller)
+        self.assertEqual((rollup.units, rollup.revenue), (2, Decimal("100.00")))
+
+
+class ImageFetchTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        from PIL import Image
+        buffer = io.BytesIO()
+        Image.new("RGB", (2, 2)).save(buffer, "PNG")
+        png = buffer.getvalue()
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/redirect":
+                    self.send_response(302)
+                    self.send_header("Location", "http://10.0.0.1/img.png")
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "image/png")
+                self.end_headers()
+                self.wfile.write(png)
+
+            def log_message(self, *args):
+                pass
+
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        cls.port = cls.server.server_address[1]
+        Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        # only the test server counts as a public host
+        patcher = mock.patch.object(product_import, "_is_public", lambda ip: str(ip) == "127.0.0.1")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.lookups = []
+        real_getaddrinfo = socket.getaddrinfo
+
+        def getaddrinfo(host, *args, **kwargs):
+            if host == "images.example":
+                self.lookups.append(host)
+                # a rebinding DNS server: public for the check, private afterwards
+                host = "127.0.0.1" if len(self.lookups) == 1 else "10.0.0.1"
+            return real_getaddrinfo(host, *args, **kwargs)
+
+        patcher = mock.patch("socket.getaddrinfo", getaddrinfo)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_connects_to_the_address_that_was_checked(self):
+        body, extension = product_import.fetch_image(f"http://images.example:{self.port}/img.png")
+        self.assertEqual(extension, "png")
+        self.assertEqual(self.lookups, ["images.example"])
+
+    def test_redirect_to_private_address_is_refused(self):
+        with self.assertRaisesMessage(ValueError, "not public"):
+            product_import.fetch_image(f"http://127.0.0.1:{self.port}/redirect")
+
+    def test_metadata_address_is_refused(self):
+        with self.assertRaisesMessage(ValueError, "not public"):
+            product_import.fetch_image("http://169.254.169.254/latest/meta-data/")
+
+
+class PublicAddressTests(TestCase):
+    def test_ipv6_forms_of_internal_ipv4_addresses_are_refused(self):
+        for address in ("::ffff:127.0.0.1", "::127.0.0.1", "64:ff9b::7f00:1", "2002:7f00:1::", "64:ff9b::a00:1"):
+            with self.subTest(address=address):
+                self.assertFalse(product_import._is_public(ipaddress.ip_address(address)))
+
+    def test_ipv6_forms_of_public_ipv4_addresses_are_allowed(self):
+        for address in ("8.8.8.8", "64:ff9b::808:808", "2002:808:808::", "2606:4700:4700::1111"):
+            with self.subTest(address=address):
+                self.assertTrue(product_import._is_public(ipaddress.ip_address(address)))
+
+
+class ProductImportTests(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user(username="seller", password="pass")
+        self.other = User.objects.create_user(username="other", password="pass")
+        Product.objects.create(
+            title="Theirs", description="desc", price=Decimal("5.00"),
+            category="home", image="products/theirs.png", seller=self.other,
+        )
+
+    def run_import(self, text, fmt="csv"):
+        pool = mock.Mock()
+        report = product_import.ProductImport(self.seller, batch_size=2, image_pool=pool).run(
+            io.BytesIO(text.encode()), fmt
+        )
+        return report, pool
+
+    def test_valid_rows_are_created_and_bad_rows_reported(self):
+        report, pool = self.run_import(
+            "title,price,description,category,stock,image_url\n"
+            "Cup,10.50,nice,kitchen,3,https://img.example/cup.png\n"
+            "Bad,-1,nice,kitchen,3,\n"
+            "Bowl,4,nice,kitchen,,\n"
+        )
+        self.assertEqual((report["created"], report["failed"], report["images_queued"]), (2, 1, 1))
+        self.assertEqual(report["errors"][0]["row"], 2)
+        cup = Product.objects.get(title="Cup")
+        self.assertEqual((cup.seller, cup.price, cup.inventory.stock_quantity), (self.seller, Decimal("10.50"), 3))
+        self.assertEqual(Product.objects.get(title="Bowl").inventory.stock_quantity, 0)
+        self.assertEqual(SellerStats.objects.get(seller=self.seller).products_count, 2)
+        pool.submit.assert_called_once_with([(cup.pk, cup.public_product_id, "https://img.example/cup.png")])
+
+    def test_jsonl_lines_are_independent(self):
+        report, _ = self.run_import(
+            '{"title": "Cup", "price": "1", "description": "d", "category": "c"}\n'
+            "not json\n",
+            fmt="jsonl",
+        )
+        self.assertEqual((report["created"], report["failed"]), (1, 1))
+
+    def test_cannot_claim_another_sellers_stored_image(self):
+        self.run_import(
+            "title,price,description,category,image\n"
+            "Mine,1,d,c,products/theirs.png\n"
+        )
+        self.assertEqual(Product.objects.get(title="Mine").image.name, "")
+
+
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.seller = User.objects.create_user(username="seller", password="pass")
+        self.create_product("Lamp")
+
+    def create_product(self, title):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Product.objects.create(
+                title=title, description="desc", price=Decimal("10.00"),
+                category="home", image="products/x.png", seller=self.seller,
+            )
+
+    def titles(self):
+        response = APIClient().get("/api/products/", {"category": "home"})
+        return [product["title"] for product in response.json()["results"]["products"]]
+
+    def test_listing_is_served_from_cache_until_the_catalog_changes(self):
+        self.assertEqual(self.titles(), ["Lamp"])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.titles(), ["Lamp"])
+        self.assertEqual(len(queries), 0)
+
+        self.create_product("Desk")
+        self.assertEqual(self.titles(), ["Desk", "Lamp"])
+
+    def test_cached_links_carry_only_listing_params(self):
+        self.create_product("Desk")
+        first = APIClient().get("/api/products/", {"category": "Home", "page_size": 1, "utm": "mail"}).json()
+        self.assertEqual(first["next"], "http://testserver/api/products/?category=home&page=2&page_size=1")
+        with self.assertNumQueries(0):
+            second = APIClient().get("/api/products/", {"category": "home", "page_size": 1}).json()
+        self.assertEqual(second, first)
+
+        page_two = APIClient().get(first["next"] + "&utm=x").json()
+        self.assertEqual(page_two["previous"], "http://testserver/api/products/?category=home&page_size=1")
+        cursor = APIClient().get("/api/products/", {"pagination": "cursor", "page_size": 1, "ref": "x"}).json()
+        self.assertNotIn("ref", cursor["next"])
+        self.assertIn("cursor=", cursor["next"])
+
+    def test_version_moves_only_after_commit(self):
+        before = catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            inventory.set_stock(Product.objects.get(), 4)
+            self.assertEqual(catalog_version(), before)
+        self.assertNotEqual(catalog_version(), before)
+
+
+class PricingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        seller = User.objects.create_user(username="seller", password="pass")
+        self.buyer = User.objects.create_user(username="buyer", password="pass")
+        self.product = Product.objects.create(
+            title="Lamp", description="desc", price=Decimal("200.00"),
+            category="home", image="products/lamp.png", seller=seller,
+        )
+        Inventory.objects.create(product=self.product, stock_quantity=5)
+        cart.add_to_cart(self.buyer.pk, self.product.public_product_id, 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.offer = Offer.objects.create(coupon="SAVE10", type="PERCENT", unit=10)
+
+    def test_quote_applies_coupon_and_gift_wrap(self):
+        quote = pricing.quote_cart(self.buyer, "SAVE10", gift_wrap=True)
+        self.assertEqual(quote["subtotal"], Decimal("400.00"))
+        self.assertEqual(quote["discount"], Decimal("40.00"))
+        self.assertEqual(quote["total"], Decimal("370.00"))
+
+    def test_direct_discount_is_capped_at_half(self):
+        offer = Offer(coupon="FLAT", type="DIRECT", unit=1000)
+        self.assertEqual(pricing.calculate_discount(Decimal("400.00"), offer), Decimal("200.00"))
+
+    def test_unknown_coupon_is_rejected(self):
+        with self.assertRaises(pricing.PricingError):
+            pricing.quote_cart(self.buyer, "NOPE")
+
+    def test_cached_quote_follows_coupon_changes(self):
+        self.assertEqual(pricing.quote_cart(self.buyer, "SAVE10")["discount"], Decimal("40.00"))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.offer.unit = 50
+            self.offer.save()
+        self.assertEqual(pricing.quote_cart(self.buyer, "SAVE10")["discount"], Decimal("200.00"))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.offer.delete()
+        with self.assertRaises(pricing.PricingError):
+            pricing.quote_cart(self.buyer, "SAVE10")
+
+    def test_order_is_priced_without_the_quote_cache(self):
+        pricing.quote_cart(self.buyer, "SAVE10")
+        # a change the cache cannot see, e.g. a queryset update
+        Offer.objects.filter(pk="SAVE10").update(unit=25)
+        with mock.patch("ecommerce.views_payment.razorpay_client") as gateway:
+            gateway.order.create.return_value = {"id": "order_rzp_1"}
+            client = APIClient()
+            client.force_authenticate(self.buyer)
+            response = client.post("/api/create-order/", {
+                "shipping_address": "addr", "phone_number": "123", "coupon": "SAVE10",
+            }, format="json")
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(Order.objects.get().total_amount, Decimal("300.00"))
+
+
+def make_products(seller, count, price=Decimal("10.00"), category="home"):
+    return [
+        Product.objects.create(
+            title=f"Product {i}", description="desc", price=price,
+            category=category, image=f"products/{i}.png", seller=seller,
+        )
+        for i in range(count)
+    ]
+
+
+class CartBatchTests(TestCase):
+    def setUp(self):
+        seller = User.objects.create_user(username="seller", password="pass")
+        self.buyer = User.objects.create_user(username="buyer", password="pass")
+        self.products = make_products(seller, 3)
+        self.client = APIClient()
+        self.client.force_authenticate(self.buyer)
+
+    def batch(self, operations):
+        return self.client.post("/api/cart/batch/", {"operations": operations}, format="json")
+
+    def test_operations_replay_in_order(self):
+        a, b, c = (product.public_product_id for product in self.products)
+        response = self.batch([
+            {"op": "add", "product_id": a, "quantity": 1},
+            {"op": "add", "product_id": a, "quantity": 2},
+            {"op": "wishlist_add", "product_id": b},
+            {"op": "move_to_cart", "product_id": b, "quantity": 4},
+            {"op": "remove", "product_id": c},
+            {"op": "add", "product_id": "PRD-missing", "quantity": 1},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            dict(CartItem.objects.filter(user=self.buyer).values_list("product_id", "quantity")),
+            {self.products[0].pk: 3, self.products[1].pk: 4},
+        )
+        self.assertFalse(Wishlist.objects.filter(user=self.buyer).exists())
+        self.assertEqual([error["index"] for error in response.json()["errors"]], [4, 5])
+
+    def test_query_count_does_not_grow_with_operations(self):
+        def count(operations):
+            CartItem.objects.all().delete()
+            with CaptureQueriesContext(connection) as queries:
+                self.batch(operations)
+            return len(queries)
+
+        few = count([{"op": "add", "product_id": self.products[0].public_product_id, "quantity": 1}])
+        many = count([
+            {"op": "add", "product_id": product.public_product_id, "quantity": 1}
+            for product in self.products for _ in range(5)
+        ])
+        self.assertEqual(few, many)
+
+
+class CartBatchRaceTests(TransactionTestCase):
+    def test_concurrent_add_is_not_overwritten(self):
+        seller = User.objects.create_user(username="seller", password="pass")
+        buyer = User.objects.create_user(username="buyer", password="pass")
+        product = make_products(seller, 1)[0]
+        replay = cart._replay
+
+        def replay_after_concurrent_add(*args):
+            # another request adds the same product after the batch read the cart
+            def add():
+                try:
+                    cart.add_to_cart(buyer.pk, product.public_product_id, 3)
+                finally:
+                    connections.close_all()
+            thread = Thread(target=add)
+            thread.start()
+            thread.join()
+            return replay(*args)
+
+        with mock.patch.object(cart, "_replay", replay_after_concurrent_add):
+            cart.apply_batch(buyer, [{"op": "add", "product_id": product.public_product_id, "quantity": 2}])
+        self.assertEqual(CartItem.objects.get(user=buyer).quantity, 5)
+
+
+class ReviewPaginationTests(TestCase):
+    def setUp(self):
+        seller = User.objects.create_user(username="seller", password="pass")
+        self.product = make_products(seller, 1)[0]
+        for i, rating in enumerate([3, 1, 5, 1, 4, 3, 2]):
+            user = User.objects.create_user(username=f"reviewer{i}", password="pass")
+            Review.objects.create(user=user, product=self.product, rating=rating, comment="ok")
+
+    def walk(self, ordering):
+        url = f"/api/product/{self.product.public_product_id}/reviews/?ordering={ordering}&page_size=2"
+        seen = []
+        while url:
+            body = APIClient().get(url).json()
+            seen += [(review["rating"], review["user"]) for review in body["results"]]
+            url = body["next"]
+        return seen
+
+    def test_every_ordering_walks_all_reviews_once_in_order(self):
+        for name, ordering in REVIEW_ORDERINGS.items():
+            expected = [
+                (review.rating, review.user.username)
+                for review in Review.objects.filter(product=self.product).order_by(*ordering)
+            ]
+            self.assertEqual(self.walk(name), expected, name)
+        self.assertEqual([rating for rating, _ in self.walk("lowest")], [1, 1, 2, 3, 3, 4, 5])
+
+    def test_every_ordering_is_an_index_scan(self):
+        with connection.cursor() as cursor:
+            # a handful of rows would otherwise be read whole and sorted
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            cursor.execute("SET LOCAL enable_bitmapscan = off")
+        for name, ordering in REVIEW_ORDERINGS.items():
+            plan = Review.objects.filter(product=self.product).order_by(*ordering)[:10].explain()
+            self.assertNotIn("Sort", plan.replace("Index Scan", ""), name)
+
+
+class ClaimsAuthenticationTests(TestCase):
+    def setUp(self):
+        user_cache.clear()
+        self.user = User.objects.create_user(username="buyer", email="buyer@example.com", password="pass")
+        self.token = AccessToken.for_user(self.user)
+        self.auth = ClaimsJWTAuthentication()
+
+    def client_for(self, token):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+        return client
+
+    def test_columns_load_once_from_the_cache(self):
+        with self.assertNumQueries(1):
+            user = self.auth.get_user(self.token)
+        with self.assertNumQueries(0):
+            self.assertEqual(user.pk, self.user.pk)
+            self.assertEqual((user.username, user.email), ("buyer", "buyer@example.com"))
+            self.assertEqual(self.auth.get_user(self.token).date_joined, self.user.date_joined)
+        self.assertIsInstance(user, User)
+
+    def test_saving_or_deleting_the_user_forgets_the_cached_row(self):
+        self.auth.get_user(self.token)
+        self.user.email = "new@example.com"
+        self.user.save()
+        self.assertIsNone(user_cache.get(self.user.pk))
+        self.assertEqual(self.auth.get_user(self.token).email, "new@example.com")
+
+        self.user.delete()
+        self.assertIsNone(user_cache.get(self.user.pk))
+        with self.assertRaises(AuthenticationFailed):
+            self.auth.get_user(self.token)
+
+    def test_token_of_a_deleted_user_is_rejected_before_writes(self):
+        seller = User.objects.create_user(username="seller", password="pass")
+        product = make_products(seller, 1)[0]
+        self.user.delete()
+        response = self.client_for(self.token).post(
+            "/api/cart/", {"product_id": product.public_product_id, "quantity": 1}, format="json"
+        )
+        self.assertEqual(response.status_code, 401)
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_inactive_user_is_rejected(self):
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client_for(self.token).get("/api/profile/").status_code, 401)
+
+    def test_cart_write_needs_no_user_query(self):
+        seller = User.objects.create_user(username="seller", password="pass")
+        product = make_products(seller, 1)[0]
+        client = self.client_for(self.token)
+        client.post("/api/cart/", {"product_id": product.public_product_id, "quantity": 1}, format="json")
+        with CaptureQueriesContext(connection) as queries:
+            response = client.post("/api/cart/", {"product_id": product.public_product_id, "quantity": 1}, format="json")
+        self.assertEqual(response.json()["quantity"], 2)
+        self.assertFalse([q for q in queries if '"auth_user"' in q["sql"]])
+
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        seller = User.objects.create_user(username="seller", password="pass")
+        for title, description in [
+            ("Jute bag", "woven shopping bag"),
+            ("Cotton tote", "roomy bag made of jute"),
+            ("Desk lamp", "warm light"),
+        ]:
+            Product.objects.create(
+                title=title, description=description, price=Decimal("10.00"),
+                category="home", image="products/x.png", seller=seller,
+            )
+
+    def titles(self, **params):
+        response = APIClient().get("/api/products/", params)
+        self.assertEqual(response.status_code, 200)
+        return [product["title"] for product in response.json()["results"]["products"]]
+
+    def test_prefix_terms_match_while_typing(self):
+        self.assertEqual(sorted(self.titles(search="jut ba")), ["Cotton tote", "Jute bag"])
+        self.assertEqual(self.titles(search="lam"), ["Desk lamp"])
+
+    def test_relevance_ranks_title_matches_first(self):
+        self.assertEqual(self.titles(search="jute", sort="relevance"), ["Jute bag", "Cotton tote"])
+
+    def test_input_without_terms_matches_nothing(self):
+        self.assertEqual(self.titles(search="&|!:*"), [])
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        seller = User.objects.create_user(username="seller", password="pass")
+        self.products = make_products(seller, 7)
+        # identical timestamps leave the id to break every tie
+        Product.objects.update(created_at=timezone.now())
+        self.expected = [p.public_product_id for p in sorted(self.products, key=lambda p: -p.pk)]
+
+    def get(self, url, params=None):
+        response = APIClient().get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def ids(self, page):
+        return [product["public_product_id"] for product in page["results"]["products"]]
+
+    def test_cursor_pages_walk_forward_and_back_without_gaps(self):
+        page = self.get("/api/products/", {"pagination": "cursor", "page_size": 3})
+        self.assertEqual(page["count"], 7)
+        self.assertIsNone(page["previous"])
+        seen = self.ids(page)
+        pages = [page]
+        while page["next"]:
+            page = self.get(page["next"])
+            pages.append(page)
+            seen += self.ids(page)
+        self.assertEqual(seen, self.expected)
+
+        back = self.get(pages[-1]["previous"])
+        self.assertEqual(self.ids(back), self.ids(pages[-2]))
+
+    def test_skip_count_and_bad_cursor(self):
+        page = self.get("/api/products/", {"pagination": "cursor", "skip_count": 1})
+        self.assertNotIn("count", page)
+        response = APIClient().get("/api/products/", {"cursor": "not-a-cursor"})
+        self.assertEqual(response.status_code, 404)
+
+    def test_user_orders_are_cursor_paginated(self):
+        buyer = User.objects.create_user(username="buyer", password="pass")
+        orders = [
+            Order.objects.create(
+                user=buyer, total_amount=Decimal("10.00"), shipping_address="addr", phone_number="1"
+            )
+            for _ in range(3)
+        ]
+        client = APIClient()
+        client.force_authenticate(buyer)
+        first = client.get("/api/user-orders/", {"page_size": 2}).json()
+        second = client.get(first["next"]).json()
+        self.assertEqual(
+            [o["public_order_id"] for o in first["orders"] + second["orders"]],
+            [o.public_order_id for o in reversed(orders)],
+        )
+        self.assertIsNone(second["next"])
+
+
+class ProductListValuesSerializerTests(TestCase):
+    def test_matches_the_model_serializer(self):
+        seller = User.objects.create_user(username="seller", password="pass")
+        products = make_products(seller, 2, price=Decimal("12.50"))
+        products[1].image = ""
+        products[1].save()
+        Product.objects.filter(pk=products[0].pk).update(rating_sum=9, rating_count=2)
+
+        request = APIClient().get("/api/products/").wsgi_request
+        queryset = Product.objects.order_by("id")
+        expected = ProductListSerializer(queryset, many=True, context={"request": request}).data
+        with self.assertNumQueries(1):
+            rows = list(ProductListValuesSerializer.get_queryset(queryset))
+        with self.assertNumQueries(0):
+            data = ProductListValuesSerializer(rows, context={"request": request}).data
+        self.assertEqual(data, [dict(item) for item in expected])
+
+
+class RatingAggregateTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        seller = User.objects.create_user(username="seller", password="pass")
+        self.product, self.other = make_products(seller, 2)
+        self.buyers = [User.objects.create_user(username=f"buyer{i}", password="pass") for i in range(3)]
+
+    def review(self, user, product, rating):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client.post(
+            "/api/reviews/create/",
+            {"product_id": product.public_product_id, "rating": rating, "comment": "ok"},
+            format="json",
+        )
+
+    def detail(self):
+        return APIClient().get(f"/api/product/{self.product.public_product_id}/").json()
+
+    def test_create_edit_and_delete_move_the_aggregates(self):
+        for user, rating in zip(self.buyers, (5, 4, 2)):
+            self.assertEqual(self.review(user, self.product, rating).status_code, 201)
+        detail = self.detail()
+        self.assertEqual((detail["average_rating"], detail["rating_count"]), (3.7, 3))
+        self.assertEqual(detail["rating_histogram"], {"1": 0, "2": 1, "3": 0, "4": 1, "5": 1})
+
+        review = Review.objects.get(user=self.buyers[2])
+        review.rating = 5
+        review.save()
+        Review.objects.get(user=self.buyers[1]).delete()
+        detail = self.detail()
+        self.assertEqual((detail["average_rating"], detail["rating_count"]), (5.0, 2))
+        self.assertEqual(detail["rating_histogram"], {"1": 0, "2": 0, "3": 0, "4": 0, "5": 2})
+
+    def test_rating_sort_and_rebuild(self):
+        self.review(self.buyers[0], self.product, 2)
+        self.review(self.buyers[0], self.other, 4)
+        response = APIClient().get("/api/products/", {"sort": "rating"})
+        titles = [p["title"] for p in response.json()["results"]["products"]]
+        self.assertEqual(titles, [self.other.title, self.product.title])
+
+        Product.objects.update(rating_sum=0, rating_count=0, rating_2=0, rating_4=0)
+        call_command("rebuild_product_ratings", stdout=io.StringIO())
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.rating_sum, self.product.rating_count, self.product.rating_2), (2, 1, 1))
+
+
+
+class RatingRebuildRaceTests(TransactionTestCase):
+    def test_review_saved_during_the_rebuild_is_kept(self):
+        seller = User.objects.create_user(username="seller", password="pass")
+        buyer = User.objects.create_user(username="buyer", password="pass")
+        product = make_products(seller, 1)[0]
+        reviewed, release = Event(), Event()
+
+        def review():
+            try:
+                with transaction.atomic():
+                    Review.objects.create(user=buyer, product=product, rating=4, comment="ok")
+                    reviewed.set()
+                    release.wait(5)
+            finally:
+                connections.close_all()
+
+        def rebuild():
+            try:
+                call_command("rebuild_product_ratings", stdout=io.StringIO())
+            finally:
+                connections.close_all()
+
+        reviewer = Thread(target=review)
+        reviewer.start()
+        reviewed.wait(5)
+        # the rebuild starts while the review is uncommitted, then the review commits
+        rebuilder = Thread(target=rebuild)
+        rebuilder.start()
+        rebuilder.join(0.5)
+        release.set()
+        reviewer.join()
+        rebuilder.join()
+
+        product.refresh_from_db()
+        self.assertEqual((product.rating_sum, product.rating_count, product.rating_4), (4, 1, 1))
+
+class CartUpsertTests(TestCase):
+    def setUp(self):
+        seller = User.objects.create_user(username="seller", password="pass")
+        self.buyer = User.objects.create_user(username="buyer", password="pass")
+        self.product, self.hidden = make_products(seller, 2)
+        Product.objects.filter(pk=self.hidden.pk).update(is_active=False)
+        self.client = APIClient()
+        self.client.force_authenticate(self.buyer)
+
+    def test_each_mutation_is_one_statement(self):
+        public_id = self.product.public_product_id
+        with self.assertNumQueries(1):
+            self.assertEqual(cart.add_to_cart(self.buyer.pk, public_id, 2), 2)
+        with self.assertNumQueries(1):
+            self.assertEqual(cart.add_to_cart(self.buyer.pk, public_id, 3), 5)
+        with self.assertNumQueries(1):
+            self.assertEqual(cart.set_cart_quantity(self.buyer.pk, public_id, 1), 1)
+        with self.assertNumQueries(1):
+            self.assertTrue(cart.remove_from_cart(self.buyer.pk, public_id))
+        with self.assertNumQueries(1):
+            self.assertTrue(cart.add_to_wishlist(self.buyer.pk, public_id))
+        self.assertFalse(cart.add_to_wishlist(self.buyer.pk, public_id))
+        self.assertFalse(CartItem.objects.exists())
+        self.assertEqual(Wishlist.objects.count(), 1)
+
+    def test_missing_rows_and_inactive_products(self):
+        self.assertIsNone(cart.add_to_cart(self.buyer.pk, self.hidden.public_product_id, 1))
+        self.assertIsNone(cart.add_to_wishlist(self.buyer.pk, "PRD-missing"))
+
+        body = {"product_id": self.product.public_product_id, "quantity": 2}
+        response = self.client.patch("/api/cart/", body, format="json")
+        self.assertEqual((response.status_code, response.json()["error"]), (404, "Item not in cart"))
+        body["product_id"] = self.hidden.public_product_id
+        response = self.client.patch("/api/cart/", body, format="json")
+        self.assertEqual((response.status_code, response.json()["error"]), (404, "Product not found"))
+        self.assertEqual(self.client.delete("/api/wishlist/", body, format="json").status_code, 404)
+
+
+class CartDeltaSyncTests(TestCase):
+    def setUp(self):
+        seller = User.objects.create_user(username="seller", password="pass")
+        self.buyer = User.objects.create_user(username="buyer", password="pass")
+        self.products = make_products(seller, 3)
+        self.client = APIClient()
+        self.client.force_authenticate(self.buyer)
+
+    def sync(self, since=None):
+        params = {} if since is None else {"since": since}
+        return self.client.get("/api/sync-cart-wishlist/", params)
+
+    def test_since_returns_only_later_changes(self):
+        first, second, third = (p.public_product_id for p in self.products)
+        cart.add_to_cart(self.buyer.pk, first, 1)
+        cart.add_to_wishlist(self.buyer.pk, second)
+        full = self.sync().json()
+        self.assertTrue(full["full"])
+        self.assertEqual((len(full["cart"]), len(full["wishlist"])), (1, 1))
+
+        self.assertEqual(self.sync(full["version"]).status_code, 304)
+
+        cart.add_to_cart(self.buyer.pk, third, 2)
+        cart.remove_from_wishlist(self.buyer.pk, second)
+        delta = self.sync(full["version"]).json()
+        self.assertFalse(delta["full"])
+        self.assertEqual([item["quantity"] for item in delta["cart"]], [2])
+        self.assertEqual(delta["wishlist"], [])
+        self.assertEqual(delta["removed"], {"cart": [], "wishlist": [second]})
+        self.assertEqual(delta["version"], full["version"] + 2)
+
+    def test_deleted_product_is_reported_removed(self):
+        first, second = (p.public_product_id for p in self.products[:2])
+        cart.add_to_cart(self.buyer.pk, first, 1)
+        cart.add_to_wishlist(self.buyer.pk, first)
+        cart.add_to_cart(self.buyer.pk, second, 1)
+        version = self.sync().json()["version"]
+
+        Product.objects.filter(pk=self.products[0].pk).delete()
+        delta = self.sync(version).json()
+        self.assertEqual(delta["removed"], {"cart": [first], "wishlist": [first]})
+        self.assertEqual(delta["version"], version + 1)
+        self.assertEqual(self.sync(version + 1).status_code, 304)
+
+    def test_transfers_are_single_statements_and_logged(self):
+        public_id = self.products[0].public_product_id
+        cart.add_to_wishlist(self.buyer.pk, public_id)
+        cart.add_to_cart(self.buyer.pk, public_id, 1)
+        version = self.sync().json()["version"]
+
+        with self.assertNumQueries(1):
+            self.assertEqual(cart.move_to_cart(self.buyer.pk, public_id, 2), 3)
+        self.assertEqual(cart.move_to_cart(self.buyer.pk, public_id, 2), 0)
+        delta = self.sync(version).json()
+        self.assertEqual([item["quantity"] for item in delta["cart"]], [3])
+        self.assertEqual(delta["removed"], {"cart": [], "wishlist": [public_id]})
+        self.assertEqual(delta["version"], version + 1)
+
+        response = self.client.post("/api/transfer-to-wishlist/", {"product_id": public_id, "quantity": 1}, format="json")
+        self.assertEqual(response.json()["message"], "Item transferred from cart to wishlist")
+        self.assertFalse(CartItem.objects.exists())
+        response = self.client.post("/api/transfer-to-wishlist/", {"product_id": public_id, "quantity": 1}, format="json")
+        self.assertEqual((response.status_code, response.json()["error"]), (404, "Item not in cart"))
+        response = self.client.post("/api/transfer-to-cart/", {"product_id": "PRD-missing", "quantity": 1}, format="json")
+        self.assertEqual((response.status_code, response.json()["error"]), (404, "Product not found"))
+        response = self.client.post("/api/transfer-to-cart/", {"product_id": public_id, "quantity": 1}, format="json")
+        self.assertEqual(response.json()["cart_quantity"], 1)
+
+    def test_unknown_or_bad_versions(self):
+        cart.add_to_cart(self.buyer.pk, self.products[0].public_product_id, 1)
+        self.assertTrue(self.sync(99).json()["full"])
+        self.assertEqual(self.sync("abc").status_code, 400)
+
+
+class CreateOrderTests(TestCase):
+    def setUp(self):
+        seller = User.objects.create_user(username="seller", password="pass")
+        self.buyer = User.objects.create_user(username="buyer", password="pass")
+        self.products = make_products(seller, 6)
+        Inventory.objects.bulk_create(Inventory(product=p, stock_quantity=5) for p in self.products)
+        self.client = APIClient()
+        self.client.force_authenticate(self.buyer)
+
+    def create_order(self, products):
+        return self.client.post("/api/create-order/", {
+            "items": [{"product_id": p.public_product_id, "quantity": 1} for p in products],
+            "shipping_address": "addr", "phone_number": "123",
+        }, format="json")
+
+    def test_query_count_does_not_grow_with_items(self):
+        counts = []
+        with mock.patch("ecommerce.views_payment.razorpay_client") as gateway:
+            for size in (2, 6):
+                gateway.order.create.return_value = {"id": f"order_rzp_{size}"}
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.create_order(self.products[:size])
+                self.assertEqual(response.status_code, 201, response.content)
+                counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_gateway_is_called_outside_the_order_transaction(self):
+        depth = len(connection.atomic_blocks)
+        seen = []
+
+        def create(payload):
+            seen.append(len(connection.atomic_blocks))
+            raise ConnectionError("gateway down")
+
+        with mock.patch("ecommerce.views_payment.razorpay_client") as gateway:
+            gateway.order.create.side_effect = create
+            response = self.create_order(self.products[:2])
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(seen, [depth])
+        self.assertEqual(Order.objects.get().status, "FAILED")
+        self.assertEqual(Inventory.objects.get(product=self.products[0]).stock_quantity, 5)
+
+
+class IdempotencyKeyTests(TestCase):
+    def setUp(self):
+        idempotency.response_cache.clear()
+        seller = User.objects.create_user(username="seller", password="pass")
+        self.buyer = User.objects.create_user(username="buyer", password="pass")
+        self.product = make_products(seller, 1)[0]
+        Inventory.objects.create(product=self.product, stock_quantity=5)
+        self.client = APIClient()
+        self.client.force_authenticate(self.buyer)
+        self.body = {
+            "items": [{"product_id": self.product.public_product_id, "quantity": 1}],
+            "shipping_address": "addr", "phone_number": "123",
+        }
+
+    def create_order(self, body, key="key-1"):
+        return self.client.post("/api/create-order/", body, format="json", HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_the_first_response(self):
+        with mock.patch("ecommerce.views_payment.razorpay_client") as gateway:
+            gateway.order.create.return_value = {"id": "order_rzp_1"}
+            first = self.create_order(self.body)
+            idempotency.response_cache.clear()
+            retry = self.create_order(self.body)
+            cached = self.create_order(self.body)
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual((retry.status_code, retry.json()), (201, first.json()))
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(cached.json(), first.json())
+        self.assertEqual(gateway.order.create.call_count, 1)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_key_reused_with_another_body_is_rejected(self):
+        with mock.patch("ecommerce.views_payment.razorpay_client") as gateway:
+            gateway.order.create.return_value = {"id": "order_rzp_1"}
+            self.create_order(self.body)
+            response = self.create_order({**self.body, "phone_number": "456"})
+        self.assertEqual(response.status_code, 422)
+
+    def test_server_errors_free_the_key(self):
+        with mock.patch("ecommerce.views_payment.razorpay_client") as gateway:
+            gateway.order.create.side_effect = [ConnectionError("down"), {"id": "order_rzp_2"}]
+            self.assertEqual(self.create_order(self.body).status_code, 500)
+            self.assertEqual(self.create_order(self.body).status_code, 201)
+        self.assertEqual(Order.objects.filter(status="PENDING").count(), 1)
+
+    def test_retry_takes_over_a_key_whose_lease_lapsed(self):
+        with mock.patch("ecommerce.views_payment.razorpay_client") as gateway:
+            gateway.order.create.side_effect = [{"id": "order_rzp_1"}, {"id": "order_rzp_2"}]
+            self.create_order(self.body)
+            # as if the worker died after claiming the key
+            records = IdempotencyRecord.objects.all()
+            records.update(response_status=None, response_body=None, locked_until=timezone.now() + timedelta(seconds=30))
+            idempotency.response_cache.clear()
+            self.assertEqual(self.create_order(self.body).status_code, 409)
+            records.update(locked_until=timezone.now() - timedelta(seconds=1))
+            retry = self.create_order(self.body)
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(gateway.order.create.call_count, 2)
+        record = records.get()
+        self.assertEqual((record.response_status, record.locked_until), (201, None))
+
+
+class WebhookInboxTests(TestCase):
+    def setUp(self):
+        seller = User.objects.create_user(username="seller", password="pass")
+        self.buyer = User.objects.create_user(username="buyer", password="pass")
+        product = make_products(seller, 1)[0]
+        Inventory.objects.create(product=product, stock_quantity=3)
+        self.order = Order.objects.create(
+            user=self.buyer, total_amount=Decimal("10.00"), shipping_address="addr",
+            phone_number="123", razorpay_order_id="order_rzp_1",
+        )
+        OrderItem.objects.create(order=self.order, product=product, quantity=1, price_at_purchase=Decimal("10.00"))
+        inventory.reserve_stock(self.order, {product.pk: 1})
+
+    def deliver(self, event_id, order_id="order_rzp_1"):
+        body = {
+            "event": "order.paid",
+            "payload": {"order": {"entity": {"id": order_id}}, "payment": {"entity": {"id": "pay_1"}}},
+        }
+        with mock.patch("ecommerce.views_payment.razorpay_client"):
+            return APIClient().post(
+                "/webhook/razorpay/", body, format="json",
+                HTTP_X_RAZORPAY_SIGNATURE="sig", HTTP_X_RAZORPAY_EVENT_ID=event_id,
+            )
+
+    def test_redelivery_is_stored_once_and_applied_by_the_worker(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.deliver("evt_1").status_code, 200)
+        self.assertEqual(self.deliver("evt_1").status_code, 200)
+        self.assertEqual(WebhookEvent.objects.count(), 1)
+        self.assertEqual(Order.objects.get(pk=self.order.pk).status, "PENDING")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(webhooks.process_batch(), 1)
+        self.assertEqual(Order.objects.get(pk=self.order.pk).status, "VERIFIED")
+        self.assertEqual(WebhookEvent.objects.get().status, "PROCESSED")
+        self.assertEqual(webhooks.process_batch(), 0)
+
+    def test_bad_signature_is_not_stored(self):
+        with mock.patch("ecommerce.views_payment.razorpay_client") as gateway:
+            gateway.utility.verify_webhook_signature.side_effect = ValueError("bad signature")
+            response = APIClient().post("/webhook/razorpay/", {"event": "order.paid"}, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(WebhookEvent.objects.exists())
+
+    def test_broken_event_backs_off_without_blocking_the_batch(self):
+        WebhookEvent.objects.create(event_id="evt_bad", event="order.paid", payload={"payload": {}})
+        self.deliver("evt_good")
+        self.assertEqual(webhooks.process_batch(max_attempts=2), 2)
+        bad = WebhookEvent.objects.get(event_id="evt_bad")
+        self.assertEqual((bad.status, bad.attempts), ("PENDING", 1))
+        self.assertIn("KeyError", bad.last_error)
+        self.assertGreater(bad.available_at, timezone.now())
+        self.assertEqual(WebhookEvent.objects.get(event_id="evt_good").status, "PROCESSED")
+
+        WebhookEvent.objects.filter(pk=bad.pk).update(available_at=timezone.now())
+        webhooks.process_batch(max_attempts=2)
+        self.assertEqual(WebhookEvent.objects.get(pk=bad.pk).status, "FAILED")
+
+
+class OrderEmailRenderingTests(TestCase):
+    def setUp(self):
+        seller = User.objects.create_user(username="seller", password="pass")
+        self.products = make_products(seller, 3)
+        self.orders = []
+        for i in range(4):
+            buyer = User.objects.create_user(username=f"buyer{i}", email=f"buyer{i}@example.com", password="pass")
+            order = Order.objects.create(
+                user=buyer, total_amount=Decimal("60.00"), shipping_address="addr", phone_number="123",
+            )
+            OrderItem.objects.bulk_create(
+                OrderItem(order=order, product=p, quantity=2, price_at_purchase=Decimal("10.005")) for p in self.products
+            )
+            self.orders.append(order)
+
+    def test_batch_renders_in_fixed_queries(self):
+        orders = list(Order.objects.filter(pk__in=[o.pk for o in self.orders]))
+        with self.assertNumQueries(2):
+            rendered = mailers.render_order_completed_batch(orders)
+        self.assertEqual(len(rendered), 4)
+        subject, text_body, html_body = rendered[0]
+        self.assertEqual(subject, f"Order {orders[0].public_order_id} completed")
+        self.assertIn("- Product 2 x 2 @ ₹10.01", text_body)
+        self.assertIn("Total: ₹60.00", text_body)
+        self.assertIn("Product 2", html_body)
+
+    def test_email_goes_to_the_buyer_with_an_html_part(self):
+        message = mailers.build_order_completed_email(Order.objects.get(pk=self.orders[1].pk))
+        self.assertEqual(message.to, ["buyer1@example.com"])
+        self.assertEqual(message.alternatives[0][1], "text/html")
+
+
+class SalesRollupTests(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user(username="seller", password="pass")
+        self.seller.groups.add(Group.objects.create(name="seller"))
+        self.buyer = User.objects.create_user(username="buyer", password="pass")
+        self.lamp, self.desk = make_products(self.seller, 2)
+        self.today = timezone.localdate()
+        self.client = APIClient()
+        self.client.force_authenticate(self.seller)
+
+    def paid_order(self, days_ago, lines):
+        order = Order.objects.create(
+            user=self.buyer, total_amount=Decimal("0.00"), shipping_address="addr", phone_number="123",
+        )
+        Order.objects.filter(pk=order.pk).update(created_at=timezone.now() - timedelta(days=days_ago))
+        order.refresh_from_db()
+        for product, quantity in lines:
+            OrderItem.objects.create(order=order, product=product, quantity=quantity, price_at_purchase=product.price)
+        order.status = "PAID"
+        order.save()
+        return order
+
+    def analytics(self, **params):
+        response = self.client.get("/api/seller/analytics/", params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_series_is_zero_filled_and_follows_refunds(self):
+        self.paid_order(2, [(self.lamp, 1), (self.desk, 2)])
+        cancelled = self.paid_order(0, [(self.lamp, 4)])
+        data = self.analytics(**{"from": str(self.today - timedelta(days=2))})
+        self.assertEqual([point["units"] for point in data["series"]], [3, 0, 4])
+        self.assertEqual(data["totals"], {"units": 7, "revenue": 70.0})
+
+        cancelled.status = "CANCELLED"
+        cancelled.save()
+        data = self.analytics(**{"from": str(self.today - timedelta(days=2))})
+        self.assertEqual([point["units"] for point in data["series"]], [3, 0, 0])
+        self.assertEqual(SellerStats.objects.get(seller=self.seller).revenue, Decimal("30.00"))
+        self.assertEqual(self.client.get("/api/seller/summary/").json()["revenue"], 30.0)
+
+    def test_month_granularity_and_bad_ranges(self):
+        self.paid_order(0, [(self.lamp, 2)])
+        data = self.analytics(granularity="month", **{"from": str(self.today), "to": str(self.today)})
+        self.assertEqual(data["series"], [{"period": str(self.today.replace(day=1)), "units": 2, "revenue": 20.0}])
+        self.assertEqual(self.client.get("/api/seller/analytics/", {"granularity": "year"}).status_code, 400)
+        self.assertEqual(self.client.get("/api/seller/analytics/", {"from": "2024-02-01", "to": "2024-01-01"}).status_code, 400)
+
+    def test_refund_after_product_deletion_leaves_no_revenue(self):
+        order = Order.objects.create(
+            user=self.buyer, total_amount=Decimal("20.00"), shipping_address="addr", phone_number="123",
+        )
+        OrderItem.objects.create(order=order, product=self.lamp, quantity=2, price_at_purchase=self.lamp.price)
+        link_order_sellers(order)
+        self.assertEqual(OrderItem.objects.get(order=order).seller_id, self.seller.pk)
+        order.status = "PAID"
+        order.save()
+        self.assertEqual(SellerStats.objects.get(seller=self.seller).revenue, Decimal("20.00"))
+
+        Product.objects.filter(pk=self.lamp.pk).delete()  # the queryset delete leaves the stored image alone
+        order.status = "CANCELLED"
+        order.save()
+        self.assertEqual(SellerStats.objects.get(seller=self.seller).revenue, Decimal("0.00"))
+
+        call_command("rebuild_seller_stats", stdout=io.StringIO())
+        stats = SellerStats.objects.get(seller=self.seller)
+        self.assertEqual((stats.orders_count, stats.revenue), (1, Decimal("0.00")))
+
+    def test_backfill_rebuilds_the_rollups(self):
+        self.paid_order(1, [(self.lamp, 1)])
+        self.paid_order(0, [(self.desk, 3)])
+        expected = sorted(SalesRollup.objects.values_list("product_id", "day", "units", "revenue"))
+        SalesRollup.objects.all().delete()
+        call_command("backfill_sales_rollups", stdout=io.StringIO())
+        self.assertEqual(sorted(SalesRollup.objects.values_list("product_id", "day", "units", "revenue")), expected)
+
+
+def seller_client(username):
+    seller = User.objects.create_user(username=username, password="pass")
+    seller.groups.add(Group.objects.get_or_create(name="seller")[0])
+    client = APIClient()
+    client.force_authenticate(seller)
+    return seller, client
+
+
+class SellerOrdersTests(TestCase):
+    def setUp(self):
+        self.seller, self.client = seller_client("seller")
+        self.other, self.other_client = seller_client("other")
+        buyer = User.objects.create_user(username="buyer", password="pass")
+        mine = make_products(self.seller, 2)
+        theirs = make_products(self.other, 1)
+        self.orders = []
+        for _ in range(3):
+            order = Order.objects.create(
+                user=buyer, total_amount=Decimal("30.00"), shipping_address="addr", phone_number="123",
+            )
+            OrderItem.objects.bulk_create(
+                OrderItem(order=order, product=p, quantity=1, price_at_purchase=p.price) for p in mine + theirs
+            )
+            link_order_sellers(order)
+            self.orders.append(order)
+
+    def test_each_seller_sees_each_order_once_with_own_lines(self):
+        self.assertEqual(OrderSeller.objects.count(), 6)
+        # role from the groups (no token here), the links with their orders, this seller's lines
+        with self.assertNumQueries(3):
+            data = self.client.get("/api/seller/orders/", {"pagination": "cursor", "skip_count": 1}).json()
+        self.assertEqual([o["id"] for o in data["results"]], [o.pk for o in reversed(self.orders)])
+        self.assertEqual({len(o["items"]) for o in data["results"]}, {2})
+        other = self.other_client.get("/api/seller/orders/").json()
+        self.assertEqual(other["count"], 3)
+        self.assertEqual({len(o["items"]) for o in other["results"]}, {1})
+
+    def test_status_changes_reach_the_links(self):
+        order = self.orders[0]
+        response = self.client.patch(f"/api/seller/orders/{order.pk}/", {"status": "SHIPPED"}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(OrderSeller.objects.filter(order=order).values_list("status", flat=True)), {"SHIPPED"})
+
+        stranger, stranger_client = seller_client("stranger")
+        response = stranger_client.patch(f"/api/seller/orders/{order.pk}/", {"status": "DELIVERED"}, format="json")
+        self.assertEqual(response.status_code, 404)
+
+
+class SellerOrdersExportTests(TestCase):
+    def setUp(self):
+        self.seller, self.client = seller_client("seller")
+        other = User.objects.create_user(username="other", password="pass")
+        self.buyer = User.objects.create_user(username="buyer", password="pass")
+        self.lamp = make_products(self.seller, 1, price=Decimal("12.50"))[0]
+        self.foreign = make_products(other, 1)[0]
+        self.paid = self.order([(self.lamp, 2), (self.foreign, 1)], "PAID")
+        self.pending = self.order([(self.lamp, 1)], "PENDING")
+        self.old = self.order([(self.lamp, 1)], "PAID", days_ago=30)
+
+    def order(self, lines, status, days_ago=0):
+        order = Order.objects.create(
+            user=self.buyer, total_amount=Decimal("0.00"), shipping_address="addr", phone_number="123",
+            status=status,
+        )
+        Order.objects.filter(pk=order.pk).update(created_at=timezone.now() - timedelta(days=days_ago))
+        order.refresh_from_db()
+        OrderItem.objects.bulk_create(
+            OrderItem(order=order, product=p, quantity=q, price_at_purchase=p.price) for p, q in lines
+        )
+        link_order_sellers(order)
+        return order
+
+    def export(self, **params):
+        response = self.client.get("/api/seller/orders/export/", params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return list(csv.DictReader(io.StringIO(b"".join(response.streaming_content).decode())))
+
+    def test_streams_only_this_sellers_lines(self):
+        rows = self.export()
+        self.assertEqual(
+            [row["order_id"] for row in rows],
+            [self.old.public_order_id, self.paid.public_order_id, self.pending.public_order_id],
+        )
+        self.assertEqual({row["product_id"] for row in rows}, {self.lamp.public_product_id})
+        self.assertEqual((rows[1]["quantity"], rows[1]["line_total"]), ("2", "25.00"))
+
+    def test_date_and_status_filters(self):
+        today = str(timezone.localdate())
+        rows = self.export(**{"from": today, "status": "paid"})
+        self.assertEqual([row["order_id"] for row in rows], [self.paid.public_order_id])
+        response = self.client.get("/api/seller/orders/export/", {"status": "LOST"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_formula_cells_are_escaped(self):
+        Order.objects.filter(pk=self.paid.pk).update(shipping_address='=HYPERLINK("http://x")')
+        Product.objects.filter(pk=self.lamp.pk).update(title="@SUM(A1)")
+        row = self.export(status="PAID")[-1]
+        self.assertEqual(row["shipping_address"], '\'=HYPERLINK("http://x")')
+        self.assertEqual(row["title"], "'@SUM(A1)")
+        self.assertEqual(row["customer"], "buyer")
+
+
+class SellerBulkUpdateTests(TestCase):
+    def setUp(self):
+        self.seller, self.client = seller_client("seller")
+        other = User.objects.create_user(username="other", password="pass")
+        self.plain, self.sharded, self.new = make_products(self.seller, 3)
+        self.foreign = make_products(other, 1)[0]
+        Inventory.objects.create(product=self.plain, stock_quantity=1)
+        Inventory.objects.create(product=self.foreign, stock_quantity=7)
+        inventory.set_stock(self.sharded, 4)
+        inventory.reshard(self.sharded, 2)
+
+    def post(self, items):
+        return self.client.post("/api/seller/products/bulk-update/", {"items": items}, format="json")
+
+    def stock(self, product):
+        stock = Inventory.objects.get(product=product)
+        if stock.shard_count:
+            return sum(stock.shards.values_list("quantity", flat=True))
+        return stock.stock_quantity
+
+    def test_updates_own_products_and_leaves_other_sellers_alone(self):
+        response = self.post([
+            {"public_product_id": self.plain.public_product_id, "stock": 40, "price": "19.00"},
+            {"public_product_id": self.sharded.public_product_id, "stock": 9},
+            {"public_product_id": self.new.public_product_id, "stock": 3},
+            {"public_product_id": self.foreign.public_product_id, "stock": 0, "price": "1.00"},
+            {"public_product_id": "PRD-missing", "price": "2.00"},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["updated"], 3)
+        self.assertEqual(
+            response.json()["not_found"], sorted(["PRD-missing", self.foreign.public_product_id])
+        )
+        self.assertEqual([self.stock(p) for p in (self.plain, self.sharded, self.new)], [40, 9, 3])
+        self.assertEqual(Product.objects.get(pk=self.plain.pk).price, Decimal("19.00"))
+
+        self.foreign.refresh_from_db()
+        self.assertEqual((self.foreign.price, self.stock(self.foreign)), (Decimal("10.00"), 7))
+
+    def test_price_only_items_keep_their_stock(self):
+        self.post([{"public_product_id": self.plain.public_product_id, "price": "5.00"}])
+        self.assertEqual(self.stock(self.plain), 1)
+        response = self.post([{"public_product_id": self.plain.public_product_id}])
+        self.assertEqual(response.status_code, 400)
@@ -1,7 +1,7 @@
 from django.urls import path
 from rest_framework_simplejwt.views import TokenRefreshView
 from .import views
-from .views import ContactMessageCreateView, SellerOrderUpdateView, SellerOrdersView, SellerProductDetailView, SellerProductListCreateView, SellerSummaryView 
+from .views import ContactMessageCreateView, SellerOrderUpdateView, SellerOrdersView, SellerProductDetailView, SellerProductListCreateView, SellerSummaryView, SellerAnalyticsView, SellerProductImportView, SellerOrdersExportView, SellerProductBulkUpdateView
 from .import views_payment as views2
 
 urlpatterns = [
@@ -13,10 +13,13 @@ urlpatterns = [
     path('api/logout/', views.logout),
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path("api/product/<str:public_product_id>/",views.product_detail,name="product_detail"),
+    path("api/product/<str:public_product_id>/reviews/", views.product_reviews, name="product_reviews"),
     path("api/apply-offer/", views.apply_offer, name="apply_offer"),
 
     path('api/sync-cart-wishlist/', views.sync_cart_wishlist, name='sync_cart_wishlist'),
     path('api/cart/', views.manage_cart, name='manage_cart'),
+    path('api/cart/batch/', views.cart_batch, name='cart_batch'),
+    path('api/cart/quote/', views.cart_quote, name='cart_quote'),
     path('api/wishlist/', views.manage_wishlist, name='manage_wishlist'),
     path('api/transfer-to-cart/', views.transfer_to_cart, name='transfer_to_cart'),
     path('api/user-orders/', views.user_orders, name='user_orders'),
@@ -32,9 +35,13 @@ urlpatterns = [
     path("api/reviews/create/", views.create_review, name="create_review"),
     # seller apis 
     path("api/seller/summary/", SellerSummaryView.as_view()),
+    path("api/seller/analytics/", SellerAnalyticsView.as_view()),
     path("api/seller/products/", SellerProductListCreateView.as_view()),
+    path("api/seller/products/import/", SellerProductImportView.as_view()),
+    path("api/seller/products/bulk-update/", SellerProductBulkUpdateView.as_view()),
     path("api/seller/products/<int:pk>/", SellerProductDetailView.as_view()),
     path("api/seller/orders/", SellerOrdersView.as_view()),
+    path("api/seller/orders/export/", SellerOrdersExportView.as_view()),
     path("api/seller/orders/<int:pk>/", SellerOrderUpdateView.as_view()),
 
 ]
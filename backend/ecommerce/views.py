@@ -1,24 +1,35 @@
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.contrib.auth.models import Group
-from .models import Order
-from .serializers import OrderSerializer, SellerOrderSerializer, SellerProductSerializer
-from .models import Product, Offer, CartItem, Wishlist, ContactMessage, Review
+from .models import Order, OrderItem
+from .serializers import OrderSerializer, SellerOrderSerializer, SellerProductSerializer, SellerBulkUpdateSerializer
+from .models import Product, Offer, CartItem, Wishlist, ContactMessage, Review, CartVersion, CartChange, SellerStats, \
+    SalesRollup, OrderSeller
 from .decorators import allowed_users
-from .serializers import ProductListSerializer, RegisterSerializer, LoginSerializer, ProductDetailSerializer, \
+from .roles import HasRole
+from . import cart, inventory, pricing, product_import
+from .search import search_products
+from .pagination import ProductPagination, KeysetPagination, OrderPagination, select_paginator
+from .cache import catalog_version, product_list_cache_key, product_list_url, rebase_page_links, \
+    get_cached_product_list, set_cached_product_list
+from .serializers import RegisterSerializer, LoginSerializer, ProductDetailSerializer, \
     OfferApplySerializer, CartItemSerializer, WishlistSerializer, AddToCartSerializer, UpdateCartSerializer, \
     AddToWishlistSerializer, RemoveFromWishlistSerializer, RemoveFromCartSerializer, TransferToCartSerializer, \
-    TransferToWishlistSerializer,ContactMessageSerializer, UserProfileSerializer
-from rest_framework.pagination import PageNumberPagination
+    TransferToWishlistSerializer,ContactMessageSerializer, UserProfileSerializer, ProductListValuesSerializer, \
+    ReviewSerializer, CartBatchSerializer
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import BasePermission
 from rest_framework.parsers import MultiPartParser, FormParser
 from django.db import models
+from django.db.models import Prefetch
+from django.db.models.functions import NullIf, TruncMonth, TruncWeek
+from django.utils import timezone
+from datetime import date, datetime, time, timedelta
+import csv
 
 # Create your views here.
 def home(request):
@@ -32,20 +43,21 @@ def seller_dashboard(request):
     return HttpResponse("only seller logged can see this")
 
 
-class ProductPagination(PageNumberPagination):
-    page_size = 9
-    page_size_query_param = "page_size"
-    max_page_size = 30
-
-
 @api_view(["GET"])
 def product_list(request):
-    products = Product.objects.filter(is_active=True).order_by("-created_at")
+    cache_key = product_list_cache_key(request)
+    version = catalog_version()
+    cached = get_cached_product_list(cache_key, version)
+    if cached is not None:
+        return Response(cached)
+
+    products = Product.objects.filter(is_active=True)
 
     min_price = request.GET.get("min_price")
     max_price = request.GET.get("max_price")
     category = request.GET.get("category")
     search = request.GET.get("search")
+    sort = request.GET.get("sort")
     if min_price:
         products = products.filter(price__gte=min_price)
     if max_price:
@@ -53,20 +65,37 @@ def product_list(request):
     if category:
         products = products.filter(category__iexact=category)
     if search:
-        products = products.filter(title__icontains=search)
+        products = search_products(products, search)
 
-    paginator = ProductPagination()
+    # relevance only makes sense when there is a search term to rank against,
+    # and neither rank nor rating is a keyset column, so both page by number
+    if sort == "relevance" and search:
+        products = products.order_by("-rank", "-created_at")
+        paginator = ProductPagination()
+    elif sort == "rating":
+        average = models.F("rating_sum") * 1.0 / NullIf("rating_count", 0)
+        products = products.order_by(
+            average.desc(nulls_last=True), "-rating_count", "-created_at"
+        )
+        paginator = ProductPagination()
+    else:
+        products = products.order_by("-created_at", "-id")
+        paginator = select_paginator(request)
+    products = ProductListValuesSerializer.get_queryset(products)
     paginated_products = paginator.paginate_queryset(products, request)
 
-    serializer = ProductListSerializer(
+    serializer = ProductListValuesSerializer(
         paginated_products,
-        many=True,
         context={"request": request}
     )
 
-    return paginator.get_paginated_response({
+    response = paginator.get_paginated_response({
         "products": serializer.data
     })
+    # the links must not carry ignored params such as ?utm= to other clients
+    rebase_page_links(response.data, product_list_url(request))
+    set_cached_product_list(cache_key, version, response.data)
+    return response
 
 @api_view(["POST"])
 def register(request):
@@ -97,7 +126,7 @@ def logout(request):
 @api_view(["GET"])
 def product_detail(request, public_product_id):
     product = get_object_or_404(
-        Product,
+        Product.objects.select_related("seller", "inventory"),
         public_product_id=public_product_id,
         is_active=True
     )
@@ -110,6 +139,36 @@ def product_detail(request, public_product_id):
     return Response(serializer.data)
 
 
+REVIEW_ORDERINGS = {
+    "newest": ("-created_at", "-id"),
+    "highest": ("-rating", "-created_at", "-id"),
+    "lowest": ("rating", "-created_at", "-id"),
+}
+
+
+@api_view(["GET"])
+def product_reviews(request, public_product_id):
+    """
+    Cursor paginated reviews of one product
+    Query: ?ordering=newest|highest|lowest&page_size=10&cursor=...
+    """
+    ordering = request.GET.get("ordering", "newest")
+    if ordering not in REVIEW_ORDERINGS:
+        return Response({"error": "Invalid ordering"}, status=400)
+
+    product = get_object_or_404(
+        Product.objects.only("id"),
+        public_product_id=public_product_id,
+        is_active=True
+    )
+    reviews = Review.objects.filter(product=product).select_related("user")
+
+    paginator = KeysetPagination(ordering=REVIEW_ORDERINGS[ordering])
+    page = paginator.paginate_queryset(reviews, request)
+    serializer = ReviewSerializer(page, many=True)
+    return paginator.get_paginated_response(serializer.data)
+
+
 @api_view(["POST"])
 def apply_offer(request):
     """
@@ -118,26 +177,81 @@ def apply_offer(request):
         "coupon": "FLAT500",
         "cart_total": 600
     }
+    cart_total may be left out by signed-in users to price their cart
     """
-    serializer = OfferApplySerializer(data=request.data)
+    serializer = OfferApplySerializer(data=request.data, context={"request": request})
     serializer.is_valid(raise_exception=True)
     return Response(serializer.validated_data)
 
 
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def cart_quote(request):
+    """
+    Server side price of the user's cart
+    Query: ?coupon=FLAT500&gift_wrap=1
+    """
+    gift_wrap = request.GET.get("gift_wrap") in ("1", "true")
+    try:
+        quote = pricing.quote_cart(request.user, request.GET.get("coupon"), gift_wrap)
+    except pricing.PricingError as e:
+        return Response({"error": str(e)}, status=400)
+    return Response(pricing.quote_payload(quote))
+
+
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
 def sync_cart_wishlist(request):
+    """
+    Full cart and wishlist, or with ?since=<version> only the rows changed
+    after that version (304 when nothing changed)
+    """
     user = request.user
-    cart_items = CartItem.objects.filter(user=user)
-    wishlist_items = Wishlist.objects.filter(user=user)
+    version = CartVersion.objects.filter(user=user).values_list("version", flat=True).first() or 0
+
+    since = request.GET.get("since")
+    try:
+        since = int(since) if since is not None else None
+    except ValueError:
+        return Response({"error": "Invalid since"}, status=400)
+
+    # a client ahead of the server (e.g. restored database) gets a full resync
+    if since is not None and since <= version:
+        if since == version:
+            return Response(status=status.HTTP_304_NOT_MODIFIED)
 
+        changes = CartChange.objects.filter(user=user, version__gt=since).values_list(
+            "kind", "product_id", "removed", "public_product_id"
+        )
+        changed = {"cart": [], "wishlist": []}
+        removed = {"cart": [], "wishlist": []}
+        for kind, product_id, is_removed, public_product_id in changes:
+            if is_removed:
+                removed[kind].append(public_product_id)
+            else:
+                changed[kind].append(product_id)
+
+        cart_items = CartItem.objects.filter(user=user, product_id__in=changed["cart"])
+        wishlist_items = Wishlist.objects.filter(user=user, product_id__in=changed["wishlist"])
+    else:
+        removed = None
+        cart_items = CartItem.objects.filter(user=user)
+        wishlist_items = Wishlist.objects.filter(user=user)
+
+    cart_items = cart_items.select_related("product__seller")
+    wishlist_items = wishlist_items.select_related("product__seller")
     cart_serializer = CartItemSerializer(cart_items, many=True, context={"request": request})
     wishlist_serializer = WishlistSerializer(wishlist_items, many=True, context={"request": request})
 
-    return Response({
+    payload = {
+        "version": version,
+        "full": removed is None,
         "cart": cart_serializer.data,
-        "wishlist": wishlist_serializer.data
-    })
+        "wishlist": wishlist_serializer.data,
+    }
+    if removed is not None:
+        payload["removed"] = removed
+    return Response(payload)
 
 @api_view(["POST", "PATCH", "DELETE"])
 @permission_classes([IsAuthenticated])
@@ -151,21 +265,11 @@ def manage_cart(request):
         product_id = serializer.validated_data["product_id"]
         quantity = serializer.validated_data["quantity"]
 
-        try:
-            product = Product.objects.get(public_product_id=product_id, is_active=True)
-        except Product.DoesNotExist:
+        new_quantity = cart.add_to_cart(user.id, product_id, quantity)
+        if new_quantity is None:
             return Response({"error": "Product not found"}, status=404)
 
-        cart_item, created = CartItem.objects.get_or_create(
-            user=user,
-            product=product,
-            defaults={"quantity": quantity}
-        )
-        if not created:
-            cart_item.quantity += quantity
-            cart_item.save()
-
-        return Response({"message": "Item added to cart", "quantity": cart_item.quantity})
+        return Response({"message": "Item added to cart", "quantity": new_quantity})
 
     elif request.method == "PATCH":
         # Update cart item quantity
@@ -174,18 +278,13 @@ def manage_cart(request):
         product_id = serializer.validated_data["product_id"]
         quantity = serializer.validated_data["quantity"]
 
-        try:
-            product = Product.objects.get(public_product_id=product_id, is_active=True)
-            cart_item = CartItem.objects.get(user=user, product=product)
-        except Product.DoesNotExist:
-            return Response({"error": "Product not found"}, status=404)
-        except CartItem.DoesNotExist:
+        new_quantity = cart.set_cart_quantity(user.id, product_id, quantity)
+        if new_quantity is None:
+            if not cart.product_exists(product_id):
+                return Response({"error": "Product not found"}, status=404)
             return Response({"error": "Item not in cart"}, status=404)
 
-        cart_item.quantity = quantity
-        cart_item.save()
-
-        return Response({"message": "Cart item updated", "quantity": cart_item.quantity})
+        return Response({"message": "Cart item updated", "quantity": new_quantity})
 
     elif request.method == "DELETE":
         # Remove item from cart
@@ -193,15 +292,11 @@ def manage_cart(request):
         serializer.is_valid(raise_exception=True)
         product_id = serializer.validated_data["product_id"]
 
-        try:
-            product = Product.objects.get(public_product_id=product_id, is_active=True)
-            cart_item = CartItem.objects.get(user=user, product=product)
-        except Product.DoesNotExist:
-            return Response({"error": "Product not found"}, status=404)
-        except CartItem.DoesNotExist:
+        if not cart.remove_from_cart(user.id, product_id):
+            if not cart.product_exists(product_id):
+                return Response({"error": "Product not found"}, status=404)
             return Response({"error": "Item not in cart"}, status=404)
 
-        cart_item.delete()
         return Response({"message": "Item removed from cart"})
 
 @api_view(["POST", "DELETE"])
@@ -215,15 +310,9 @@ def manage_wishlist(request):
         serializer.is_valid(raise_exception=True)
         product_id = serializer.validated_data["product_id"]
 
-        try:
-            product = Product.objects.get(public_product_id=product_id, is_active=True)
-        except Product.DoesNotExist:
+        created = cart.add_to_wishlist(user.id, product_id)
+        if created is None:
             return Response({"error": "Product not found"}, status=404)
-
-        wishlist_item, created = Wishlist.objects.get_or_create(
-            user=user,
-            product=product
-        )
         if created:
             return Response({"message": "Item added to wishlist"})
         else:
@@ -235,17 +324,39 @@ def manage_wishlist(request):
         serializer.is_valid(raise_exception=True)
         product_id = serializer.validated_data["product_id"]
 
-        try:
-            product = Product.objects.get(public_product_id=product_id, is_active=True)
-            wishlist_item = Wishlist.objects.get(user=user, product=product)
-        except Product.DoesNotExist:
-            return Response({"error": "Product not found"}, status=404)
-        except Wishlist.DoesNotExist:
+        if not cart.remove_from_wishlist(user.id, product_id):
+            if not cart.product_exists(product_id):
+                return Response({"error": "Product not found"}, status=404)
             return Response({"error": "Item not in wishlist"}, status=404)
 
-        wishlist_item.delete()
         return Response({"message": "Item removed from wishlist"})
 
+@api_view(["POST"])
+@permission_classes([IsAuthenticated])
+def cart_batch(request):
+    """
+    Apply many cart / wishlist changes at once, e.g. merging a guest cart
+    Body:
+    {
+        "operations": [
+            {"op": "add", "product_id": "PRD-...", "quantity": 2},
+            {"op": "move_to_cart", "product_id": "PRD-...", "quantity": 1},
+            {"op": "wishlist_remove", "product_id": "PRD-..."}
+        ]
+    }
+    """
+    serializer = CartBatchSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    errors = cart.apply_batch(request.user, serializer.validated_data["operations"])
+
+    cart_items = CartItem.objects.filter(user=request.user).select_related("product__seller")
+    wishlist_items = Wishlist.objects.filter(user=request.user).select_related("product__seller")
+    return Response({
+        "cart": CartItemSerializer(cart_items, many=True, context={"request": request}).data,
+        "wishlist": WishlistSerializer(wishlist_items, many=True, context={"request": request}).data,
+        "errors": errors,
+    })
+
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
 def transfer_to_cart(request):
@@ -259,45 +370,36 @@ def transfer_to_cart(request):
     product_id = serializer.validated_data["product_id"]
     quantity = serializer.validated_data["quantity"]
 
-    try:
-        product = Product.objects.get(public_product_id=product_id, is_active=True)
-    except Product.DoesNotExist:
+    # one statement: out of the wishlist, into the cart, logged for delta sync
+    new_quantity = cart.move_to_cart(user.id, product_id, quantity)
+    if new_quantity is None:
         return Response({"error": "Product not found"}, status=404)
-
-    # Check if item is in wishlist
-    try:
-        wishlist_item = Wishlist.objects.get(user=user, product=product)
-    except Wishlist.DoesNotExist:
+    if not new_quantity:
         return Response({"error": "Item not in wishlist"}, status=404)
 
-    # Add to cart
-    cart_item, created = CartItem.objects.get_or_create(
-        user=user,
-        product=product,
-        defaults={"quantity": quantity}
-    )
-    if not created:
-        cart_item.quantity += quantity
-        cart_item.save()
-
-    # Remove from wishlist
-    wishlist_item.delete()
-
-    return Response({"message": "Item transferred from wishlist to cart", "cart_quantity": cart_item.quantity})
+    return Response({"message": "Item transferred from wishlist to cart", "cart_quantity": new_quantity})
 
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
 def user_orders(request):
     """
-    Fetch all orders for the authenticated user
+    Fetch the authenticated user's orders, newest first. All of them by
+    default; cursor paginated once the client passes ?page_size= or ?cursor=
+    Query: ?page_size=10&cursor=...&skip_count=1
     """
     user = request.user
-    orders = Order.objects.filter(user=user).order_by("-created_at")
-    serializer = OrderSerializer(orders, many=True, context={"request": request})
-    return Response({
-        "count": orders.count(),
-        "orders": serializer.data
-    })
+    orders = Order.objects.filter(user=user).prefetch_related(
+        Prefetch("items", queryset=OrderItem.objects.select_related("product__seller"))
+    )
+    params = request.query_params
+    if OrderPagination.cursor_query_param not in params and OrderPagination.page_size_query_param not in params:
+        serializer = OrderSerializer(orders.order_by("-created_at", "-id"), many=True, context={"request": request})
+        return Response({"count": len(serializer.data), "orders": serializer.data})
+
+    paginator = OrderPagination()
+    page = paginator.paginate_queryset(orders, request)
+    serializer = OrderSerializer(page, many=True, context={"request": request})
+    return paginator.get_paginated_response(serializer.data)
 
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
@@ -325,25 +427,13 @@ def transfer_to_wishlist(request):
     product_id = serializer.validated_data["product_id"]
     quantity = serializer.validated_data["quantity"]
 
-    try:
-        product = Product.objects.get(public_product_id=product_id, is_active=True)
-    except Product.DoesNotExist:
+    result = cart.move_to_wishlist(user.id, product_id)
+    if result is None:
         return Response({"error": "Product not found"}, status=404)
-
-    # Check if item is in cart
-    try:
-        cart_item = CartItem.objects.get(user=user, product=product)
-    except CartItem.DoesNotExist:
+    in_cart, moved = result
+    if not in_cart:
         return Response({"error": "Item not in cart"}, status=404)
-
-    # Add to wishlist
-    wishlist_item, created = Wishlist.objects.get_or_create(
-        user=user,
-        product=product
-    )
-    if created:
-        # Remove from cart
-        cart_item.delete()
+    if moved:
         return Response({"message": "Item transferred from cart to wishlist"})
     else:
         return Response({"message": "Item already in wishlist"})
@@ -395,31 +485,104 @@ def create_review(request):
 
     return Response(serializer.errors, status=400)
 
-class IsSeller(BasePermission):
-    def has_permission(self, request, view):
-        return (
-            request.user.is_authenticated and
-            request.user.groups.filter(name="seller").exists()
-        )
+class IsSeller(HasRole):
+    # read from the token's role claim, no group query
+    role = "seller"
+
 class SellerSummaryView(APIView):
     permission_classes = [IsSeller]
 
     def get(self, request):
-        seller = request.user
-        products_count = Product.objects.filter(seller=seller).count()
-        orders_count = Order.objects.filter(
-            items__product__seller=seller
-        ).distinct().count()
+        stats = SellerStats.objects.filter(seller=request.user).values(
+            "products_count", "orders_count", "revenue"
+        ).first() or {"products_count": 0, "orders_count": 0, "revenue": 0}
 
-        revenue = Order.objects.filter(
-            items__product__seller=seller,
-            status__in=["PAID", "DELIVERED"]
-        ).aggregate(models.Sum("total_amount"))["total_amount__sum"] or 0
+        return Response({
+            "products": stats["products_count"],
+            "orders": stats["orders_count"],
+            "revenue": stats["revenue"]
+        })
+
+ANALYTICS_GRANULARITIES = {
+    "day": lambda: models.F("day"),
+    "week": lambda: TruncWeek("day"),
+    "month": lambda: TruncMonth("day"),
+}
+ANALYTICS_MAX_DAYS = 731
+
+
+def _date_range(params, default_days):
+    """
+    Inclusive ?from=&to= dates, defaulting to the last `default_days` days.
+    Returns (start, end, error message).
+    """
+    try:
+        end = date.fromisoformat(params["to"]) if params.get("to") else timezone.localdate()
+        start = date.fromisoformat(params["from"]) if params.get("from") else end - timedelta(days=default_days - 1)
+    except ValueError:
+        return None, None, "from and to must be dates (YYYY-MM-DD)"
+    if start > end:
+        return None, None, "from must not be after to"
+    if (end - start).days >= ANALYTICS_MAX_DAYS:
+        return None, None, f"Range is limited to {ANALYTICS_MAX_DAYS} days"
+    return start, end, None
+
+
+def _analytics_periods(start, end, granularity):
+    """Every period start between start and end, so empty periods show as zero."""
+    if granularity == "week":
+        start = start - timedelta(days=start.weekday())
+    elif granularity == "month":
+        start = start.replace(day=1)
+    period = start
+    while period <= end:
+        yield period
+        if granularity == "day":
+            period += timedelta(days=1)
+        elif granularity == "week":
+            period += timedelta(weeks=1)
+        else:
+            period = (period + timedelta(days=32)).replace(day=1)
+
+
+class SellerAnalyticsView(APIView):
+    permission_classes = [IsSeller]
+
+    def get(self, request):
+        start, end, error = _date_range(request.query_params, default_days=30)
+        if error:
+            return Response({"error": error}, status=400)
+        granularity = request.query_params.get("granularity", "day")
+        if granularity not in ANALYTICS_GRANULARITIES:
+            return Response({"error": "granularity must be day, week or month"}, status=400)
+
+        # reads only the daily rollups, never the order tables
+        rows = (
+            SalesRollup.objects.filter(seller=request.user, day__gte=start, day__lte=end)
+            .annotate(period=ANALYTICS_GRANULARITIES[granularity]())
+            .values("period")
+            .annotate(units=models.Sum("units"), revenue=models.Sum("revenue"))
+            .order_by("period")
+        )
+        by_period = {row["period"]: row for row in rows}
+        series = [
+            {
+                "period": period,
+                "units": by_period.get(period, {}).get("units", 0),
+                "revenue": by_period.get(period, {}).get("revenue", 0),
+            }
+            for period in _analytics_periods(start, end, granularity)
+        ]
 
         return Response({
-            "products": products_count,
-            "orders": orders_count,
-            "revenue": revenue
+            "from": start,
+            "to": end,
+            "granularity": granularity,
+            "totals": {
+                "units": sum(point["units"] for point in series),
+                "revenue": sum(point["revenue"] for point in series),
+            },
+            "series": series,
         })
 
 class SellerProductListCreateView(APIView):
@@ -427,10 +590,10 @@ class SellerProductListCreateView(APIView):
     parser_classes = [MultiPartParser, FormParser]
 
     def get(self, request):
-        products = Product.objects.filter(seller=request.user).order_by("-created_at")
+        products = Product.objects.filter(seller=request.user).order_by("-created_at", "-id")
         
         # Pagination
-        paginator = ProductPagination()
+        paginator = select_paginator(request)
         paginated_products = paginator.paginate_queryset(products, request)
         
         serializer = SellerProductSerializer(
@@ -450,6 +613,56 @@ class SellerProductListCreateView(APIView):
             return Response(serializer.data, status=201)
         return Response(serializer.errors, status=400)
 
+class SellerProductImportView(APIView):
+    """
+    Bulk create products from a CSV or JSON lines upload (multipart "file").
+    Columns: title, price, description, category, stock, image_url.
+    """
+    permission_classes = [IsSeller]
+    parser_classes = [MultiPartParser]
+
+    def post(self, request):
+        upload = request.FILES.get("file")
+        if upload is None:
+            return Response({"error": "Upload a CSV or JSONL file as 'file'."}, status=400)
+        fmt = product_import.detect_format(upload.name, request.data.get("format"))
+        if fmt is None:
+            return Response({"error": "format must be csv or jsonl"}, status=400)
+        try:
+            batch_size = min(int(request.data.get("batch_size") or 500), 5000)
+        except ValueError:
+            return Response({"error": "batch_size must be a number"}, status=400)
+
+        importer = product_import.ProductImport(
+            request.user, batch_size=batch_size, image_pool=product_import.shared_image_pool()
+        )
+        report = importer.run(upload.file, fmt)
+        return Response(report, status=201 if report["created"] else 400)
+
+class SellerProductBulkUpdateView(APIView):
+    """
+    Set stock and/or price for many of the seller's products at once.
+    Body:
+    {
+        "items": [
+            {"public_product_id": "PRD-...", "stock": 40, "price": "199.00"},
+            {"public_product_id": "PRD-...", "stock": 0}
+        ]
+    }
+    A product listed twice takes its last entry.
+    """
+    permission_classes = [IsSeller]
+
+    def post(self, request):
+        serializer = SellerBulkUpdateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        updates = {
+            item["public_product_id"]: (item.get("stock"), item.get("price"))
+            for item in serializer.validated_data["items"]
+        }
+        updated, not_found = inventory.bulk_update_products(request.user.pk, updates)
+        return Response({"updated": len(updated), "not_found": not_found})
+
 class SellerProductDetailView(APIView):
     permission_classes = [IsSeller]
     parser_classes = [MultiPartParser, FormParser]
@@ -481,25 +694,107 @@ class SellerOrdersView(APIView):
     permission_classes = [IsSeller]
 
     def get(self, request):
-        orders = Order.objects.filter(
-            items__product__seller=request.user
-        ).distinct().order_by("-created_at")
-        
+        # walk this seller's OrderSeller rows on the (seller, created_at) index
+        links = OrderSeller.objects.filter(seller=request.user).select_related("order__user").prefetch_related(
+            Prefetch(
+                "order__items",
+                queryset=OrderItem.objects.filter(product__seller=request.user).select_related("product__seller"),
+                to_attr="seller_items",
+            )
+        ).order_by("-created_at", "-id")
+
         # Pagination
-        paginator = ProductPagination()
-        paginated_orders = paginator.paginate_queryset(orders, request)
+        paginator = select_paginator(request)
+        paginated_links = paginator.paginate_queryset(links, request)
 
-        serializer = SellerOrderSerializer(paginated_orders, many=True, context={"request": request})
+        serializer = SellerOrderSerializer(
+            [link.order for link in paginated_links], many=True, context={"request": request}
+        )
         return paginator.get_paginated_response(serializer.data)
+
+
+class Echo:
+    """File-like object whose write() hands the row back, for streaming csv.writer output."""
+
+    def write(self, value):
+        return value
+
+
+EXPORT_COLUMNS = [
+    "order_id", "created_at", "status", "customer", "shipping_address", "phone_number",
+    "product_id", "title", "quantity", "price", "line_total",
+]
+EXPORT_CHUNK_SIZE = 2000
+# cells starting with these are run as formulas by spreadsheet apps
+CSV_FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def csv_safe(value):
+    if isinstance(value, str) and value.startswith(CSV_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+class SellerOrdersExportView(APIView):
+    """
+    CSV of the seller's order lines: ?from=&to= (dates, default last 365 days)
+    and ?status=PAID,SHIPPED. Rows come from a server-side cursor and are
+    written as they are read, so the size of the range does not matter.
+    """
+    permission_classes = [IsSeller]
+
+    def get(self, request):
+        start, end, error = _date_range(request.query_params, default_days=365)
+        if error:
+            return Response({"error": error}, status=400)
+        statuses = [value for value in request.query_params.get("status", "").upper().split(",") if value]
+        valid_statuses = {choice for choice, _ in Order.STATUS_CHOICES}
+        if not set(statuses) <= valid_statuses:
+            return Response({"error": f"status must be among {', '.join(sorted(valid_statuses))}"}, status=400)
+
+        # one filter() call: every condition applies to the same OrderSeller row
+        link_filter = {
+            "order__seller_links__seller": request.user,
+            "order__seller_links__created_at__gte": timezone.make_aware(datetime.combine(start, time.min)),
+            "order__seller_links__created_at__lt": timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min)),
+        }
+        if statuses:
+            link_filter["order__seller_links__status__in"] = statuses
+        rows = (
+            OrderItem.objects.filter(product__seller=request.user, **link_filter)
+            # the link's copy of created_at, so rows come off the (seller, created_at) index in order
+            .order_by("order__seller_links__created_at", "order_id", "id")
+            .values_list(
+                "order__public_order_id", "order__created_at", "order__status", "order__user__username",
+                "order__shipping_address", "order__phone_number", "product__public_product_id",
+                "product__title", "quantity", "price_at_purchase",
+            )
+            .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+        )
+
+        writer = csv.writer(Echo())
+
+        def stream():
+            yield writer.writerow(EXPORT_COLUMNS)
+            for *fields, quantity, price in rows:
+                fields[1] = fields[1].isoformat()
+                yield writer.writerow([csv_safe(field) for field in fields] + [quantity, price, quantity * price])
+
+        response = StreamingHttpResponse(stream(), content_type="text/csv")
+        response["Content-Disposition"] = f'attachment; filename="orders-{start}-{end}.csv"'
+        return response
+
+
 class SellerOrderUpdateView(APIView):
     permission_classes = [IsSeller]
 
     def patch(self, request, pk):
-        order = get_object_or_404(
-            Order,
-            id=pk,
-            items__product__seller=request.user
+        link = get_object_or_404(
+            OrderSeller.objects.select_related("order"),
+            order_id=pk,
+            seller=request.user
         )
+        order = link.order
 
         status_value = request.data.get("status")
         allowed = ["VERIFIED", "SHIPPED", "DELIVERED"]
@@ -1,7 +1,4 @@
 import razorpay
-import json
-import threading
-from decimal import Decimal
 from django.conf import settings
 from django.db import transaction
 from django.shortcuts import get_object_or_404
@@ -13,9 +10,14 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 
-from .models import Product, Order, OrderItem, CartItem, Offer
+from .models import Order, OrderItem, OrderSeller, apply_seller_order_change, link_order_sellers
 from .serializers import OrderCreationSerializer, PaymentVerificationSerializer
-from .mailers import send_order_completed_email
+from .outbox import enqueue_order_completed
+from .cart import clear_cart
+from . import pricing
+from .idempotency import idempotent
+from . import webhooks
+from .inventory import OutOfStock, reserve_stock, release_reservations, settle_payment
 
 # Initialize Razorpay Client
 razorpay_client = razorpay.Client(auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET))
@@ -24,56 +26,37 @@ razorpay_client = razorpay.Client(auth=(settings.RAZORPAY_KEY_ID, settings.RAZOR
 class CreateRazorpayOrderView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @idempotent("create-order")
     def post(self, request, *args, **kwargs):
         serializer = OrderCreationSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         data = serializer.validated_data
 
         user = request.user
-        items_data = data['items']
         coupon_code = data.get('coupon')
         gift_wrap_requested = data.get('gift_wrap', False)
 
-        subtotal = Decimal('0.00')
-        order_items_to_prepare = []
-
-        # 1. Securely calculate subtotal based on current product prices
-        for item in items_data:
-            try:
-                product = Product.objects.get(public_product_id=item['product_id'], is_active=True)
-                item_total = product.price * item['quantity']
-                subtotal += item_total
-                order_items_to_prepare.append({
-                    'product': product,
-                    'quantity': item['quantity'],
-                    'price_at_purchase': product.price
-                })
-            except Product.DoesNotExist:
-                return Response({"error": f"Product {item['product_id']} not found."}, status=400)
-
-        # 2. Apply Coupon Logic (if provided)
-        discount = Decimal('0.00')
-        if coupon_code:
-            try:
-                offer = Offer.objects.get(coupon=coupon_code)
-                if offer.type == "PERCENT":
-                    discount = (subtotal * Decimal(offer.unit)) / Decimal(100)
-                elif offer.type == "DIRECT":
-                    # Direct discount with 50% cap as per your OfferApplySerializer logic
-                    max_allowed_discount = subtotal * Decimal("0.50")
-                    discount = min(Decimal(offer.unit), max_allowed_discount)
-
-                # Safety: discount should never exceed subtotal
-                discount = min(discount, subtotal)
-            except Offer.DoesNotExist:
-                return Response({"error": "Invalid coupon code."}, status=400)
-
-        total_final_amount = subtotal - discount
-
-        if gift_wrap_requested:
-            total_final_amount += Decimal('10.00')
-
-        # 3. Create Order in local DB and Razorpay
+        # 1. Securely price the order from current product prices
+        try:
+            if data.get('items'):
+                quote = pricing.quote_items(data['items'], coupon_code, gift_wrap_requested)
+            else:
+                # never from the quote cache: the order is charged at today's prices and coupons
+                quote = pricing.quote_cart(user, coupon_code, gift_wrap_requested, cached=False)
+        except pricing.PricingError as e:
+            return Response({"error": str(e)}, status=400)
+
+        if not quote['items']:
+            return Response({"error": "Cart is empty."}, status=400)
+
+        discount = quote['discount']
+        total_final_amount = quote['total']
+
+        quantities = {}
+        for line in quote['items']:
+            quantities[line['product']] = quantities.get(line['product'], 0) + line['quantity']
+
+        # 2. Create the order, its items and the stock hold in one short transaction
         try:
             with transaction.atomic():
                 order = Order.objects.create(
@@ -85,38 +68,57 @@ class CreateRazorpayOrderView(APIView):
                     status="PENDING",
                     payment_provider="RAZORPAY"
                 )
-
-                for item_info in order_items_to_prepare:
-                    OrderItem.objects.create(order=order, **item_info)
-
-                # Razorpay expects amount in paise
-                amount_paise = int(total_final_amount * 100)
-
-                razorpay_order = razorpay_client.order.create({
-                    'amount': amount_paise,
-                    'currency': 'INR',
-                    'receipt': order.public_order_id,
-                    'payment_capture': 1
-                })
-
-                order.razorpay_order_id = razorpay_order['id']
-                order.save()
-
+                OrderItem.objects.bulk_create([
+                    OrderItem(
+                        order=order,
+                        product_id=line['product'],
+                        quantity=line['quantity'],
+                        price_at_purchase=line['price']
+                    )
+                    for line in quote['items']
+                ])
+                link_order_sellers(order)
+                apply_seller_order_change(order.pk, orders_delta=1)
+                reserve_stock(order, quantities)
+        except OutOfStock as e:
+            public_ids = {line['product']: line['product_id'] for line in quote['items']}
             return Response({
-                "razorpay_order_id": razorpay_order['id'],
-                "amount": amount_paise,
-                "currency": "INR",
-                "key_id": settings.RAZORPAY_KEY_ID,
-                "discount_applied": float(discount)
-            }, status=status.HTTP_201_CREATED)
-
+                "error": "Some items are out of stock.",
+                "products": [public_ids[pk] for pk in e.product_ids],
+            }, status=400)
+
+        # 3. Register the order with Razorpay outside the transaction, so no
+        # database connection is held open across the gateway round trip.
+        # Razorpay expects amount in paise
+        amount_paise = int(total_final_amount * 100)
+        try:
+            razorpay_order = razorpay_client.order.create({
+                'amount': amount_paise,
+                'currency': 'INR',
+                'receipt': order.public_order_id,
+                'payment_capture': 1
+            })
         except Exception as e:
+            if Order.objects.filter(pk=order.pk, status="PENDING").update(status="FAILED"):
+                OrderSeller.objects.filter(order_id=order.pk).update(status="FAILED")
+            release_reservations([order.pk])
             return Response({"error": f"Order creation failed: {str(e)}"}, status=500)
 
+        Order.objects.filter(pk=order.pk).update(razorpay_order_id=razorpay_order['id'])
+
+        return Response({
+            "razorpay_order_id": razorpay_order['id'],
+            "amount": amount_paise,
+            "currency": "INR",
+            "key_id": settings.RAZORPAY_KEY_ID,
+            "discount_applied": float(discount)
+        }, status=status.HTTP_201_CREATED)
+
 
 class VerifyRazorpayPaymentView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @idempotent("verify-payment")
     def post(self, request, *args, **kwargs):
         serializer = PaymentVerificationSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -126,19 +128,24 @@ class VerifyRazorpayPaymentView(APIView):
             razorpay_client.utility.verify_payment_signature(data)
 
             # Update order status
-            order = Order.objects.get(razorpay_order_id=data['razorpay_order_id'], user=request.user)
-            if order.status != "VERIFIED":
-                order.status = "PAID"
-            order.razorpay_payment_id = data['razorpay_payment_id']
-            order.razorpay_signature = data['razorpay_signature']
-            order.save()
-
-            # Clean up the cart after successful purchase
-            CartItem.objects.filter(user=request.user).delete()
-
-            # Send Email using multiThreading
-            email_thread = threading.Thread(target=send_order_completed_email, args=(order,))
-            email_thread.start()
+            order_id = Order.objects.values_list("pk", flat=True).get(
+                razorpay_order_id=data['razorpay_order_id'], user=request.user
+            )
+            with transaction.atomic():
+                order = settle_payment(
+                    order_id, "PAID",
+                    razorpay_payment_id=data['razorpay_payment_id'],
+                    razorpay_signature=data['razorpay_signature'],
+                )
+                if order.status == "REFUND_DUE":
+                    return Response({
+                        "error": "Payment received, but the items sold out after the order expired. "
+                                 "The payment will be refunded."
+                    }, status=409)
+                # Clean up the cart after successful purchase
+                clear_cart(request.user.id)
+                # confirmation goes out through the outbox once this commits
+                enqueue_order_completed([order])
 
             return Response({"status": "success", "message": "Payment verified and order confirmed."})
 
@@ -161,30 +168,8 @@ class RazorpayWebhookView(APIView):
             razorpay_client.utility.verify_webhook_signature(
                 payload.decode('utf-8'), signature, secret
             )
-            data = json.loads(payload)
-            event = data.get('event')
-
-            if event == "order.paid":
-                order_id = data['payload']['order']['entity']['id']
-                payment_id = data['payload']['payment']['entity']['id']
-
-                try:
-                    order = Order.objects.get(razorpay_order_id=order_id)
-                    order.status = "VERIFIED"
-                    order.razorpay_payment_id = payment_id
-                    order.save()
-
-                    # Clean up the cart after successful backend verification
-                    CartItem.objects.filter(user=order.user).delete()
-
-                    try:
-                        send_order_completed_email(order)
-                    except Exception as e:
-                        print(f"Webhook Email Failed: {e}")
-
-                    print(f"Webhook Success: Order {order_id} verified.")
-                except Order.DoesNotExist:
-                    pass
+            # stored and acknowledged here, applied by the process_webhooks worker
+            webhooks.record_event(webhooks.event_id_for(request, payload), payload)
 
             return Response(status=status.HTTP_200_OK)
         except Exception as e: